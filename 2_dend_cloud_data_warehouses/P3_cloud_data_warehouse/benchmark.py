@@ -0,0 +1,448 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+import sql_queries
+import create_tables
+import etl
+from benchmark_results import compare_results, measure, write_results
+from connection import get_pool
+from generate_data import generate, generator_options
+from manifest import LocalBackend
+from preprocess import preprocess_table, staging_columns
+from scheduler import target_table
+from settings import load_settings
+
+# Synthetic staging rows generated inside PostgreSQL.
+# Every user, song and artist appears several times, as in the real logs, and
+# the (artist, song) pairs of the events match the songs.
+# `%%` is a literal modulo, the other placeholders are the scale sizes.
+staging_events_fill = ("""
+    INSERT INTO staging_events (
+        artist, firstName, lastName, gender, level, page, sessionId, song, ts, userId
+    )
+    SELECT
+        'Artist ' || ((i %% %(songs)s) %% %(artists)s),
+        'First ' || (i %% %(users)s),
+        'Last ' || (i %% %(users)s),
+        CASE WHEN i %% 2 = 0 THEN 'M' ELSE 'F' END,
+        CASE WHEN i %% 3 = 0 THEN 'paid' ELSE 'free' END,
+        'NextSong',
+        i %% 1000,
+        'Song ' || (i %% %(songs)s),
+        TIMESTAMP '2018-11-01' + i * INTERVAL '1 second',
+        CAST(i %% %(users)s AS VARCHAR)
+    FROM generate_series(1, %(events)s) AS i
+""")
+
+staging_songs_fill = ("""
+    INSERT INTO staging_songs (
+        num_songs, artist_id, artist_name, song_id, title, duration, year
+    )
+    SELECT
+        1,
+        'AR' || (i %% %(artists)s),
+        'Artist ' || (i %% %(artists)s),
+        'SO' || i,
+        'Song ' || i,
+        180 + i %% 120,
+        1960 + i %% 60
+    FROM generate_series(1, %(songs)s) AS i
+""")
+
+def incomplete_forms():
+    """
+    Returns the inserts of the incomplete data compared by benchmark_keymap,
+    read from sql_queries when the benchmark runs.
+    """
+    return {
+        'md5': [sql_queries.artist_table_insert_incomplete_md5,
+                sql_queries.song_table_insert_incomplete_md5,
+                sql_queries.songplay_table_insert_incomplete_md5],
+        'key map': sql_queries.insert_incomplete_table_queries
+    }
+
+
+def dimension_forms():
+    """
+    Returns the dimension loads compared by benchmark_upsert, read from
+    sql_queries when the benchmark runs.
+    """
+    return {
+        'not in': [sql_queries.user_table_insert, sql_queries.song_table_insert,
+                   sql_queries.artist_table_insert, sql_queries.time_table_insert],
+        'upsert': [sql_queries.user_table_upsert, sql_queries.song_table_upsert,
+                   sql_queries.artist_table_upsert, sql_queries.time_table_upsert]
+    }
+
+
+def reset_tables(cur, conn):
+    """
+    Drops and creates the Sparkify tables.
+
+    INPUTS:
+    * cur the cursor variable
+    * conn the connection to the Postgres DB
+    """
+    for query in sql_queries.drop_table_queries + sql_queries.create_table_queries:
+        cur.execute(query)
+    conn.commit()
+
+
+def fill_staging_tables(cur, conn, events):
+    """
+    Fills the staging tables with synthetic rows.
+
+    INPUTS:
+    * cur the cursor variable
+    * conn the connection to the Postgres DB
+    * events int - Number of events (users, songs and artists are derived)
+    """
+    sizes = {
+        'events': events,
+        'users': max(events // 100, 1),
+        'songs': max(events // 10, 1),
+        'artists': max(events // 50, 1)
+    }
+    cur.execute(staging_events_fill, sizes)
+    cur.execute(staging_songs_fill, sizes)
+    conn.commit()
+
+
+def timed_execute(cur, conn, query):
+    """
+    Executes and commits a query. Returns the wall time in seconds.
+
+    INPUTS:
+    * cur the cursor variable
+    * conn the connection to the Postgres DB
+    * query string - SQL statement(s)
+    """
+    start = time.time()
+    cur.execute(query)
+    conn.commit()
+    return time.time() - start
+
+
+def count_rows(cur, table):
+    """
+    Returns the number of rows of a table.
+
+    INPUTS:
+    * cur the cursor variable
+    * table string - Name of the table
+    """
+    cur.execute("SELECT COUNT(*) FROM {}".format(table))
+    return cur.fetchone()[0]
+
+
+def benchmark_upsert(config, sizes):
+    """
+    Compares the NOT IN inserts with the staged delete-then-insert upserts
+    of the dimension tables. Each form runs twice on the same staging data,
+    the second run being a re-run of a nightly load.
+    Returns a DataFrame with the time of each run and the resulting rows.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * sizes list of ints - Number of staged events for each scale
+    """
+    results = []
+    with get_pool(config).connection() as conn:
+        cur = conn.cursor()
+        for events in sizes:
+            for form, queries in dimension_forms().items():
+                reset_tables(cur, conn)
+                fill_staging_tables(cur, conn, events)
+                for run in (1, 2):
+                    for query in queries:
+                        table = target_table(query)
+                        seconds = timed_execute(cur, conn, query)
+                        results.append({
+                            'events': events, 'form': form, 'run': run, 'table': table,
+                            'seconds': round(seconds, 3), 'rows': count_rows(cur, table)
+                        })
+                        print("- ", events, " events, ", form, ", run ", run, ", ", table,
+                              ": ", round(seconds, 3), "s", sep='')
+    return pd.DataFrame(results)
+
+
+def write_event_files(directory, events, files=8):
+    """
+    Writes synthetic log files (newline-delimited JSON, as in log_data).
+    Returns the total size in bytes.
+
+    INPUTS:
+    * directory string - Output directory
+    * events int - Number of events
+    * files int - Number of files
+    """
+    for index in range(files):
+        with open(os.path.join(directory, 'events-{:02d}.json'.format(index)), 'w') as log_file:
+            for i in range(index, events, files):
+                log_file.write(json.dumps({
+                    'artist': 'Artist {}'.format(i % max(events // 50, 1)),
+                    'auth': 'Logged In', 'firstName': 'First {}'.format(i % 100),
+                    'gender': 'MF'[i % 2], 'itemInSession': i % 50,
+                    'lastName': 'Last {}'.format(i % 100), 'length': 180.0 + i % 120,
+                    'level': 'free', 'location': 'Somewhere, CA', 'method': 'PUT',
+                    'page': 'NextSong', 'registration': 1540000000000.0,
+                    'sessionId': i % 1000, 'song': 'Song {}'.format(i % max(events // 10, 1)),
+                    'status': 200, 'ts': 1541000000000 + i * 1000,
+                    'userAgent': 'Mozilla/5.0', 'userId': str(i % 100)
+                }) + '\n')
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def benchmark_preprocess(config, sizes):
+    """
+    Compares the COPY of the raw JSON logs with the preprocessing into gzip
+    CSV or Parquet chunks followed by the COPY of the chunks.
+    Returns a DataFrame with the time of each step and the bytes loaded.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * sizes list of ints - Number of events for each scale
+    """
+    workers = config.getint('ETL', 'PREPROCESS_WORKERS', fallback=4)
+    results = []
+    with get_pool(config).connection() as conn:
+        cur = conn.cursor()
+        for events in sizes:
+            with tempfile.TemporaryDirectory() as directory:
+                json_dir = os.path.join(directory, 'log_data')
+                os.makedirs(json_dir)
+                json_bytes = write_event_files(json_dir, events)
+
+                reset_tables(cur, conn)
+                json_seconds = timed_execute(
+                    cur, conn, "COPY staging_events FROM '{}' JSON 'auto'".format(json_dir))
+                json_rows = count_rows(cur, 'staging_events')
+
+                reset_tables(cur, conn)
+                start = time.time()
+                paths = [path for path, _ in LocalBackend().list(json_dir)]
+                manifest = preprocess_table(
+                    LocalBackend(), paths, 'staging_events', staging_columns('staging_events'),
+                    os.path.join(directory, 'preprocessed'), workers)
+                preprocess_seconds = time.time() - start
+                csv_seconds = timed_execute(
+                    cur, conn,
+                    "COPY staging_events FROM '{}' MANIFEST GZIP CSV DELIMITER '|'".format(manifest))
+                csv_rows = count_rows(cur, 'staging_events')
+                with open(manifest) as manifest_file:
+                    csv_bytes = sum(entry['meta']['content_length']
+                                    for entry in json.load(manifest_file)['entries'])
+
+                reset_tables(cur, conn)
+                start = time.time()
+                manifest = preprocess_table(
+                    LocalBackend(), paths, 'staging_events', staging_columns('staging_events'),
+                    os.path.join(directory, 'preprocessed_parquet'), workers,
+                    file_format='parquet')
+                preprocess_parquet_seconds = time.time() - start
+                parquet_seconds = timed_execute(
+                    cur, conn,
+                    "COPY staging_events FROM '{}' MANIFEST FORMAT AS PARQUET".format(manifest))
+                parquet_rows = count_rows(cur, 'staging_events')
+                with open(manifest) as manifest_file:
+                    parquet_bytes = sum(entry['meta']['content_length']
+                                        for entry in json.load(manifest_file)['entries'])
+
+                for step, seconds, size, rows in (
+                        ('json copy', json_seconds, json_bytes, json_rows),
+                        ('preprocess', preprocess_seconds, json_bytes, csv_rows),
+                        ('csv copy', csv_seconds, csv_bytes, csv_rows),
+                        ('preprocess parquet', preprocess_parquet_seconds, json_bytes,
+                         parquet_rows),
+                        ('parquet copy', parquet_seconds, parquet_bytes, parquet_rows)):
+                    results.append({'events': events, 'step': step, 'seconds': round(seconds, 3),
+                                    'bytes': size, 'rows': rows})
+                    print("- ", events, " events, ", step, ": ", round(seconds, 3), "s, ",
+                          size, " bytes", sep='')
+    return pd.DataFrame(results)
+
+
+def benchmark_joinkey(config, sizes):
+    """
+    Compares the songplays insert joining on (artist, title) with the insert
+    joining on the precomputed song_key, including the time to compute the keys.
+    Returns a DataFrame with the time of each step and the songplays rows.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * sizes list of ints - Number of staged events for each scale
+    """
+    steps = {
+        'columns': [('insert', sql_queries.songplay_table_insert_by_columns)],
+        'song key': [('key events', sql_queries.staging_events_key_update),
+                     ('key songs', sql_queries.staging_songs_key_update),
+                     ('insert', sql_queries.songplay_table_insert_by_key)]
+    }
+    results = []
+    with get_pool(config).connection() as conn:
+        cur = conn.cursor()
+        for events in sizes:
+            reset_tables(cur, conn)
+            fill_staging_tables(cur, conn, events)
+            for form, queries in steps.items():
+                cur.execute("DELETE FROM songplays")
+                conn.commit()
+                for step, query in queries:
+                    seconds = timed_execute(cur, conn, query)
+                    results.append({'events': events, 'form': form, 'step': step,
+                                    'seconds': round(seconds, 3),
+                                    'rows': count_rows(cur, 'songplays')})
+                    print("- ", events, " events, ", form, ", ", step, ": ",
+                          round(seconds, 3), "s", sep='')
+    return pd.DataFrame(results)
+
+
+def songplay_key_bytes(cur):
+    """
+    Returns the bytes taken by the keys of songplays: the song_id and
+    artist_id strings plus 8 bytes per BIGINT song_key_id and artist_key_id.
+
+    INPUT:
+    * cur the cursor variable
+    """
+    cur.execute("SELECT COALESCE(SUM(OCTET_LENGTH(song_id)), 0) "
+                "+ COALESCE(SUM(OCTET_LENGTH(artist_id)), 0) "
+                "+ 8 * (COUNT(song_key_id) + COUNT(artist_key_id)) FROM songplays")
+    return cur.fetchone()[0] or 0
+
+
+def benchmark_keymap(config, sizes):
+    """
+    Compares the incomplete-data inserts keyed by MD5 strings with the ones
+    reusing the integer keys of key_map. Each form runs twice on the same
+    staging data: the first run of `key map` fills the map, the second one
+    only reuses it.
+    Returns a DataFrame with the time of each statement and the bytes of the
+    songplays keys.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * sizes list of ints - Number of staged events for each scale
+    """
+    results = []
+    with get_pool(config).connection() as conn:
+        cur = conn.cursor()
+        for events in sizes:
+            for form, queries in incomplete_forms().items():
+                reset_tables(cur, conn)
+                cur.execute("DELETE FROM key_map")
+                fill_staging_tables(cur, conn, events)
+                for run in (1, 2):
+                    cur.execute("DELETE FROM songplays")
+                    conn.commit()
+                    for query in queries:
+                        table = target_table(query)
+                        seconds = timed_execute(cur, conn, query)
+                        results.append({
+                            'events': events, 'form': form, 'run': run, 'table': table,
+                            'seconds': round(seconds, 3), 'key_bytes': songplay_key_bytes(cur)
+                        })
+                        print("- ", events, " events, ", form, ", run ", run, ", ", table,
+                              ": ", round(seconds, 3), "s", sep='')
+    return pd.DataFrame(results)
+
+
+def table_bytes(cur, tables):
+    """
+    Returns the bytes taken by tables, indexes included.
+
+    INPUTS:
+    * cur the cursor variable
+    * tables list of table names
+    """
+    cur.execute("SELECT COALESCE(SUM(pg_total_relation_size(oid)), 0) FROM pg_class "
+                "WHERE relname IN %s AND relkind = 'r'", (tuple(tables),))
+    return int(cur.fetchone()[0])
+
+
+def benchmark_e2e(config, sizes):
+    """
+    Runs the pipeline end to end on generated data (generate_data.py) at each
+    scale: create_tables.main(), then load_staging_tables() and
+    insert_tables() of etl.py. The COPYs load the generated files through the
+    local stand-in. Records the wall time, rows per second, peak memory of
+    this process (where the local loader parses the files) and bytes written
+    of each stage, and saves them as JSON in BENCHMARK_RESULTS_DIR.
+    Returns a DataFrame with the results.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * sizes list of ints - Number of generated events for each scale
+    """
+    staging_tables = ['staging_events', 'staging_songs']
+    final_tables = [target_table(query) for query in sql_queries.insert_table_queries]
+    pool = get_pool(config)
+    results = []
+    for events in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            options = generator_options(config, events)
+            options['file_format'] = 'json'
+            totals = {}
+            results.append(measure(
+                events, 'generate', lambda: totals.update(generate(options, directory)),
+                rows=lambda: sum(rows for rows, _ in totals.values()),
+                bytes_written=lambda: sum(size for _, size in totals.values())))
+            config['LOCAL']['STAGING_EVENTS'] = os.path.join(directory, 'log_data')
+            config['LOCAL']['STAGING_SONGS'] = os.path.join(directory, 'song_data')
+
+            with pool.connection() as conn:
+                cur = conn.cursor()
+                results.append(measure(
+                    events, 'create_tables', create_tables.main,
+                    bytes_written=lambda: table_bytes(cur, staging_tables + final_tables)))
+                results.append(measure(
+                    events, 'load_staging_tables', lambda: etl.load_staging_tables(cur, conn),
+                    rows=lambda: sum(count_rows(cur, table) for table in staging_tables),
+                    bytes_written=lambda: table_bytes(cur, staging_tables)))
+                results.append(measure(
+                    events, 'insert_tables', lambda: etl.insert_tables(cur, conn),
+                    rows=lambda: count_rows(cur, 'staging_events'),
+                    bytes_written=lambda: table_bytes(cur, final_tables)))
+    write_results(config.get('ETL', 'BENCHMARK_RESULTS_DIR', fallback='benchmark_results'),
+                  'e2e', results)
+    return pd.DataFrame(results)
+
+
+BENCHMARKS = {
+    'upsert': benchmark_upsert,
+    'joinkey': benchmark_joinkey,
+    'keymap': benchmark_keymap,
+    'preprocess': benchmark_preprocess,
+    'e2e': benchmark_e2e
+}
+
+
+def main():
+    """
+    Runs a benchmark against the local PostgreSQL configured in the [DWH]
+    section of dwh.cfg.
+    Usage: python3 benchmark.py <benchmark> [events ...]
+    or: python3 benchmark.py compare <old results> <new results>
+    """
+    if len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        compare_results(sys.argv[2], sys.argv[3])
+        return
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("- Choose a benchmark:", ", ".join(BENCHMARKS))
+        return
+    config = load_settings()
+    # Benchmarks always run against the local PostgreSQL stand-in.
+    if not config.has_section('LOCAL'):
+        config.add_section('LOCAL')
+    config['LOCAL']['ENABLED'] = 'True'
+
+    sizes = [int(size) for size in sys.argv[2:]] or [10000, 100000, 1000000]
+    pd.set_option('display.max_rows', None)
+    print(BENCHMARKS[sys.argv[1]](config, sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+from datetime import datetime
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+
+
+# Change of the wall time reported as a regression by compare_results().
+REGRESSION_THRESHOLD = 0.1
+
+
+def current_commit():
+    """
+    Returns the short hash of the checked out commit, or 'unknown' outside a
+    git repository.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def read_rss():
+    """
+    Returns the resident memory of this process in bytes. Falls back to the
+    peak so far where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    """
+    Samples the resident memory of this process in a thread while a `with`
+    block runs. The peak is in `bytes` once the block has finished.
+    """
+
+    def __init__(self, read=read_rss, interval=0.05):
+        """
+        INPUTS:
+        * read function() returning the memory in bytes
+        * interval float - Seconds between two samples
+        """
+        self.read = read
+        self.interval = interval
+        self.bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.bytes = max(self.bytes, self.read())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.bytes = self.read()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.bytes = max(self.bytes, self.read())
+
+
+def measure(scale, stage, run, rows=None, bytes_written=None, memory=PeakMemory):
+    """
+    Runs one stage of a benchmark and returns its result: wall time, rows per
+    second, peak memory and bytes written. `rows` and `bytes_written` are
+    called after the stage, outside the timed section.
+
+    INPUTS:
+    * scale int - Scale of the run (e.g. number of events)
+    * stage string - Name of the stage
+    * run function() running the stage
+    * rows function() returning the rows processed by the stage
+    * bytes_written function() returning the bytes written by the stage
+    * memory function() returning a context manager with a `bytes` peak
+    """
+    with memory() as peak:
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+    result = {
+        'scale': scale,
+        'stage': stage,
+        'seconds': round(seconds, 3),
+        'rows': rows() if rows else 0,
+        'peak_memory_bytes': peak.bytes,
+        'bytes_written': bytes_written() if bytes_written else 0
+    }
+    result['rows_per_second'] = int(result['rows'] / max(seconds, 1e-9))
+    print("- ", scale, ", ", stage, ": ", result['seconds'], "s, ", result['rows_per_second'],
+          " rows/s, peak ", result['peak_memory_bytes'] // 2 ** 20, " MiB, ",
+          result['bytes_written'], " bytes written", sep='')
+    return result
+
+
+def directory_size(path):
+    """
+    Returns the total size of the files under a directory (0 if it does not
+    exist).
+
+    INPUT:
+    * path string - Directory
+    """
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def write_results(directory, benchmark, results):
+    """
+    Writes the results of a run as JSON, named after the benchmark and the
+    commit, so runs of two commits can be compared. Returns the file path.
+
+    INPUTS:
+    * directory string - Results directory
+    * benchmark string - Name of the benchmark
+    * results list of dictionaries returned by measure()
+    """
+    os.makedirs(directory, exist_ok=True)
+    commit = current_commit()
+    path = os.path.join(directory, '{}-{}.json'.format(benchmark, commit))
+    with open(path, 'w') as results_file:
+        json.dump({'benchmark': benchmark, 'commit': commit,
+                   'created': datetime.utcnow().isoformat(timespec='seconds'),
+                   'results': results}, results_file, indent=2, sort_keys=True)
+    print("- Results saved in", path)
+    return path
+
+
+def compare_results(old_path, new_path, threshold=REGRESSION_THRESHOLD):
+    """
+    Prints the change of every stage between two result files and flags the
+    stages that got slower by more than `threshold`. Returns the regressions
+    as (scale, stage, change) tuples.
+
+    INPUTS:
+    * old_path string - Results of the baseline commit
+    * new_path string - Results of the commit to check
+    * threshold float - Relative slowdown reported as a regression
+    """
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    baseline = {(result['scale'], result['stage']): result for result in old['results']}
+    print("Comparing", old['commit'], "with", new['commit'])
+    regressions = []
+    for result in new['results']:
+        key = (result['scale'], result['stage'])
+        if key not in baseline:
+            print("- ", key[0], ", ", key[1], ": new stage", sep='')
+            continue
+        before = baseline[key]
+        change = (result['seconds'] - before['seconds']) / max(before['seconds'], 1e-3)
+        flag = " REGRESSION" if change > threshold else ""
+        if flag:
+            regressions.append((key[0], key[1], round(change, 3)))
+        print("- ", key[0], ", ", key[1], ": ", before['seconds'], "s -> ", result['seconds'],
+              "s (", "{:+.1f}".format(100 * change), "%), peak memory ",
+              before['peak_memory_bytes'] // 2 ** 20, " -> ", result['peak_memory_bytes'] // 2 ** 20,
+              " MiB, bytes written ", before['bytes_written'], " -> ", result['bytes_written'],
+              flag, sep='')
+    return regressions
@@ -0,0 +1,229 @@
+from contextlib import contextmanager
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+from local_stand_in import LocalStandInConnection, is_local_stand_in_enabled
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection becomes available before the pool timeout.
+    """
+
+
+def getDBCredentials(config):
+    """
+    Retrieves a list with the required credentials to connect to the DB
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    credentials = []
+    credentials.append(config['DWH']['DWH_ENDPOINT'])
+    credentials.append(config['DWH']['DWH_DB'])
+    credentials.append(config['DWH']['DWH_DB_USER'])
+    credentials.append(config['DWH']['DWH_DB_PASSWORD'])
+    credentials.append(config['DWH']['DWH_PORT'])
+    return credentials
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of connections to the DB.
+    `minconn` connections are opened up front and kept warm. Idle connections
+    are checked with `SELECT 1` before being handed out again and replaced if
+    they are broken. Every connection gets the per-statement timeout.
+    """
+
+    def __init__(self, config):
+        """
+        INPUT:
+        * config ConfigParser() object with parameters ([DWH] section)
+        """
+        self._config = config
+        self._dsn = "host={} dbname={} user={} password={} port={}".format(
+            *getDBCredentials(config))
+        self.minconn = config.getint('DWH', 'DWH_POOL_MIN', fallback=1)
+        self.maxconn = config.getint('DWH', 'DWH_POOL_MAX', fallback=4)
+        self.timeout = config.getfloat('DWH', 'DWH_POOL_TIMEOUT', fallback=30)
+        self.health_check_seconds = config.getfloat(
+            'DWH', 'DWH_POOL_HEALTH_CHECK_SECONDS', fallback=30)
+        self.statement_timeout_ms = config.getint('DWH', 'DWH_STATEMENT_TIMEOUT_MS', fallback=0)
+        self._condition = threading.Condition()
+        self._idle = []
+        self._opened = 0
+        self._metrics = {'created': 0, 'checkouts': 0, 'reconnects': 0, 'timeouts': 0,
+                         'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0}
+        for _ in range(self.minconn):
+            self._idle.append((self._open(), time.time()))
+            self._opened += 1
+
+    def _open(self):
+        conn = psycopg2.connect(self._dsn)
+        if self.statement_timeout_ms:
+            with conn.cursor() as cur:
+                cur.execute("SET statement_timeout TO %s", (self.statement_timeout_ms,))
+            conn.commit()
+        with self._condition:
+            self._metrics['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.time() - last_used < self.health_check_seconds:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """
+        Borrows a connection, waiting up to the pool timeout for one to be
+        returned when all of them are in use.
+        """
+        start = time.time()
+        with self._condition:
+            while not self._idle and self._opened >= self.maxconn:
+                remaining = self.timeout - (time.time() - start)
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout(
+                        "No connection available after {}s ({} in use)".format(
+                            self.timeout, self._opened))
+                self._condition.wait(remaining)
+            idle = self._idle.pop() if self._idle else None
+            if idle is None:
+                self._opened += 1
+            waited = time.time() - start
+            self._metrics['checkouts'] += 1
+            self._metrics['wait_seconds_total'] += waited
+            self._metrics['wait_seconds_max'] = max(self._metrics['wait_seconds_max'], waited)
+
+        try:
+            if idle is None:
+                return self._open()
+            conn, last_used = idle
+            if self._is_healthy(conn, last_used):
+                return conn
+            conn.close()
+            with self._condition:
+                self._metrics['reconnects'] += 1
+            return self._open()
+        except Exception:
+            with self._condition:
+                self._opened -= 1
+                self._condition.notify()
+            raise
+
+    def putconn(self, conn):
+        """
+        Returns a connection to the pool. An open transaction is rolled back
+        and a closed connection is dropped.
+
+        INPUT:
+        * conn connection returned by getconn()
+        """
+        if not conn.closed and \
+                conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+        with self._condition:
+            if conn.closed:
+                self._opened -= 1
+            else:
+                self._idle.append((conn, time.time()))
+            self._condition.notify()
+
+    def wrap(self, conn):
+        """
+        Returns the connection wrapped by the local stand-in when it is enabled.
+
+        INPUT:
+        * conn connection returned by getconn()
+        """
+        if is_local_stand_in_enabled(self._config):
+            return LocalStandInConnection(conn, self._config)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection for a `with` block and returns it at the end.
+        """
+        conn = self.getconn()
+        try:
+            yield self.wrap(conn)
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """
+        Closes the idle connections.
+        """
+        with self._condition:
+            for conn, _ in self._idle:
+                conn.close()
+            self._opened -= len(self._idle)
+            self._idle = []
+
+    def metrics(self):
+        """
+        Returns the pool metrics: connections created, checkouts, reconnects,
+        timeouts, total and max wait in seconds, and connections in use.
+        """
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics['in_use'] = self._opened - len(self._idle)
+            metrics['idle'] = len(self._idle)
+        metrics['wait_seconds_total'] = round(metrics['wait_seconds_total'], 3)
+        metrics['wait_seconds_max'] = round(metrics['wait_seconds_max'], 3)
+        return metrics
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(config):
+    """
+    Returns the pool of the [DWH] section, creating it on first use.
+    Scripts and parallel loaders using the same settings share it.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    key = tuple(sorted(config['DWH'].items()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(config)
+        return _pools[key]
+
+
+def print_pool_metrics(config):
+    """
+    Prints the metrics of the pool of the [DWH] section.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    metrics = get_pool(config).metrics()
+    print("Connection pool:", ", ".join(
+        "{}={}".format(name, value) for name, value in metrics.items()))
+
+
+def close_pools():
+    """
+    Closes every pool.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
@@ -1,58 +1,55 @@
-import configparser
-import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+import sql_queries
+from connection import get_pool
+from execution import ExecutionPlan, plan_options, print_summary
+from settings import load_settings
 
 
-def drop_tables(cur, conn):
+def drop_tables(cur, conn, batch_size=0, savepoints=False,
+        scan_counter=None):
     """
-    Drops all existing tables (7) in Sparkify.
-    Two staging tables: staging_events, staging_songs
+    Drops the existing tables (8) in Sparkify.
+    Three staging tables: staging_events, staging_songs, staging_plays
     Five tables: songplay, songs, artists, users and time.
+    key_map and calendar are kept, so the keys and the calendar survive reloads.
+    Returns the statistics of the phase (see ExecutionPlan.run).
 
     INPUTS:
     * cur the cursor variable
     * con the connection to the Postgres DB 
+    * batch_size int - Statements per transaction (0: one transaction)
+    * savepoints boolean - Keeps going when a statement fails
+    * scan_counter ScanCounter reporting the rows scanned (optional)
     """
     print("1. Droping existing tables:")
-    for query in drop_table_queries:
-        cur.execute(query)
-        conn.commit()
-        query_words = query.split()
-        print("- Table: `", query_words[-1], "`", sep='')
+    plan = ExecutionPlan(
+        'drop_tables', sql_queries.drop_table_queries,
+        lambda query: "- Table: `{}`".format(query.split()[-1]),
+        batch_size, savepoints, scan_counter)
+    return plan.run(cur, conn)
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, batch_size=0, savepoints=False,
+        scan_counter=None):
     """
-    Creates tables (7) in Sparkify.
+    Creates tables (9) in Sparkify.
     Two staging tables: staging_events, staging_songs
     Five tables: time, users, artists, songs and songplay.
+    Two lookup tables: key_map and calendar.
+    Returns the statistics of the phase (see ExecutionPlan.run).
 
     INPUTS:
     * cur the cursor variable
     * con the connection to the Postgres DB
+    * batch_size int - Statements per transaction (0: one transaction)
+    * savepoints boolean - Keeps going when a statement fails
+    * scan_counter ScanCounter reporting the rows scanned (optional)
     """
     print("2. Creating tables.")
-    for query in create_table_queries:
-        cur.execute(query)
-        conn.commit()
-        query_words = query.split()
-        print("- Table: `", query_words[5], "`", sep='')
-
-
-def getDBCredentials(config):
-    """
-    Retrieves a list with the required credentials to connect to the DB
-
-    INPUT:
-    * config ConfigParser() object with parameters
-    """
-    credentials = []
-    credentials.append(config['DWH']['DWH_ENDPOINT'])
-    credentials.append(config['DWH']['DWH_DB'])
-    credentials.append(config['DWH']['DWH_DB_USER'])
-    credentials.append(config['DWH']['DWH_DB_PASSWORD'])
-    credentials.append(config['DWH']['DWH_PORT'])
-    return credentials
+    plan = ExecutionPlan(
+        'create_tables', sql_queries.create_table_queries,
+        lambda query: "- Table: `{}`".format(query.split()[5]),
+        batch_size, savepoints, scan_counter)
+    return plan.run(cur, conn)
 
 
 def main():
@@ -63,19 +60,20 @@ def main():
     Then, it drops the tables if they exist.
     Then, it closes the connection. 
     """
-    config = configparser.ConfigParser()
-    config.optionxform=str
-    config.read('dwh.cfg')
+    config = load_settings()
 
-    conn = psycopg2.connect(
-        "host={} dbname={} user={} password={} port={}".format(*getDBCredentials(config))
-        )
-    cur = conn.cursor()
+    pool = get_pool(config)
+    with pool.connection() as conn:
+        cur = conn.cursor()
 
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
+        options = plan_options(config)
+        stats = [
+            drop_tables(cur, conn, **options),
+            create_tables(cur, conn, **options)
+        ]
+        print_summary(stats)
 
-    conn.close()
+    pool.closeall()
 
 
 if __name__ == "__main__":
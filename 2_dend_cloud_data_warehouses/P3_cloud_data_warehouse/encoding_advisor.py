@@ -0,0 +1,293 @@
+import math
+import re
+import sys
+import psycopg2
+import sql_queries
+from connection import get_pool
+from scheduler import TABLE_PATTERN
+from settings import load_settings
+
+
+COLUMN_DEFINITION_PATTERN = re.compile(
+    r"^(?P<indent>\s*)(?P<column>\w+)(?P<space>\s+)(?P<type>\w+)(?P<width>\([\d,\s]+\))?"
+    r"(?P<identity>\s+IDENTITY\([\d,\s]+\))?(?P<constraints>.*?)(?P<comma>,?)\s*$",
+    re.IGNORECASE)
+ENCODE_PATTERN = re.compile(r"\s*\bENCODE\s+\w+", re.IGNORECASE)
+
+# Bytes per value of the fixed-width types (VARCHAR: its length + 4).
+FIXED_WIDTHS = {'INT': 4, 'INTEGER': 4, 'SMALLINT': 2, 'BIGINT': 8,
+                'DECIMAL': 8, 'TIMESTAMP': 8, 'DATE': 4, 'BOOLEAN': 1}
+NUMERIC_TYPES = set(FIXED_WIDTHS)
+
+# Reduction (%) assumed for each encoding when ANALYZE COMPRESSION is not
+# available. Conservative figures for the Sparkify data.
+ESTIMATED_REDUCTION = {'raw': 0, 'runlength': 90, 'bytedict': 75, 'az64': 55,
+                       'zstd': 50, 'lzo': 40}
+
+# Distinct values a BYTEDICT dictionary can hold.
+BYTEDICT_LIMIT = 256
+
+
+def table_columns(create_query):
+    """
+    Returns the (column, type, constraints) of a CREATE TABLE statement.
+
+    INPUT:
+    * create_query string - CREATE TABLE statement
+    """
+    body = create_query[create_query.index('(') + 1:create_query.rindex(')')]
+    columns = []
+    for line in body.splitlines():
+        match = COLUMN_DEFINITION_PATTERN.match(line)
+        if match:
+            columns.append((match.group('column').lower(), match.group('type').upper(),
+                            match.group('constraints')))
+    return columns
+
+
+def profile_columns(cur, table, columns, sample_rows):
+    """
+    Profiles a table with queries that run on Redshift and on PostgreSQL.
+    The widths of the VARCHAR columns are measured over the whole table, the
+    rest over a random sample of about `sample_rows` rows.
+    Returns the total rows of the table and, per column, the non-null,
+    distinct values and total bytes of the sample and the max bytes of the
+    table (no profiles when the table is empty).
+
+    INPUTS:
+    * cur the cursor variable
+    * table string - Name of the table
+    * columns list of (column, type, constraints)
+    * sample_rows int - Rows sampled
+    """
+    varchars = [column for column, column_type, _ in columns if column_type == 'VARCHAR']
+    cur.execute("SELECT {} FROM {}".format(', '.join(
+        ["COUNT(*)"] + ["MAX(OCTET_LENGTH({}))".format(column) for column in varchars]), table))
+    result = cur.fetchone()
+    rows, max_bytes = result[0], dict(zip(varchars, result[1:]))
+    if not rows:
+        return 0, {}
+    expressions = []
+    for column, _, _ in columns:
+        expressions.extend([
+            "COUNT({})".format(column),
+            "COUNT(DISTINCT {})".format(column),
+            "SUM(OCTET_LENGTH(CAST({} AS VARCHAR)))".format(column)
+        ])
+    # RANDOM() < 1 keeps every row of the tables smaller than the sample.
+    cur.execute("SELECT COUNT(*), {} FROM {} WHERE RANDOM() < {}".format(
+        ', '.join(expressions), table, min(1.0, float(sample_rows) / rows)))
+    result = cur.fetchone()
+    profiles = {}
+    for index, (column, _, _) in enumerate(columns):
+        non_null, distinct, total_bytes = result[1 + 3 * index:4 + 3 * index]
+        profiles[column] = {'sampled': result[0], 'non_null': non_null, 'distinct': distinct,
+                            'max_bytes': max_bytes.get(column) or 0, 'bytes': total_bytes or 0}
+    return rows, profiles
+
+
+def analyze_compression(cur, table, sample_rows):
+    """
+    Returns the encoding and the estimated reduction (%) that Redshift
+    recommends for every column, or None when ANALYZE COMPRESSION is not
+    available (PostgreSQL).
+    The connection must be in autocommit mode: ANALYZE COMPRESSION cannot
+    run inside a transaction block.
+
+    INPUTS:
+    * cur the cursor variable
+    * table string - Name of the table
+    * sample_rows int - Rows sampled per slice (COMPROWS, at least 1000)
+    """
+    try:
+        cur.execute("ANALYZE COMPRESSION {} COMPROWS {}".format(table, max(sample_rows, 1000)))
+    except psycopg2.Error:
+        return None
+    return {column.lower(): (encoding.lower(), float(reduction))
+            for _, column, encoding, reduction in cur.fetchall()}
+
+
+def recommend_encoding(column_type, constraints, profile):
+    """
+    Local fallback of ANALYZE COMPRESSION. Returns (encoding, reduction %).
+    The sort key stays RAW so that range-restricted scans keep their zone maps.
+
+    INPUTS:
+    * column_type string - Declared type (e.g. 'VARCHAR')
+    * constraints string - Rest of the column definition
+    * profile dictionary returned by profile_columns()
+    """
+    if re.search(r"\bSORTKEY\b", constraints, re.IGNORECASE):
+        encoding = 'raw'
+    elif profile['distinct'] <= 1:
+        encoding = 'runlength'
+    elif column_type in NUMERIC_TYPES:
+        encoding = 'az64'
+    elif profile['distinct'] < BYTEDICT_LIMIT:
+        encoding = 'bytedict'
+    else:
+        encoding = 'zstd'
+    return encoding, float(ESTIMATED_REDUCTION[encoding])
+
+
+def tight_width(max_bytes):
+    """
+    Returns a VARCHAR width for the longest value of the column: 25%
+    headroom, rounded up to a multiple of 16.
+
+    INPUT:
+    * max_bytes int - Longest value in bytes
+    """
+    width = int(math.ceil(max(max_bytes, 1) * 1.25 / 16.0)) * 16
+    return min(width, 65535)
+
+
+def column_bytes(column_type, profile, rows):
+    """
+    Returns the uncompressed size of a column, extrapolated from the sample
+    to the whole table.
+
+    INPUTS:
+    * column_type string - Declared type
+    * profile dictionary returned by profile_columns()
+    * rows int - Rows of the table
+    """
+    if not profile['sampled']:
+        return 0
+    if column_type in FIXED_WIDTHS:
+        sampled = FIXED_WIDTHS[column_type] * profile['sampled']
+    else:
+        sampled = profile['bytes'] + 4 * profile['non_null']
+    return int(sampled * rows / float(profile['sampled']))
+
+
+def advise_table(cur, create_query, sample_rows):
+    """
+    Recommends an encoding and, for VARCHAR columns, a width for every column
+    of a table. Returns the table name and a list of recommendations, empty
+    when the table has no rows to base them on.
+
+    INPUTS:
+    * cur the cursor variable
+    * create_query string - CREATE TABLE statement of the table
+    * sample_rows int - Rows sampled
+    """
+    table = TABLE_PATTERN.search(create_query).group(1).lower()
+    columns = table_columns(create_query)
+    rows, profiles = profile_columns(cur, table, columns, sample_rows)
+    if not rows:
+        return table, []
+    analyzed = analyze_compression(cur, table, sample_rows)
+    recommendations = []
+    for column, column_type, constraints in columns:
+        profile = profiles[column]
+        if analyzed and column in analyzed:
+            encoding, reduction = analyzed[column]
+            source = 'analyze compression'
+        else:
+            encoding, reduction = recommend_encoding(column_type, constraints, profile)
+            source = 'local statistics'
+        raw_bytes = column_bytes(column_type, profile, rows)
+        recommendations.append({
+            'table': table, 'column': column, 'type': column_type,
+            'width': tight_width(profile['max_bytes']) if column_type == 'VARCHAR' else None,
+            'encoding': encoding, 'source': source, 'rows': rows,
+            'bytes': raw_bytes, 'saved_bytes': int(raw_bytes * reduction / 100.0)
+        })
+    return table, recommendations
+
+
+def rewrite_create(create_query, recommendations):
+    """
+    Returns the CREATE TABLE statement with an ENCODE clause per column and
+    the recommended VARCHAR widths.
+
+    INPUTS:
+    * create_query string - CREATE TABLE statement
+    * recommendations list returned by advise_table()
+    """
+    by_column = {recommendation['column']: recommendation for recommendation in recommendations}
+    start, end = create_query.index('(') + 1, create_query.rindex(')')
+    lines = []
+    for line in create_query[start:end].split('\n'):
+        match = COLUMN_DEFINITION_PATTERN.match(line)
+        if not match or match.group('column').lower() not in by_column:
+            lines.append(line)
+            continue
+        recommendation = by_column[match.group('column').lower()]
+        column_type = match.group('type') + (match.group('width') or '')
+        if recommendation['width']:
+            column_type = '{}({})'.format(match.group('type'), recommendation['width'])
+        constraints = ENCODE_PATTERN.sub('', match.group('constraints')).rstrip()
+        lines.append('{}{}{}{}{} ENCODE {}{}{}'.format(
+            match.group('indent'), match.group('column'), match.group('space'),
+            column_type, match.group('identity') or '',
+            recommendation['encoding'], constraints, match.group('comma')))
+    return create_query[:start] + '\n'.join(lines) + create_query[end:]
+
+
+def print_report(table, recommendations):
+    """
+    Prints the recommendation of every column and the estimated savings of
+    the table.
+
+    INPUTS:
+    * table string - Name of the table
+    * recommendations list returned by advise_table()
+    """
+    total = sum(recommendation['bytes'] for recommendation in recommendations)
+    saved = sum(recommendation['saved_bytes'] for recommendation in recommendations)
+    print("- Table `", table, "`: ", recommendations[0]['rows'] if recommendations else 0,
+          " rows, ", total, " bytes, ", saved, " bytes saved (",
+          round(100.0 * saved / total, 1) if total else 0.0, "%)", sep='')
+    for recommendation in recommendations:
+        print("    ", recommendation['column'], ": ENCODE ", recommendation['encoding'],
+              " (", recommendation['source'], ")",
+              ", VARCHAR({})".format(recommendation['width']) if recommendation['width'] else '',
+              ", ", recommendation['saved_bytes'], " bytes saved", sep='')
+
+
+def main():
+    """
+    Samples every Sparkify table, prints the recommended encodings and
+    widths (empty tables are left as they are) and writes the rewritten CREATE TABLE statements to
+    ENCODED_DDL_PATH. Run it after etl.py, so the tables hold data.
+    Usage: python3 encoding_advisor.py [table ...]
+    """
+    config = load_settings()
+
+    sample_rows = config.getint('ETL', 'ENCODING_SAMPLE_ROWS', fallback=100000)
+    path = config.get('ETL', 'ENCODED_DDL_PATH', fallback='') or 'encoded_tables.sql'
+    tables = [table.lower() for table in sys.argv[1:]]
+
+    pool = get_pool(config)
+    conn = pool.getconn()
+    conn.autocommit = True
+    statements = []
+    try:
+        cur = pool.wrap(conn).cursor()
+        print("1. Sampling tables:")
+        for create_query in sql_queries.default_create_table_queries:
+            table = TABLE_PATTERN.search(create_query).group(1).lower()
+            if tables and table not in tables:
+                statements.append(create_query)
+                continue
+            table, recommendations = advise_table(cur, create_query, sample_rows)
+            if not recommendations:
+                print("- Table `", table, "`: empty, encodings left unchanged.", sep='')
+                statements.append(create_query)
+                continue
+            print_report(table, recommendations)
+            statements.append(rewrite_create(create_query, recommendations))
+    finally:
+        conn.autocommit = False
+        pool.putconn(conn)
+    pool.closeall()
+
+    with open(path, 'w') as ddl_file:
+        ddl_file.write('\n'.join(statement.strip() for statement in statements) + '\n')
+    print("2. Encoded DDL written:", path)
+
+
+if __name__ == "__main__":
+    main()
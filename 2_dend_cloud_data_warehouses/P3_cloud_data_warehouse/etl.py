@@ -1,75 +1,313 @@
-import configparser
-import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries, insert_incomplete_table_queries
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import time
+import sql_queries
+from connection import get_pool, print_pool_metrics
+from scheduler import build_insert_graph, critical_path, run_graph, target_table, write_trace
+from incremental import load_incrementally
+from time_dimension import ensure_calendar
+from execution import ExecutionPlan, PhaseError, plan_options, print_summary
+from settings import load_settings
 
 
-def load_staging_tables(cur, conn):
+def load_staging_tables(cur, conn, batch_size=0, savepoints=False,
+        scan_counter=None):
     """
     Loads data from S3 to Sparkify staging tables.
     Target staging tables: staging_events, staging_songs
+    Returns the statistics of the phase (see ExecutionPlan.run).
 
     INPUTS:
     * cur the cursor variable
     * con the connection to the Postgres DB 
+    * batch_size int - Statements per transaction (0: one transaction)
+    * savepoints boolean - Keeps going when a statement fails
+    * scan_counter ScanCounter reporting the rows scanned (optional)
     """
     print("1. Loading data from S3 to Redshift staging tables.")
-    for query in copy_table_queries:
-        cur.execute(query)
-        conn.commit()
-        query_words = query.split()
-        print("- Table loaded: `", query_words[1], "`", sep='')
+    plan = ExecutionPlan(
+        'load_staging_tables', sql_queries.copy_table_queries,
+        lambda query: "- Table loaded: `{}`".format(query.split()[1]),
+        batch_size, savepoints, scan_counter)
+    return plan.run(cur, conn)
+
+
+def copy_into_staging_table(pool, query):
+    """
+    Runs one COPY on its own pooled connection and leaves the transaction open.
+    The caller decides whether to commit or roll it back.
+    Returns a dictionary with the table, the connection, the wall time and
+    the error (None if the COPY succeeded).
+
+    INPUTS:
+    * pool ConnectionPool with the connections to the DB
+    * query string - COPY statement
+    """
+    table = query.split()[1]
+    start = time.time()
+    conn = None
+    error = None
+    try:
+        conn = pool.getconn()
+        with pool.wrap(conn).cursor() as cur:
+            cur.execute(query)
+    except Exception as e:
+        error = e
+    return {'table': table, 'conn': conn, 'seconds': time.time() - start, 'error': error}
+
+
+def load_staging_tables_concurrently(config, workers=None):
+    """
+    Loads data from S3 to Sparkify staging tables running every COPY in
+    copy_table_queries at the same time, each one on its own connection.
+    The COPYs are committed only if all of them succeeded, otherwise all of
+    them are rolled back, so the staging tables are never half loaded.
+    Every COPY keeps its connection until the end, so DWH_POOL_MAX must be at
+    least the number of queries; `workers` bounds how many COPYs run at once.
+    Returns a list with the status and the wall time of each table.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * workers int - Number of concurrent COPYs (default: one per query)
+    """
+    workers = workers or len(sql_queries.copy_table_queries)
+    print("1. Loading data from S3 to Redshift staging tables (", workers, " workers).", sep='')
+    pool = get_pool(config)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda query: copy_into_staging_table(pool, query),
+            sql_queries.copy_table_queries))
+
+    failed = [result for result in results if result['error'] is not None]
+    for result in results:
+        conn = result.pop('conn')
+        if failed:
+            result['status'] = 'failed' if result['error'] is not None else 'rolled back'
+        else:
+            try:
+                conn.commit()
+                result['status'] = 'committed'
+            except Exception as e:
+                result['error'] = e
+                result['status'] = 'commit failed'
+        if conn is not None:
+            # Returning the connection rolls back anything left uncommitted.
+            pool.putconn(conn)
+        print("- Table `", result['table'], "`: ", result['status'],
+              " in ", round(result['seconds'], 2), "s", sep='')
+        if result['error'] is not None:
+            print("  ", result['error'])
+    return results
+
+
+def key_staging_tables(cur, conn, batch_size=0, savepoints=False,
+        scan_counter=None):
+    """
+    Computes the normalized song_key of both staging tables, used by the
+    songplays join when SONG_KEY_JOIN is enabled.
+    Returns the statistics of the phase (see ExecutionPlan.run).
+
+    INPUTS:
+    * cur the cursor variable
+    * con the connection to the Postgres DB
+    * batch_size int - Statements per transaction (0: one transaction)
+    * savepoints boolean - Keeps going when a statement fails
+    * scan_counter ScanCounter reporting the rows scanned (optional)
+    """
+    print("- Computing the song keys of the staging tables.")
+    plan = ExecutionPlan(
+        'key_staging_tables', sql_queries.staging_key_queries,
+        lambda query: "- Song keys computed: `{}`".format(query.split()[1]),
+        batch_size, savepoints, scan_counter)
+    return plan.run(cur, conn)
+
+
+def materialize_staging_plays(cur, conn, batch_size=0, savepoints=False,
+        scan_counter=None):
+    """
+    Scans staging_events once into staging_plays, the intermediate every
+    insert reads in the single-pass transform.
+    Returns the statistics of the phase (see ExecutionPlan.run).
+
+    INPUTS:
+    * cur the cursor variable
+    * con the connection to the Postgres DB
+    * batch_size int - Statements per transaction (0: one transaction)
+    * savepoints boolean - Keeps going when a statement fails
+    * scan_counter ScanCounter reporting the rows scanned (optional)
+    """
+    print("- Materializing the NextSong events into `staging_plays`.")
+    plan = ExecutionPlan(
+        'materialize_staging_plays',
+        [sql_queries.staging_plays_drop, sql_queries.staging_plays_create],
+        lambda query: "- {}".format(' '.join(query.split()[:3])),
+        batch_size, savepoints, scan_counter)
+    return plan.run(cur, conn)
 
 
-def insert_tables(cur, conn):
+def insert_tables(cur, conn, queries=None, batch_size=0, savepoints=False,
+        scan_counter=None):
     """
     Loads data from staging tables to final tables.
     Target staging tables: songplay, songs, artists, users and time
+    Returns the statistics of the phase (see ExecutionPlan.run).
 
     INPUTS:
     * cur the cursor variable
     * con the connection to the Postgres DB 
+    * queries list of inserts or upserts (default: insert_table_queries)
+    * batch_size int - Statements per transaction (0: one transaction)
+    * savepoints boolean - Keeps going when a statement fails
+    * scan_counter ScanCounter reporting the rows scanned (optional)
     """
+    queries = queries if queries is not None else sql_queries.insert_table_queries
     print("2. Transforming from staging to final.")
-    for query in insert_table_queries:
-        cur.execute(query)
-        conn.commit()
-        query_words = query.split()
-        print("- Table loaded: `", query_words[2], "`", sep='')
+    plan = ExecutionPlan(
+        'insert_tables', queries,
+        lambda query: "- Table loaded: `{}`".format(target_table(query)),
+        batch_size, savepoints, scan_counter)
+    return plan.run(cur, conn)
+
+
+def insert_tables_in_parallel(config, workers, trace_path=None, queries=None):
+    """
+    Loads data from staging tables to final tables following the dependencies
+    between the tables (REFERENCES and foreign key columns in sql_queries.py).
+    Independent dimension inserts run at the same time on pooled connections
+    and songplays waits only for the dimensions it needs.
+    Returns the timing trace of each insert and writes it as a Gantt-style
+    JSON file when trace_path is given.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * workers int - Number of inserts running at the same time
+    * trace_path string - JSON file for the timing trace (optional)
+    * queries list of inserts or upserts (default: insert_table_queries)
+    """
+    queries = queries if queries is not None else sql_queries.insert_table_queries
+    print("2. Transforming from staging to final (", workers, " workers).", sep='')
+    nodes, dependencies = build_insert_graph(queries, sql_queries.create_table_queries)
+    pool = get_pool(config)
+
+    def run_insert(table, query):
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query)
+            conn.commit()
+
+    trace = run_graph(nodes, dependencies, run_insert, workers)
+    for node in trace:
+        print("- Table `", node['name'], "`: ", node['status'], sep='', end='')
+        if node['seconds'] is not None:
+            print(" from ", node['start'], "s to ", node['end'], "s", sep='', end='')
+        print(" " + node['error'] if node['error'] else "")
+    print("- Critical path:", " -> ".join(critical_path(trace)))
+    if trace_path:
+        write_trace(trace_path, 'insert_tables', trace)
+        print("- Timing trace saved in", trace_path)
+    return trace
 
-def insert_incomplete_tables(cur, conn, is_processed):
+
+def insert_incomplete_tables(cur, conn, is_processed, queries=None,
+        batch_size=0, savepoints=False, scan_counter=None):
     """
     Loads incomplete data from event staging table to final tables.
     Target staging tables: songplay, songs and artists
+    Returns the statistics of the phase (see ExecutionPlan.run), or None
+    if incomplete data is not processed.
 
     INPUTS:
     * cur the cursor variable
     * con the connection to the Postgres DB 
     * is_proecessed boolean - Allows processing incomplete data
+    * queries list of inserts (default: insert_incomplete_table_queries)
+    * batch_size int - Statements per transaction (0: one transaction)
+    * savepoints boolean - Keeps going when a statement fails
+    * scan_counter ScanCounter reporting the rows scanned (optional)
     """
     if not is_processed:
         print("3. Incomplete data is not processed.")
         return
+    queries = queries if queries is not None else sql_queries.insert_incomplete_table_queries
     print("3. Adding incomplete data to final tables.")
-    for query in insert_incomplete_table_queries:
-        cur.execute(query)
-        conn.commit()
-        query_words = query.split()
-        print("- Incomplete data inserted into: `", query_words[2], "`", sep='')
+    plan = ExecutionPlan(
+        'insert_incomplete_tables', queries,
+        lambda query: "- Incomplete data inserted into: `{}`".format(target_table(query)),
+        batch_size, savepoints, scan_counter)
+    return plan.run(cur, conn)
 
-def getDBCredentials(config):
+def run_etl(config, cur, conn):
     """
-    Retrieves a list with the required credentials to connect to the DB
+    Runs the phases of the ETL on a borrowed connection. Raises PhaseError,
+    whatever the load and insert modes, as soon as a phase failed.
 
-    INPUT:
+    INPUTS:
     * config ConfigParser() object with parameters
+    * cur the cursor variable
+    * conn the connection to the Postgres DB
     """
-    credentials = []
-    credentials.append(config['DWH']['DWH_ENDPOINT'])
-    credentials.append(config['DWH']['DWH_DB'])
-    credentials.append(config['DWH']['DWH_DB_USER'])
-    credentials.append(config['DWH']['DWH_DB_PASSWORD'])
-    credentials.append(config['DWH']['DWH_PORT'])
-    return credentials
+    options = plan_options(config)
+    process_incomplete = config.getboolean('DWH', 'DWH_PROCESS_INCOMPLETE_DATA', fallback=True)
+    stats = []
+
+    if config.getboolean('ETL', 'INCREMENTAL', fallback=False):
+        load_incrementally(cur, conn, config)
+        stats.append(insert_incomplete_tables(
+            cur, conn, process_incomplete, sql_queries.insert_incomplete_table_queries, **options))
+        print_summary([phase for phase in stats if phase])
+        return
+
+    if config.get('ETL', 'LOAD_MODE', fallback='sequential') == 'concurrent':
+        results = load_staging_tables_concurrently(
+            config, config.getint('ETL', 'COPY_WORKERS', fallback=0))
+        failed = [result for result in results if result['status'] != 'committed']
+        if failed:
+            raise PhaseError('load_staging_tables', [
+                "{}: {}".format(result['table'], result['error'] or result['status'])
+                for result in failed])
+        stats.append({'phase': 'load_staging_tables', 'commits': len(results),
+                      'seconds': round(max(result['seconds'] for result in results), 3)})
+    else:
+        stats.append(load_staging_tables(cur, conn, **options))
+    if sql_queries.staging_key_queries:
+        stats.append(key_staging_tables(cur, conn, **options))
+    if config.get('ETL', 'TIME_DIMENSION', fallback='extract') == 'calendar':
+        ensure_calendar(cur)
+        conn.commit()
+
+    upsert = config.get('ETL', 'DIMENSION_MODE', fallback='insert') == 'upsert'
+    single_pass = config.get('ETL', 'TRANSFORM_MODE', fallback='staging') == 'single_pass'
+    if single_pass:
+        stats.append(materialize_staging_plays(cur, conn, **options))
+        queries = sql_queries.single_pass_upsert_table_queries if upsert \
+            else sql_queries.single_pass_insert_table_queries
+        incomplete_queries = sql_queries.single_pass_insert_incomplete_table_queries
+    else:
+        queries = sql_queries.upsert_table_queries if upsert else sql_queries.insert_table_queries
+        incomplete_queries = sql_queries.insert_incomplete_table_queries
+    if config.get('ETL', 'INSERT_MODE', fallback='sequential') == 'parallel':
+        trace = insert_tables_in_parallel(
+            config,
+            config.getint('ETL', 'INSERT_WORKERS', fallback=4),
+            config.get('ETL', 'INSERT_TRACE_PATH', fallback=None),
+            queries)
+        failed = [node for node in trace if node['status'] != 'succeeded']
+        if failed:
+            raise PhaseError('insert_tables', [
+                "{}: {}".format(node['name'], node['error'] or node['status'])
+                for node in failed])
+        stats.append({'phase': 'insert_tables', 'commits': len(trace),
+                      'seconds': max(node['end'] for node in trace)})
+    else:
+        stats.append(insert_tables(cur, conn, queries, **options))
+    stats.append(insert_incomplete_tables(
+        cur, conn, process_incomplete, incomplete_queries, **options))
+    if single_pass:
+        cur.execute(sql_queries.staging_plays_drop)
+        conn.commit()
+
+    print_summary([phase for phase in stats if phase])
+
 
 def main():
     """
@@ -79,21 +317,21 @@ def main():
     Then, it loads the data from S3 to staging tables.
     Then, it processes the data from staging tables to final tables in Redshift
     Then, it closes the connection. 
+    It exits with status 1 when a phase failed.
     """
-    config = configparser.ConfigParser()
-    config.optionxform=str
-    config.read('dwh.cfg')
-
-    conn = psycopg2.connect(
-        "host={} dbname={} user={} password={} port={}".format(*getDBCredentials(config))
-        )
-    cur = conn.cursor()
-    
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
-    insert_incomplete_tables(cur, conn, (config['DWH']['DWH_PROCESS_INCOMPLETE_DATA']))
+    config = load_settings()
 
-    conn.close()
+    pool = get_pool(config)
+    try:
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            run_etl(config, cur, conn)
+    except PhaseError as e:
+        print("ETL stopped.", e)
+        sys.exit(1)
+    finally:
+        print_pool_metrics(config)
+        pool.closeall()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+import time
+from local_stand_in import is_local_stand_in_enabled
+
+
+class ScanCounter:
+    """
+    Rows scanned by each statement, per table: from STL_SCAN on Redshift and
+    from the pg_stat_xact_user_tables deltas on the local PostgreSQL.
+    On Redshift only the last query of a multi-statement script is counted.
+    """
+
+    def __init__(self, local):
+        """
+        INPUT:
+        * local boolean - True for the local PostgreSQL stand-in
+        """
+        self.local = local
+        self._before = {}
+
+    def read_postgres(self, cur):
+        cur.execute("SELECT relname, seq_tup_read + COALESCE(idx_tup_fetch, 0) "
+                    "FROM pg_stat_xact_user_tables")
+        return dict(cur.fetchall())
+
+    def start(self, cur):
+        """
+        Takes the counters before a statement.
+
+        INPUT:
+        * cur the cursor variable
+        """
+        if self.local:
+            self._before = self.read_postgres(cur)
+
+    def rows(self, cur):
+        """
+        Returns {table: rows scanned} for the statement executed since start().
+
+        INPUT:
+        * cur the cursor variable
+        """
+        if self.local:
+            after = self.read_postgres(cur)
+            scanned = {table: rows - self._before.get(table, 0) for table, rows in after.items()}
+        else:
+            # type 2: scans of permanent tables.
+            cur.execute("SELECT TRIM(perm_table_name), SUM(rows_pre_filter) FROM stl_scan "
+                        "WHERE query = pg_last_query_id() AND type = 2 GROUP BY 1")
+            scanned = dict(cur.fetchall())
+        return {table: int(rows) for table, rows in scanned.items() if rows}
+
+
+class PhaseError(Exception):
+    """
+    Raised when statements of a phase failed, once the failed batch has been
+    rolled back, so the next phases do not run on partly loaded tables.
+    """
+
+    def __init__(self, phase, errors):
+        """
+        INPUTS:
+        * phase string - Name of the phase
+        * errors list of error messages
+        """
+        super().__init__("Phase `{}` failed: {}".format(phase, '; '.join(errors)))
+        self.phase = phase
+        self.errors = errors
+
+
+class ExecutionPlan:
+    """
+    A phase of the pipeline (drop, create, load, insert...) executed as one
+    transaction, or as batches of `batch_size` statements with one commit per
+    batch.
+    With savepoints, a failing statement is rolled back to its savepoint and
+    the rest of the phase goes on. Without them (Redshift does not support
+    SAVEPOINT) a failing statement rolls back its batch and stops the phase.
+    Either way the phase raises PhaseError at the end when a statement failed.
+    """
+
+    def __init__(self, name, queries, describe, batch_size=0, savepoints=False,
+                 scan_counter=None):
+        """
+        INPUTS:
+        * name string - Name of the phase, for the summary
+        * queries list of SQL statements
+        * describe function(query) returning the line printed for a statement
+        * batch_size int - Statements per transaction (0: whole phase)
+        * savepoints boolean - Wraps each statement in a savepoint
+        * scan_counter ScanCounter reporting the rows scanned (optional)
+        """
+        self.name = name
+        self.queries = queries
+        self.describe = describe
+        self.batch_size = batch_size or len(queries) or 1
+        self.savepoints = savepoints
+        self.scan_counter = scan_counter
+
+    def batches(self):
+        """
+        Yields the statements of each transaction.
+        """
+        for start in range(0, len(self.queries), self.batch_size):
+            yield self.queries[start:start + self.batch_size]
+
+    def run(self, cur, conn):
+        """
+        Executes the phase and returns its statistics: committed and failed
+        statements, commits, latency, errors and rows scanned per statement.
+        Raises PhaseError after the summary line when a statement failed.
+
+        INPUTS:
+        * cur the cursor variable
+        * conn the connection to the Postgres DB
+        """
+        stats = {'phase': self.name, 'statements': 0, 'failed': 0, 'commits': 0,
+                 'seconds': 0.0, 'errors': [], 'scans': []}
+        start = time.time()
+        for batch in self.batches():
+            try:
+                executed = sum(self.execute(cur, query, stats) for query in batch)
+                conn.commit()
+                stats['commits'] += 1
+                # Counted once committed: a rolled back batch adds nothing.
+                stats['statements'] += executed
+            except Exception as e:
+                conn.rollback()
+                stats['failed'] += 1
+                stats['errors'].append(str(e))
+                print("- Rolled back", len(batch), "statements:", e)
+                break
+        stats['seconds'] = round(time.time() - start, 3)
+        print("- Phase `", self.name, "`: ", stats['statements'], " statements, ",
+              stats['failed'], " failed, ", stats['commits'], " commits in ",
+              stats['seconds'], "s", sep='')
+        if stats['failed']:
+            raise PhaseError(self.name, stats['errors'])
+        return stats
+
+    def execute(self, cur, query, stats):
+        """
+        Executes one statement, inside a savepoint when they are enabled.
+        Returns True when it succeeded, False when its savepoint was rolled back.
+
+        INPUTS:
+        * cur the cursor variable
+        * query string - SQL statement
+        * stats dictionary updated with the result
+        """
+        if self.scan_counter:
+            self.scan_counter.start(cur)
+        if not self.savepoints:
+            cur.execute(query)
+        else:
+            cur.execute("SAVEPOINT statement")
+            try:
+                cur.execute(query)
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT statement")
+                stats['failed'] += 1
+                stats['errors'].append(str(e))
+                print(self.describe(query), "failed:", e)
+                return False
+            cur.execute("RELEASE SAVEPOINT statement")
+        print(self.describe(query))
+        if self.scan_counter:
+            scanned = self.scan_counter.rows(cur)
+            stats['scans'].append({'statement': self.describe(query), 'tables': scanned})
+            print("  rows scanned:", ", ".join(
+                "{}={}".format(table, rows) for table, rows in sorted(scanned.items())) or 0)
+        return True
+
+
+def plan_options(config):
+    """
+    Returns the batch size, savepoint and scan report options of the [ETL]
+    section.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    scan_counter = None
+    if config.getboolean('ETL', 'REPORT_SCANS', fallback=False):
+        scan_counter = ScanCounter(is_local_stand_in_enabled(config))
+    return {
+        'batch_size': config.getint('ETL', 'BATCH_SIZE', fallback=0),
+        'savepoints': config.getboolean('ETL', 'USE_SAVEPOINTS', fallback=False),
+        'scan_counter': scan_counter
+    }
+
+
+def print_summary(stats):
+    """
+    Prints the commits and the latency of every phase, and the rows scanned
+    by each statement when they were counted.
+
+    INPUT:
+    * stats list of the dictionaries returned by ExecutionPlan.run()
+    """
+    print("Summary:")
+    for phase in stats:
+        print("- ", phase['phase'], ": ", phase['commits'], " commits, ",
+              phase['seconds'], "s", sep='')
+        for scan in phase.get('scans', []):
+            print("  ", scan['statement'].lstrip('- '), ": ",
+                  sum(scan['tables'].values()), " rows scanned", sep='')
+    print("- Total: ", sum(phase['commits'] for phase in stats), " commits, ",
+          round(sum(phase['seconds'] for phase in stats), 3), "s", sep='')
@@ -0,0 +1,340 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import gzip
+import io
+import json
+import os
+import sys
+import time
+import numpy as np
+from settings import load_settings
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Keys of the song files (staging_songs, P4 song_data_schema) and of the
+# event logs (staging_events, P4 log_data_schema), in the order of the
+# Udacity files.
+SONG_KEYS = ['num_songs', 'artist_id', 'artist_latitude', 'artist_longitude', 'artist_location',
+             'artist_name', 'song_id', 'title', 'duration', 'year']
+EVENT_KEYS = ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+              'level', 'location', 'method', 'page', 'registration', 'sessionId', 'song',
+              'status', 'ts', 'userAgent', 'userId']
+
+# Pages of the non-NextSong events and their relative frequency.
+OTHER_PAGES = [('Home', 0.45), ('Logout', 0.12), ('Login', 0.12), ('Settings', 0.06),
+               ('Add to Playlist', 0.1), ('Thumbs Up', 0.1), ('Help', 0.05)]
+FIRST_NAMES = ['Jacqueline', 'Kevin', 'Lily', 'Ryan', 'Chloe', 'Tegan', 'Jacob', 'Kate', 'Aleena',
+               'Mohammad', 'Matthew', 'Layla', 'Avery', 'Rylan', 'Celeste', 'Jayden']
+LAST_NAMES = ['Lynch', 'Arellano', 'Koch', 'Smith', 'Cuevas', 'Levine', 'Klein', 'Harrell',
+              'Kirby', 'Rodriguez', 'Jones', 'Griffin', 'Watkins', 'George', 'Williams', 'Graves']
+LOCATIONS = ['Atlanta-Sandy Springs-Roswell, GA', 'San Francisco-Oakland-Hayward, CA',
+             'Portland-South Portland, ME', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'New York-Newark-Jersey City, NY-NJ-PA', 'Lansing-East Lansing, MI',
+             'Waterloo-Cedar Falls, IA', 'Tampa-St. Petersburg-Clearwater, FL']
+USER_AGENTS = [
+    '"Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.125 Safari/537.36"',
+    '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.78.2 (KHTML, like Gecko) Version/7.0.6 Safari/537.78.2"',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0',
+    '"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"']
+
+_catalogs = {}
+
+
+def generator_options(config, events):
+    """
+    Returns the scale, skew and layout of the generated data ([GENERATOR]
+    section). Users, songs and artists default to a share of the events.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * events int - Number of events
+    """
+    section = 'GENERATOR'
+    return {
+        'events': events,
+        'users': config.getint(section, 'USERS', fallback=0) or max(events // 1000, 100),
+        'songs': config.getint(section, 'SONGS', fallback=0) or max(events // 100, 1000),
+        'artists': config.getint(section, 'ARTISTS', fallback=0) or max(events // 1000, 100),
+        'skew': config.getfloat(section, 'ZIPF_SKEW', fallback=1.1),
+        'unknown_song_rate': config.getfloat(section, 'UNKNOWN_SONG_RATE', fallback=0.05),
+        'next_song_rate': config.getfloat(section, 'NEXT_SONG_RATE', fallback=0.8),
+        'start_date': config.get(section, 'START_DATE', fallback='2018-11-01'),
+        'end_date': config.get(section, 'END_DATE', fallback='2018-11-30'),
+        'file_format': config.get(section, 'FORMAT', fallback='json'),
+        'rows_per_shard': config.getint(section, 'ROWS_PER_SHARD', fallback=500000),
+        'workers': config.getint(section, 'WORKERS', fallback=os.cpu_count() or 1),
+        'seed': config.getint(section, 'SEED', fallback=42)
+    }
+
+
+def zipf_cdf(n, skew):
+    """
+    Returns the cumulative distribution of a Zipf law over ranks 1..n:
+    P(rank k) is proportional to 1 / k^skew.
+
+    INPUTS:
+    * n int - Number of ranks
+    * skew float - Exponent (0: uniform, ~1: real listening data)
+    """
+    weights = 1.0 / np.power(np.arange(1, n + 1, dtype=np.float64), skew)
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def zipf_sample(rng, cdf, size):
+    """
+    Draws `size` 0-based ranks from a Zipf distribution.
+
+    INPUTS:
+    * rng numpy Generator
+    * cdf array returned by zipf_cdf()
+    * size int - Number of draws
+    """
+    return np.minimum(np.searchsorted(cdf, rng.random(size)), len(cdf) - 1)
+
+
+def song_catalog(options):
+    """
+    Returns the artist of every song and the song CDF. The artists of the
+    songs are Zipf-distributed too, so popular artists have many songs.
+    Computed once per process from the seed, so every worker agrees.
+
+    INPUT:
+    * options dictionary returned by generator_options()
+    """
+    key = (options['songs'], options['artists'], options['skew'], options['seed'])
+    if key not in _catalogs:
+        rng = np.random.default_rng(options['seed'])
+        song_artists = zipf_sample(rng, zipf_cdf(options['artists'], options['skew']),
+                                   options['songs'])
+        _catalogs[key] = (song_artists, zipf_cdf(options['songs'], options['skew']))
+    return _catalogs[key]
+
+
+def song_rows(options, first, last):
+    """
+    Returns the song records of the songs first..last-1.
+
+    INPUTS:
+    * options dictionary returned by generator_options()
+    * first int - First song
+    * last int - Last song (excluded)
+    """
+    song_artists, _ = song_catalog(options)
+    rng = np.random.default_rng([options['seed'], 1, first])
+    rows = []
+    for song, duration, year in zip(range(first, last), rng.uniform(90, 420, last - first),
+                                    rng.integers(1950, 2019, last - first)):
+        artist = int(song_artists[song])
+        rows.append({
+            'num_songs': 1,
+            'artist_id': 'AR{:016d}'.format(artist),
+            'artist_latitude': None if artist % 3 else round(25 + artist % 24 + 0.5, 5),
+            'artist_longitude': None if artist % 3 else round(-70 - artist % 50 - 0.5, 5),
+            'artist_location': '' if artist % 3 else LOCATIONS[artist % len(LOCATIONS)],
+            'artist_name': 'Artist {}'.format(artist),
+            'song_id': 'SO{:016d}'.format(song),
+            'title': 'Song {}'.format(song),
+            'duration': round(float(duration), 5),
+            'year': 0 if song % 10 == 0 else int(year)
+        })
+    return rows
+
+
+def event_rows(options, day, shard, count, first_event):
+    """
+    Returns `count` events of one day, in time order. Songs (and so artists)
+    follow the Zipf law, users are drawn uniformly and play in sessions.
+    A quarter of the users are paid and another quarter upgrade from free to
+    paid on a day of the range that depends on the user, so their level changes.
+
+    INPUTS:
+    * options dictionary returned by generator_options()
+    * day datetime - Day of the events
+    * shard int - Shard of the day (seeds the draws)
+    * count int - Number of events
+    * first_event int - Index of the first event over the whole run, so the
+      session ids are unique and fit in an INTEGER
+    """
+    song_artists, song_cdf = song_catalog(options)
+    rng = np.random.default_rng([options['seed'], 2, day.toordinal(), shard])
+    day_ms = int((day - datetime(1970, 1, 1)).total_seconds() * 1000)
+    start = datetime.strptime(options['start_date'], '%Y-%m-%d')
+    days = (datetime.strptime(options['end_date'], '%Y-%m-%d') - start).days + 1
+    timestamps = np.sort(rng.integers(day_ms, day_ms + 86400000, count))
+    songs = zipf_sample(rng, song_cdf, count)
+    is_play = rng.random(count) < options['next_song_rate']
+    is_unknown = rng.random(count) < options['unknown_song_rate']
+    lengths = rng.uniform(90, 420, count)
+    other_pages = rng.choice([page for page, _ in OTHER_PAGES], count,
+                             p=[weight / sum(weight for _, weight in OTHER_PAGES)
+                                for _, weight in OTHER_PAGES])
+    # Sessions of 1 to 40 events, each of a single user.
+    session_users = rng.integers(0, options['users'], count)
+    session_lengths = rng.integers(1, 41, count)
+    rows = []
+    session, item, remaining, user = first_event, 0, 0, 0
+    for index in range(count):
+        if remaining == 0:
+            session, item = session + 1, 0
+            remaining, user = int(session_lengths[index]), int(session_users[index])
+        remaining -= 1
+        item += 1
+        paid = user % 4 == 0 or (user % 4 == 1 and (day - start).days >= user % days)
+        song = int(songs[index])
+        play = bool(is_play[index])
+        if play and is_unknown[index]:
+            artist, title = 'Unknown Artist {}'.format(song), 'Unknown Song {}'.format(song)
+        else:
+            artist, title = 'Artist {}'.format(int(song_artists[song])), 'Song {}'.format(song)
+        rows.append({
+            'artist': artist if play else None,
+            'auth': 'Logged In',
+            'firstName': FIRST_NAMES[user % len(FIRST_NAMES)],
+            'gender': 'F' if user % 2 else 'M',
+            'itemInSession': item,
+            'lastName': LAST_NAMES[(user // len(FIRST_NAMES)) % len(LAST_NAMES)],
+            'length': round(float(lengths[index]), 5) if play else None,
+            'level': 'paid' if paid else 'free',
+            'location': LOCATIONS[user % len(LOCATIONS)],
+            'method': 'PUT' if play else 'GET',
+            'page': 'NextSong' if play else str(other_pages[index]),
+            'registration': 1500000000000 + user * 1000,
+            'sessionId': session,
+            'song': title if play else None,
+            'status': 200,
+            'ts': int(timestamps[index]),
+            'userAgent': USER_AGENTS[user % len(USER_AGENTS)],
+            'userId': str(user + 1)
+        })
+    return rows
+
+
+def write_rows(path, rows, keys, file_format):
+    """
+    Writes records as gzip JSON lines (one object per line, as COPY and
+    spark.read.json expect) or as a Parquet file. Returns the file size.
+
+    INPUTS:
+    * path string - Output file without extension
+    * rows list of dictionaries
+    * keys list of keys, in output order
+    * file_format string - 'json' or 'parquet'
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if file_format == 'parquet':
+        path += '.parquet'
+        pyarrow.parquet.write_table(
+            pyarrow.table({key: [row[key] for row in rows] for key in keys}), path)
+    else:
+        path += '.json.gz'
+        text = io.StringIO()
+        for row in rows:
+            text.write(json.dumps({key: row[key] for key in keys}))
+            text.write('\n')
+        with gzip.open(path, 'wt', compresslevel=1) as json_file:
+            json_file.write(text.getvalue())
+    return os.path.getsize(path)
+
+
+def generate_shard(task):
+    """
+    Generates and writes one shard. Returns (rows, bytes).
+
+    INPUT:
+    * task dictionary with options, output, kind ('songs' or 'events') and
+      the range of the shard
+    """
+    options = task['options']
+    if task['kind'] == 'songs':
+        rows = song_rows(options, task['first'], task['last'])
+        path = os.path.join(task['output'], 'song_data', 'part-{:05d}'.format(task['shard']))
+        keys = SONG_KEYS
+    else:
+        day = datetime.strptime(task['day'], '%Y-%m-%d')
+        rows = event_rows(options, day, task['shard'], task['count'], task['first_event'])
+        path = os.path.join(task['output'], 'log_data', day.strftime('%Y'), day.strftime('%m'),
+                            '{}-events-{:05d}'.format(task['day'], task['shard']))
+        keys = EVENT_KEYS
+    return len(rows), write_rows(path, rows, keys, options['file_format'])
+
+
+def plan_shards(options, output):
+    """
+    Splits the generation into shards of at most `rows_per_shard` rows:
+    ranges of songs, and per day of the date range, parts of its events.
+
+    INPUTS:
+    * options dictionary returned by generator_options()
+    * output string - Output directory
+    """
+    size = options['rows_per_shard']
+    tasks = [{'options': options, 'output': output, 'kind': 'songs', 'shard': shard,
+              'first': first, 'last': min(first + size, options['songs'])}
+             for shard, first in enumerate(range(0, options['songs'], size))]
+    start = datetime.strptime(options['start_date'], '%Y-%m-%d')
+    days = (datetime.strptime(options['end_date'], '%Y-%m-%d') - start).days + 1
+    first_event = 0
+    for offset in range(days):
+        day_events = options['events'] // days + (1 if offset < options['events'] % days else 0)
+        for shard, first in enumerate(range(0, day_events, size)):
+            count = min(size, day_events - first)
+            tasks.append({'options': options, 'output': output, 'kind': 'events',
+                          'day': (start + timedelta(days=offset)).strftime('%Y-%m-%d'),
+                          'shard': shard, 'count': count, 'first_event': first_event})
+            first_event += count
+    return tasks
+
+
+def generate(options, output):
+    """
+    Generates the song files and the event logs in parallel, one shard per
+    task, each written as soon as it is generated so memory stays bounded by
+    one shard per worker. Returns the rows and bytes written per kind.
+
+    INPUTS:
+    * options dictionary returned by generator_options()
+    * output string - Output directory
+    """
+    if options['file_format'] == 'parquet' and pyarrow is None:
+        raise ImportError("pyarrow is required to write Parquet files")
+    tasks = plan_shards(options, output)
+    totals = {'songs': [0, 0], 'events': [0, 0]}
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+        for task, (rows, size) in zip(tasks, executor.map(generate_shard, tasks)):
+            totals[task['kind']][0] += rows
+            totals[task['kind']][1] += size
+    seconds = time.time() - start
+    for kind, (rows, size) in totals.items():
+        print("- ", kind, ": ", rows, " rows, ", size, " bytes", sep='')
+    print("- ", len(tasks), " files in ", round(seconds, 1), "s (",
+          int(sum(rows for rows, _ in totals.values()) / max(seconds, 1e-9)), " rows/s)", sep='')
+    return totals
+
+
+def main():
+    """
+    Generates Sparkify song files and event logs for scale tests.
+    Usage: python3 generate_data.py <output_dir> [events]
+    The songs are written under <output_dir>/song_data and the events under
+    <output_dir>/log_data/YYYY/MM, as in the Udacity bucket.
+    """
+    if len(sys.argv) < 2:
+        print("- Usage: python3 generate_data.py <output_dir> [events]")
+        return
+    config = load_settings()
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    options = generator_options(config, events)
+    print("1. Generating ", events, " events, ", options['songs'], " songs, ", options['artists'],
+          " artists and ", options['users'], " users (Zipf skew ", options['skew'], ")", sep='')
+    generate(options, sys.argv[1])
+
+
+if __name__ == "__main__":
+    main()
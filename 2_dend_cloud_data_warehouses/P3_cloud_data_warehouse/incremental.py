@@ -0,0 +1,170 @@
+import json
+import os
+import boto3
+
+import sql_queries
+from local_stand_in import is_local_stand_in_enabled, list_local_files
+from scheduler import target_table
+from time_dimension import ensure_calendar
+from settings import write_json_atomically
+
+
+def read_state(path):
+    """
+    Reads the state of the previous incremental runs.
+    Returns a dictionary with the loaded log and song keys, or None if there
+    has not been any run yet.
+
+    INPUT:
+    * path string - JSON state file
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as state_file:
+        return json.load(state_file)
+
+
+def write_state(path, state):
+    """
+    Writes the state file atomically: a temporary file in the same directory
+    replaces the previous one, so a crash never leaves a truncated state.
+
+    INPUTS:
+    * path string - JSON state file
+    * state dictionary with the loaded keys
+    """
+    write_json_atomically(path, state)
+
+
+def split_s3_path(path):
+    """
+    Splits 's3://bucket/prefix' (quotes allowed) into (bucket, prefix).
+
+    INPUT:
+    * path string - S3 path
+    """
+    path = path.strip("'")[len('s3://'):]
+    bucket, _, prefix = path.partition('/')
+    return bucket, prefix
+
+
+def list_data_keys(config, table):
+    """
+    Lists the data objects of a staging table: the files under its [LOCAL]
+    path (STAGING_EVENTS, STAGING_SONGS) when the stand-in is enabled,
+    otherwise the keys under [S3] LOG_DATA or SONG_DATA.
+    Returns the full path of every object ('s3://bucket/key' in S3).
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * table string - 'staging_events' or 'staging_songs'
+    """
+    if is_local_stand_in_enabled(config):
+        return list_local_files(config['LOCAL'][table.upper()])
+
+    s3 = boto3.client('s3',
+        region_name=config['AWS']['REGION_NAME'],
+        aws_access_key_id=config['AWS']['KEY'],
+        aws_secret_access_key=config['AWS']['SECRET']
+    )
+    prefix_option = 'LOG_DATA' if table == 'staging_events' else 'SONG_DATA'
+    bucket, prefix = split_s3_path(config['S3'][prefix_option])
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.json'):
+                keys.append('s3://{}/{}'.format(bucket, obj['Key']))
+    return keys
+
+
+def copy_new_files(cur, table, copy_template, keys, loaded_keys, prefix):
+    """
+    Copies the files of a staging table not loaded by a previous run, or the
+    whole prefix when the table has not been loaded yet (loaded_keys is None).
+    Returns the keys of the copied files.
+
+    INPUTS:
+    * cur the cursor variable
+    * table string - Name of the staging table
+    * copy_template string - COPY statement with a {source} placeholder
+    * keys list of the data objects of the table
+    * loaded_keys list of the objects already loaded, or None
+    * prefix string - Source of the first load
+    """
+    if loaded_keys is None:
+        print("- ", table, ": no previous run, loading the whole prefix.", sep='')
+        cur.execute(copy_template.format(source="'{}'".format(prefix.strip("'"))))
+        return keys
+    loaded = set(loaded_keys)
+    new_keys = [key for key in keys if key not in loaded]
+    print("- ", table, ": ", len(new_keys), " new files (", len(loaded), " already loaded).",
+          sep='')
+    for key in new_keys:
+        cur.execute(copy_template.format(source="'{}'".format(key)))
+        print("- File loaded: `", key, "`", sep='')
+    return new_keys
+
+
+def load_incrementally(cur, conn, config):
+    """
+    Loads only the log and song files that have not been loaded yet. The first
+    run loads the whole LOG_DATA and SONG_DATA prefixes.
+    staging_events is cleared and only holds the new log files, while
+    staging_songs keeps the songs of the previous runs for the songplays join.
+    The new song files are copied into staging_songs_delta, which is merged
+    into staging_songs and is the only source of the songs and artists.
+    The tables are loaded and transformed in one transaction and the state
+    file is written after the commit. If that write fails, the next run loads
+    the same files again: the reloaded songs replace their rows in staging_songs,
+    the dimensions are merged and the events already in songplays are skipped.
+    Returns the new state.
+
+    INPUTS:
+    * cur the cursor variable
+    * conn the connection to the Postgres DB
+    * config ConfigParser() object with parameters
+    """
+    state_path = config.get('ETL', 'STATE_PATH', fallback='etl_state.json')
+    state = read_state(state_path) or {'loaded_keys': None}
+    if is_local_stand_in_enabled(config):
+        prefixes = {'staging_events': config['LOCAL']['STAGING_EVENTS'],
+                    'staging_songs': config['LOCAL']['STAGING_SONGS']}
+    else:
+        prefixes = {'staging_events': config['S3']['LOG_DATA'],
+                    'staging_songs': config['S3']['SONG_DATA']}
+    print("1. Incremental load of the staging tables.")
+
+    cur.execute(sql_queries.staging_events_clear)
+    new_keys = copy_new_files(
+        cur, 'staging_events', sql_queries.staging_events_copy_template,
+        list_data_keys(config, 'staging_events'), state['loaded_keys'],
+        prefixes['staging_events'])
+    if state.get('loaded_song_keys') is None:
+        cur.execute(sql_queries.staging_songs_clear)
+    cur.execute(sql_queries.staging_songs_delta_create)
+    new_song_keys = copy_new_files(
+        cur, 'staging_songs_delta', sql_queries.staging_songs_delta_copy_template,
+        list_data_keys(config, 'staging_songs'), state.get('loaded_song_keys'),
+        prefixes['staging_songs'])
+    cur.execute(sql_queries.staging_songs_merge)
+
+    for query in sql_queries.staging_key_queries:
+        cur.execute(query)
+        print("- Song keys computed: `", query.split()[1], "`", sep='')
+    if config.get('ETL', 'TIME_DIMENSION', fallback='extract') == 'calendar':
+        ensure_calendar(cur)
+
+    print("2. Transforming the new files.")
+    for query in sql_queries.incremental_insert_table_queries:
+        cur.execute(query)
+        print("- Table loaded: `", target_table(query), "`", sep='')
+    cur.execute(sql_queries.staging_songs_delta_drop)
+    conn.commit()
+
+    state['loaded_keys'] = sorted(set(state['loaded_keys'] or []) | set(new_keys))
+    state['loaded_song_keys'] = sorted(
+        set(state.get('loaded_song_keys') or []) | set(new_song_keys))
+    write_state(state_path, state)
+    print("- Files loaded so far: ", len(state['loaded_keys']), " log, ",
+          len(state['loaded_song_keys']), " song", sep='')
+    return state
@@ -0,0 +1,193 @@
+from datetime import datetime
+import json
+import os
+import re
+import statistics
+import time
+from botocore.exceptions import ClientError
+import create_tables
+import etl
+from connection import get_pool
+from waiter import record_wait
+
+
+def snapshot_mode(config):
+    """
+    Returns True when the cluster is snapshotted on teardown and restored on
+    start (DWH_LIFECYCLE_MODE = snapshot) instead of deleted and recreated.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    return config.get('DWH', 'DWH_LIFECYCLE_MODE', fallback='delete') == 'snapshot'
+
+
+def snapshot_identifier(cluster_identifier, now=None):
+    """
+    Returns the name of the final snapshot of a cluster: lowercase letters,
+    digits and hyphens, followed by the creation time.
+    ('sparkifyCluster' -> 'sparkifycluster-20181130-235959')
+
+    INPUTS:
+    * cluster_identifier string - Cluster identifier
+    * now datetime - Creation time (default: now)
+    """
+    prefix = re.sub(r"[^a-z0-9-]", '-', cluster_identifier.lower())
+    return '{}-{}'.format(prefix, (now or datetime.utcnow()).strftime('%Y%m%d-%H%M%S'))
+
+
+def list_snapshots(redshift, cluster_identifier):
+    """
+    Returns the available manual snapshots of a cluster, newest first.
+
+    INPUTS:
+    * redshift boto3 Redshift client
+    * cluster_identifier string - Cluster identifier
+    """
+    try:
+        snapshots = redshift.describe_cluster_snapshots(
+            ClusterIdentifier=cluster_identifier, SnapshotType='manual')['Snapshots']
+    except ClientError as e:
+        if "ClusterNotFound" in e.response['Error']['Code'] or \
+                "ClusterSnapshotNotFound" in e.response['Error']['Code']:
+            return []
+        raise
+    snapshots = [snapshot for snapshot in snapshots if snapshot['Status'] == 'available']
+    return sorted(snapshots, key=lambda snapshot: snapshot['SnapshotCreateTime'], reverse=True)
+
+
+def restore_cluster(redshift, config, arn):
+    """
+    Restores the cluster from its latest snapshot. Returns the snapshot
+    identifier, or None when there is no snapshot to restore from.
+
+    INPUTS:
+    * redshift boto3 Redshift client
+    * config ConfigParser() object with parameters
+    * arn string - ARN of the IAM role of the cluster
+    """
+    snapshots = list_snapshots(redshift, config['DWH']['DWH_CLUSTER_IDENTIFIER'])
+    if not snapshots:
+        print("- No snapshot of", config['DWH']['DWH_CLUSTER_IDENTIFIER'], "to restore from")
+        return None
+    snapshot = snapshots[0]['SnapshotIdentifier']
+    print("- Restoring Redshift cluster from snapshot:", snapshot)
+    redshift.restore_from_cluster_snapshot(
+        ClusterIdentifier=config['DWH']['DWH_CLUSTER_IDENTIFIER'],
+        SnapshotIdentifier=snapshot,
+        NodeType=config['DWH']['DWH_NODE_TYPE'],
+        NumberOfNodes=int(config['DWH']['DWH_NUM_NODES']),
+        IamRoles=[arn])
+    return snapshot
+
+
+def delete_cluster_with_snapshot(redshift, config):
+    """
+    Deletes the cluster after taking a final snapshot. Returns the snapshot
+    identifier.
+
+    INPUTS:
+    * redshift boto3 Redshift client
+    * config ConfigParser() object with parameters
+    """
+    snapshot = snapshot_identifier(config['DWH']['DWH_CLUSTER_IDENTIFIER'])
+    print('Deleting Redshift cluster with final snapshot', snapshot)
+    redshift.delete_cluster(ClusterIdentifier=config['DWH']['DWH_CLUSTER_IDENTIFIER'],
+                            SkipFinalClusterSnapshot=False,
+                            FinalClusterSnapshotIdentifier=snapshot)
+    return snapshot
+
+
+def prune_snapshots(redshift, config):
+    """
+    Deletes the oldest snapshots of the cluster, keeping the newest
+    DWH_SNAPSHOT_RETENTION ones. Returns the deleted identifiers.
+
+    INPUTS:
+    * redshift boto3 Redshift client
+    * config ConfigParser() object with parameters
+    """
+    retention = config.getint('DWH', 'DWH_SNAPSHOT_RETENTION', fallback=2)
+    deleted = []
+    for snapshot in list_snapshots(redshift, config['DWH']['DWH_CLUSTER_IDENTIFIER'])[retention:]:
+        redshift.delete_cluster_snapshot(SnapshotIdentifier=snapshot['SnapshotIdentifier'])
+        deleted.append(snapshot['SnapshotIdentifier'])
+    if deleted:
+        print("- Old snapshots deleted:", ", ".join(deleted))
+    return deleted
+
+
+def is_warehouse_loaded(config):
+    """
+    Runs the first query against the warehouse. Returns True when songplays
+    holds rows, False when the tables are missing or empty.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    pool = get_pool(config)
+    try:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM songplays")
+                return cur.fetchone()[0] > 0
+    except Exception as e:
+        print("- Warehouse not loaded:", str(e).strip())
+        return False
+    finally:
+        pool.closeall()
+
+
+def full_reload():
+    """
+    Creates the tables and runs the whole ETL, with the queries rendered
+    from the settings saved by the provisioning (ARN and endpoint).
+    """
+    create_tables.main()
+    etl.main()
+
+
+def prepare_warehouse(config, restored_from, origin):
+    """
+    Makes the warehouse queryable after the cluster is available: a restored
+    cluster is queried directly, a new (or empty) one is fully reloaded.
+    Records the time from start to first query per path and prints the
+    reduction of the restore over the full reload.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * restored_from string - Snapshot identifier, or None for a new cluster
+    * origin float - time.time() when the start began
+    """
+    loaded = bool(restored_from) and is_warehouse_loaded(config)
+    if not loaded:
+        print("- Full reload: create_tables.py and etl.py")
+        full_reload()
+        is_warehouse_loaded(config)
+    path = 'restore' if loaded else 'reload'
+    seconds = time.time() - origin
+    print("- Start to first query (", path, "): ", round(seconds), "s", sep='')
+    history_path = config.get('DWH', 'DWH_WAIT_HISTORY_PATH', fallback='')
+    record_wait(history_path, 'first_query_' + path, seconds)
+    print_first_query_reduction(history_path)
+    return path
+
+
+def print_first_query_reduction(history_path):
+    """
+    Prints the median start-to-first-query time of each path and the
+    reduction of the restore, when both have been recorded.
+
+    INPUT:
+    * history_path string - JSON history written by waiter.record_wait()
+    """
+    if not history_path or not os.path.exists(history_path):
+        return
+    with open(history_path) as history_file:
+        history = json.load(history_file)
+    restore, reload = history.get('first_query_restore'), history.get('first_query_reload')
+    if not restore or not reload:
+        return
+    restore, reload = statistics.median(restore), statistics.median(reload)
+    print("- Median start to first query: restore ", round(restore), "s, full reload ",
+          round(reload), "s (", round(100.0 * (reload - restore) / reload, 1), "% less)", sep='')
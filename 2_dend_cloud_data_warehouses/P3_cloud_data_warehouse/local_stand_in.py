@@ -0,0 +1,261 @@
+import csv
+from datetime import datetime
+from decimal import Decimal
+import glob
+import gzip
+import io
+import json
+import os
+import re
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+COPY_PATTERN = re.compile(
+    r"COPY\s+(?P<table>\w+)\s*(?:\([^)]*\))?\s*FROM\s+'?(?P<source>[^'\s]+)'?", re.IGNORECASE)
+INTEGER_TYPES = ('smallint', 'int', 'integer', 'bigint')
+
+
+def to_integer(value):
+    """
+    Converts a JSON number or numeric string loaded into an integer column, as
+    COPY does: 1.540919166796E12 (a float in the JSON) becomes 1540919166796.
+
+    INPUT:
+    * value number or string
+    """
+    if isinstance(value, int):
+        return value
+    return int(Decimal(str(value)))
+
+
+def iter_json_records(path):
+    """
+    Yields the JSON records stored in a file, one dictionary at a time.
+    It accepts one object per line (log_data), a single object (song_data)
+    and a JSON array with one object per line (log_data_sample.json).
+    Gzip files (.gz) are decompressed on the fly.
+
+    INPUT:
+    * path string - Path to the JSON file
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as json_file:
+        for record in iter_json_lines(json_file):
+            yield record
+
+
+def iter_json_lines(lines):
+    """
+    Yields the JSON records of an iterable of lines (see iter_json_records).
+
+    INPUT:
+    * lines iterable of strings
+    """
+    for line in lines:
+        line = line.strip().rstrip(',')
+        if line in ('', '[', ']'):
+            continue
+        yield json.loads(line)
+
+
+def list_local_files(source):
+    """
+    Lists the JSON files (plain or gzip) under a local directory, a single
+    file, a glob or the entries of a COPY manifest (.manifest).
+
+    INPUT:
+    * source string - Local path standing in for an S3 prefix
+    """
+    if source.endswith('.manifest') and os.path.isfile(source):
+        with open(source) as manifest:
+            return [entry['url'] for entry in json.load(manifest)['entries']]
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '**', '*.json'), recursive=True) +
+                      glob.glob(os.path.join(source, '**', '*.json.gz'), recursive=True))
+    return sorted(glob.glob(source))
+
+
+def to_postgres(query):
+    """
+    Translates the Redshift-only parts of a Sparkify query to PostgreSQL.
+    Distribution, sort and encoding clauses are dropped, IDENTITY columns are
+    mapped to Postgres identities and FNV_HASH to hashtextextended. PRIMARY KEY and REFERENCES are dropped too,
+    because Redshift does not enforce them and the inserts rely on that.
+
+    INPUT:
+    * query string - Redshift SQL statement
+    """
+    query = re.sub(r"\bIDENTITY\((\d+),\s*(\d+)\)",
+                   r"GENERATED BY DEFAULT AS IDENTITY (START WITH \1 INCREMENT BY \2 MINVALUE \1)",
+                   query, flags=re.IGNORECASE)
+    query = re.sub(r"\bPRIMARY\s+KEY\b", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\bREFERENCES\s+\w+\s*\(\w+\)", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\bDISTSTYLE\s+\w+", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\b(DISTKEY|SORTKEY)\s*\([\w\s,]+\)", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\b(DISTKEY|SORTKEY)\b", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\bENCODE\s+\w+", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\bFNV_HASH\(", "hashtextextended(", query, flags=re.IGNORECASE)
+    return query
+
+
+class LocalStandInCursor:
+    """
+    Cursor wrapper that lets the Redshift queries run against a local
+    PostgreSQL. COPY statements are replaced by a load of local JSON files
+    and every other statement goes through to_postgres().
+    """
+
+    def __init__(self, cursor, config):
+        self._cursor = cursor
+        self._config = config
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._cursor.close()
+
+    def execute(self, query, vars=None):
+        if query.lstrip().upper().startswith('COPY'):
+            return self.copy_from_local(query)
+        return self._cursor.execute(to_postgres(query), vars)
+
+    def local_source(self, table, source):
+        """
+        Returns the local path to load: the COPY source itself when it is a
+        local path, otherwise the path configured for the table in [LOCAL].
+
+        INPUTS:
+        * table string - Name of the staging table
+        * source string - FROM clause of the COPY statement
+        """
+        if '://' not in source and list_local_files(source):
+            return source
+        return self._config['LOCAL'][table.upper()]
+
+    def table_columns(self, table):
+        """
+        Returns the (name, data type) pairs of a table in ordinal order.
+
+        INPUT:
+        * table string - Name of the table
+        """
+        self._cursor.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_name = %s ORDER BY ordinal_position", (table.lower(),))
+        return self._cursor.fetchall()
+
+    def copy_from_local(self, query):
+        """
+        Loads the local JSON files of the COPY source, or the ones configured for
+        the target table when the source is in S3.
+        Keys are matched to columns case-insensitively, as JSON 'auto' does,
+        empty strings become NULL (EMPTYASNULL, BLANKSASNULL), epoch
+        milliseconds are converted for TIMESTAMP columns and numbers are cast
+        to int for integer columns.
+
+        INPUT:
+        * query string - Redshift COPY statement
+        """
+        match = COPY_PATTERN.search(query)
+        table = match.group('table')
+        columns = self.table_columns(table)
+        if re.search(r'\bPARQUET\b', query, re.IGNORECASE):
+            return self.copy_parquet_from_local(table, columns, match.group('source'))
+        if re.search(r'\bCSV\b', query, re.IGNORECASE):
+            return self.copy_csv_from_local(table, columns, match.group('source'))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for path in list_local_files(self.local_source(table, match.group('source'))):
+            for record in iter_json_records(path):
+                record = {key.lower(): value for key, value in record.items()}
+                row = []
+                for name, data_type in columns:
+                    value = record.get(name)
+                    if isinstance(value, str) and not value.strip():
+                        value = None
+                    if value is not None and data_type.startswith('timestamp'):
+                        value = datetime.utcfromtimestamp(value / 1000.0).isoformat()
+                    elif value is not None and data_type in INTEGER_TYPES:
+                        value = to_integer(value)
+                    row.append(value)
+                writer.writerow(row)
+        buffer.seek(0)
+        self._cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN WITH CSV".format(
+                table, ', '.join(name for name, _ in columns)),
+            buffer)
+
+    def copy_csv_from_local(self, table, columns, source):
+        """
+        Loads the gzip, pipe-delimited CSV chunks written by preprocess.py.
+
+        INPUTS:
+        * table string - Name of the staging table
+        * columns list of (name, data type) of the table
+        * source string - FROM clause of the COPY statement
+        """
+        for path in list_local_files(source):
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt') as csv_file:
+                self._cursor.copy_expert(
+                    "COPY {} ({}) FROM STDIN WITH (FORMAT csv, DELIMITER '|')".format(
+                        table, ', '.join(name for name, _ in columns)),
+                    csv_file)
+
+
+    def copy_parquet_from_local(self, table, columns, source):
+        """
+        Loads the Parquet chunks written by preprocess.py, read with pyarrow
+        and streamed to COPY FROM STDIN as CSV.
+
+        INPUTS:
+        * table string - Name of the staging table
+        * columns list of (name, data type) of the table
+        * source string - FROM clause of the COPY statement
+        """
+        if pyarrow is None:
+            raise ImportError("pyarrow is required to load Parquet files")
+        names = [name for name, _ in columns]
+        for path in list_local_files(source):
+            data = pyarrow.parquet.read_table(path).select(names)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for record in data.to_pylist():
+                writer.writerow([record[name] for name in names])
+            buffer.seek(0)
+            self._cursor.copy_expert(
+                "COPY {} ({}) FROM STDIN WITH CSV".format(table, ', '.join(names)), buffer)
+
+
+class LocalStandInConnection:
+    """
+    Connection wrapper whose cursors are LocalStandInCursor objects.
+    """
+
+    def __init__(self, connection, config):
+        self._connection = connection
+        self._config = config
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return LocalStandInCursor(self._connection.cursor(*args, **kwargs), self._config)
+
+
+def is_local_stand_in_enabled(config):
+    """
+    Returns True when the [LOCAL] section asks for the PostgreSQL stand-in.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    return config.has_section('LOCAL') and config['LOCAL'].get('ENABLED', 'False') == 'True'
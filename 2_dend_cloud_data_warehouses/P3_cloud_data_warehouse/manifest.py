@@ -0,0 +1,310 @@
+from collections import Counter
+import gzip
+import heapq
+import json
+import math
+import os
+import sys
+import boto3
+from local_stand_in import list_local_files
+from settings import load_settings
+
+
+# Slices per node of each Redshift node type.
+SLICES_PER_NODE = {
+    'dc2.large': 2,
+    'dc2.8xlarge': 16,
+    'ds2.xlarge': 2,
+    'ds2.8xlarge': 16,
+    'ra3.xlplus': 2,
+    'ra3.4xlarge': 4,
+    'ra3.16xlarge': 16
+}
+
+
+class LocalBackend:
+    """
+    Local filesystem standing in for S3, to build and test manifests offline.
+    """
+
+    def list(self, prefix):
+        """
+        Returns the (path, size) of the JSON files under a local directory,
+        a single file or a glob.
+
+        INPUT:
+        * prefix string - Local path
+        """
+        return [(path, os.path.getsize(path)) for path in list_local_files(prefix)]
+
+    def read(self, path):
+        with open(path, 'rb') as source:
+            return source.read()
+
+    def write(self, path, body):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'wb') as target:
+            target.write(body)
+
+
+class S3Backend:
+    """
+    S3 objects addressed as 's3://bucket/key'.
+    """
+
+    def __init__(self, **client_kwargs):
+        """
+        INPUT:
+        * client_kwargs arguments of boto3.client('s3') (region, credentials)
+        """
+        self.client_kwargs = client_kwargs
+        self.s3 = boto3.client('s3', **client_kwargs)
+
+    def __getstate__(self):
+        # boto3 clients cannot be pickled: worker processes create their own.
+        return self.client_kwargs
+
+    def __setstate__(self, client_kwargs):
+        self.__init__(**client_kwargs)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Returns a backend using the credentials of the [AWS] section.
+
+        INPUT:
+        * config ConfigParser() object with parameters
+        """
+        return cls(
+            region_name=config['AWS']['REGION_NAME'],
+            aws_access_key_id=config['AWS']['KEY'],
+            aws_secret_access_key=config['AWS']['SECRET']
+        )
+
+    @staticmethod
+    def split(path):
+        bucket, _, key = path.strip("'")[len('s3://'):].partition('/')
+        return bucket, key
+
+    def list(self, prefix):
+        """
+        Returns the (path, size) of the JSON objects under an S3 prefix.
+
+        INPUT:
+        * prefix string - 's3://bucket/prefix'
+        """
+        bucket, key_prefix = self.split(prefix)
+        objects = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=key_prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith('.json'):
+                    objects.append(('s3://{}/{}'.format(bucket, obj['Key']), obj['Size']))
+        return sorted(objects)
+
+    def read(self, path):
+        bucket, key = self.split(path)
+        return self.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def iter_lines(self, path):
+        """
+        Yields the lines of an object as it is downloaded, without reading
+        the whole object into memory.
+
+        INPUT:
+        * path string - 's3://bucket/key'
+        """
+        bucket, key = self.split(path)
+        for line in self.s3.get_object(Bucket=bucket, Key=key)['Body'].iter_lines():
+            yield line.decode('utf-8')
+
+    def write(self, path, body):
+        bucket, key = self.split(path)
+        self.s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def slice_count(config):
+    """
+    Returns the number of slices of the cluster described in the [DWH] section.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    nodes = 1
+    if config['DWH']['DWH_CLUSTER_TYPE'] == 'multi-node':
+        nodes = int(config['DWH']['DWH_NUM_NODES'])
+    return nodes * SLICES_PER_NODE.get(config['DWH']['DWH_NODE_TYPE'], 2)
+
+
+def plan_chunks(objects, slices, chunk_bytes):
+    """
+    Groups the input objects into chunks of similar size. The number of chunks
+    is a multiple of the slice count, so every slice loads the same amount of
+    files. Objects bigger than a chunk are split into line ranges, and the
+    largest objects are split further while there are fewer pieces than
+    chunks, so no chunk is left empty.
+    Returns a list of chunks, each one a list of (path, part, parts).
+
+    INPUTS:
+    * objects list of (path, size)
+    * slices int - Slices of the cluster
+    * chunk_bytes int - Target size of a chunk
+    """
+    total = sum(size for _, size in objects)
+    count = slices * max(1, int(math.ceil(total / float(slices * chunk_bytes))))
+
+    # Objects by size of their pieces, largest first: (-piece size, path, size, parts).
+    splits = []
+    for path, size in objects:
+        parts = max(1, int(math.ceil(size / float(chunk_bytes))))
+        splits.append((-size / float(parts), path, size, parts))
+    heapq.heapify(splits)
+    pieces_count = sum(parts for _, _, _, parts in splits)
+    while splits and pieces_count < count:
+        _, path, size, parts = heapq.heappop(splits)
+        heapq.heappush(splits, (-size / float(parts + 1), path, size, parts + 1))
+        pieces_count += 1
+
+    pieces = []
+    for _, path, size, parts in splits:
+        for part in range(parts):
+            pieces.append((size / float(parts), path, part, parts))
+
+    # Largest pieces first, each one into the smallest chunk so far.
+    heap = [(0.0, index) for index in range(count)]
+    chunks = [[] for _ in range(count)]
+    for size, path, part, parts in sorted(pieces, reverse=True):
+        load, index = heapq.heappop(heap)
+        chunks[index].append((path, part, parts))
+        heapq.heappush(heap, (load + size, index))
+    return [sorted(chunk) for chunk in chunks if chunk]
+
+
+def read_lines(backend, path):
+    """
+    Returns the JSON lines of an object (plain or gzip).
+
+    INPUTS:
+    * backend LocalBackend or S3Backend
+    * path string - Object path
+    """
+    body = backend.read(path)
+    if path.endswith('.gz'):
+        body = gzip.decompress(body)
+    # Also accepts JSON arrays with one object per line (log_data_sample.json).
+    lines = [line.strip().rstrip(b',') for line in body.splitlines()]
+    return [line for line in lines if line not in (b'', b'[', b']')]
+
+
+def piece_lines(lines, part, parts):
+    """
+    Returns the lines of one piece of an object (all of them if parts=1).
+
+    INPUTS:
+    * lines list of the lines of the object
+    * part int - Index of the piece
+    * parts int - Number of pieces of the object
+    """
+    size = int(math.ceil(len(lines) / float(parts)))
+    return lines[part * size:(part + 1) * size]
+
+
+def write_chunks(backend, chunks, output_prefix, name):
+    """
+    Writes every chunk as a gzip file of newline-delimited JSON.
+    Each object is read once: a split object is kept until its last piece
+    is written. A chunk is skipped when its pieces hold no line (an object
+    with fewer lines than pieces).
+    Returns the manifest entries.
+
+    INPUTS:
+    * backend LocalBackend or S3Backend
+    * chunks list returned by plan_chunks()
+    * output_prefix string - Where the chunks are written
+    * name string - Prefix of the chunk files (e.g. 'staging_songs')
+    """
+    remaining = Counter(path for chunk in chunks for path, _, _ in chunk)
+    objects = {}
+    entries = []
+    for chunk in chunks:
+        lines = []
+        for path, part, parts in chunk:
+            if path not in objects:
+                objects[path] = read_lines(backend, path)
+            lines.extend(piece_lines(objects[path], part, parts))
+            remaining[path] -= 1
+            if not remaining[path]:
+                del objects[path]
+        if not lines:
+            continue
+        body = gzip.compress(b'\n'.join(lines) + b'\n')
+        url = '{}/{}/part-{:05d}.json.gz'.format(output_prefix.rstrip('/'), name, len(entries))
+        backend.write(url, body)
+        entries.append({'url': url, 'mandatory': True,
+                        'meta': {'content_length': len(body)}})
+    return entries
+
+
+def write_manifest(backend, entries, path):
+    """
+    Writes a COPY manifest listing the entries.
+
+    INPUTS:
+    * backend LocalBackend or S3Backend
+    * entries list of manifest entries
+    * path string - Manifest file
+    """
+    backend.write(path, json.dumps({'entries': entries}, indent=2).encode('utf-8'))
+
+
+def build_manifest(backend, source_prefix, output_prefix, name, slices, chunk_bytes):
+    """
+    Lists the input objects, regroups them into chunks and writes the chunks
+    and their manifest. Returns the path of the manifest.
+
+    INPUTS:
+    * backend LocalBackend or S3Backend
+    * source_prefix string - Input prefix (e.g. the song_data prefix)
+    * output_prefix string - Where the chunks and the manifest are written
+    * name string - Name of the target table
+    * slices int - Slices of the cluster
+    * chunk_bytes int - Target size of a chunk
+    """
+    objects = backend.list(source_prefix.strip("'"))
+    chunks = plan_chunks(objects, slices, chunk_bytes)
+    entries = write_chunks(backend, chunks, output_prefix, name)
+    print("- ", name, ": ", len(objects), " objects regrouped into ", len(entries),
+          " chunks for ", slices, " slices.", sep='')
+    path = '{}/{}.manifest'.format(output_prefix.rstrip('/'), name)
+    write_manifest(backend, entries, path)
+    print("- Manifest written:", path)
+    return path
+
+
+def main():
+    """
+    Builds the manifests of the staging tables.
+    Usage: python3 manifest.py [local]
+    With `local` the [LOCAL] paths are read and MANIFEST_PREFIX is a local
+    directory, to test the manifests with the local stand-in.
+    """
+    config = load_settings()
+
+    chunk_bytes = config.getint('ETL', 'MANIFEST_CHUNK_MB', fallback=64) * 1024 * 1024
+    slices = slice_count(config)
+    output_prefix = config['S3']['MANIFEST_PREFIX'].strip("'")
+    if len(sys.argv) > 1 and sys.argv[1] == 'local':
+        backend = LocalBackend()
+        sources = {'staging_events': config['LOCAL']['STAGING_EVENTS'],
+                   'staging_songs': config['LOCAL']['STAGING_SONGS']}
+    else:
+        backend = S3Backend.from_config(config)
+        sources = {'staging_events': config['S3']['LOG_DATA'],
+                   'staging_songs': config['S3']['SONG_DATA']}
+
+    for name, source_prefix in sources.items():
+        build_manifest(backend, source_prefix, output_prefix, name, slices, chunk_bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+import gzip
+import io
+import json
+import re
+import sys
+from local_stand_in import INTEGER_TYPES, iter_json_lines, iter_json_records, to_integer
+from manifest import LocalBackend, S3Backend, write_manifest
+from scheduler import parse_table_definitions
+import sql_queries
+from settings import load_settings
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.types
+except ImportError:
+    pyarrow = None
+
+
+JSONPATH_PATTERN = re.compile(r"\$\['(\w+)'\]")
+TIMESTAMP_COLUMNS = {'staging_events': ['ts']}
+DELIMITER = '|'
+DECIMAL_TYPES = ('decimal', 'numeric')
+# Precision and scale of a DECIMAL declared without them, as in Redshift.
+DEFAULT_DECIMAL = (18, 0)
+
+
+def staging_definition(table):
+    """
+    Returns the definition of a staging table parsed from its CREATE TABLE
+    (see parse_table_definitions).
+
+    INPUT:
+    * table string - 'staging_events' or 'staging_songs'
+    """
+    create = {'staging_events': sql_queries.staging_events_table_create,
+              'staging_songs': sql_queries.staging_songs_table_create}[table]
+    return parse_table_definitions([create])[table]
+
+
+def staging_columns(table):
+    """
+    Returns the columns of a staging table in the order of its CREATE TABLE.
+
+    INPUT:
+    * table string - 'staging_events' or 'staging_songs'
+    """
+    return staging_definition(table)['columns']
+
+
+def load_jsonpaths(backend, path):
+    """
+    Returns the JSON keys listed in a COPY jsonpaths file, in order.
+    ("$['artist']" -> 'artist')
+
+    INPUTS:
+    * backend LocalBackend or S3Backend
+    * path string - jsonpaths file (e.g. LOG_JSONPATH)
+    """
+    jsonpaths = json.loads(backend.read(path.strip("'")))['jsonpaths']
+    return [JSONPATH_PATTERN.match(jsonpath).group(1) for jsonpath in jsonpaths]
+
+
+def to_row(record, keys, timestamps, integers=()):
+    """
+    Applies the mapping to one JSON record, as COPY would: keys are matched
+    case-insensitively, blank strings become NULL, epoch milliseconds become
+    timestamps and numbers loaded into integer columns become int (a float
+    registration would be written as 1540919166796.0 and fail the COPY).
+
+    INPUTS:
+    * record dictionary - One JSON record
+    * keys list of JSON keys, one per column
+    * timestamps set of the keys holding epoch milliseconds
+    * integers set of the keys loaded into integer columns
+    """
+    record = {key.lower(): value for key, value in record.items()}
+    row = []
+    for key in keys:
+        value = record.get(key.lower())
+        if isinstance(value, str) and not value.strip():
+            value = None
+        if value is not None and key in timestamps:
+            value = datetime.utcfromtimestamp(value / 1000.0).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        elif value is not None and key in integers:
+            value = to_integer(value)
+        row.append(value)
+    return row
+
+
+def write_csv_chunk(backend, path, rows):
+    """
+    Writes rows as a gzip, pipe-delimited CSV file. Returns its size.
+
+    INPUTS:
+    * backend LocalBackend or S3Backend
+    * path string - Output file
+    * rows list of rows
+    """
+    text = io.StringIO()
+    csv.writer(text, delimiter=DELIMITER).writerows(rows)
+    body = gzip.compress(text.getvalue().encode('utf-8'))
+    backend.write(path, body)
+    return len(body)
+
+
+def parquet_type(data_type, arguments=()):
+    """
+    Returns the pyarrow type of a column of the CREATE TABLE. DECIMAL without
+    precision is DECIMAL(18, 0), as in Redshift.
+
+    INPUTS:
+    * data_type string - Type name of the CREATE TABLE (e.g. 'decimal')
+    * arguments tuple - Declared precision and scale, or length
+    """
+    if data_type == 'bigint':
+        return pyarrow.int64()
+    if data_type in INTEGER_TYPES:
+        return pyarrow.int32()
+    if data_type in DECIMAL_TYPES:
+        precision, scale = (tuple(arguments) + (0,))[:2] if arguments else DEFAULT_DECIMAL
+        return pyarrow.decimal128(precision, scale)
+    if data_type in ('real', 'float4'):
+        return pyarrow.float32()
+    if data_type in ('double', 'float8', 'float'):
+        return pyarrow.float64()
+    if data_type == 'timestamp':
+        return pyarrow.timestamp('ms')
+    if data_type in ('boolean', 'bool'):
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+
+def to_parquet_value(value, arrow_type):
+    """
+    Converts a value of a row to the Python type pyarrow expects for a column:
+    decimals are rounded to the scale of the column, as COPY does.
+
+    INPUTS:
+    * value - Value of the row (None for NULL)
+    * arrow_type pyarrow type returned by parquet_type()
+    """
+    if value is None:
+        return None
+    if pyarrow.types.is_decimal(arrow_type):
+        return Decimal(str(value)).quantize(Decimal(1).scaleb(-arrow_type.scale), ROUND_HALF_UP)
+    if pyarrow.types.is_floating(arrow_type):
+        return float(value)
+    if pyarrow.types.is_string(arrow_type):
+        return str(value)
+    return value
+
+
+def write_parquet_chunk(backend, path, rows, columns, timestamps, definition):
+    """
+    Writes rows as a Parquet file (snappy). Returns its size.
+    Every column gets the type of the staging table (see parquet_type), even
+    when all its values are NULL, so COPY never finds a null-typed column.
+
+    INPUTS:
+    * backend LocalBackend or S3Backend
+    * path string - Output file
+    * rows list of rows
+    * columns list of column names
+    * timestamps set of the timestamp columns
+    * definition dictionary with the types and arguments of the CREATE TABLE
+    """
+    data = {column: [row[index] for row in rows] for index, column in enumerate(columns)}
+    for column in timestamps:
+        data[column] = [datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f') if value else None
+                        for value in data[column]]
+    fields, arrays = [], []
+    for column, values in data.items():
+        arrow_type = parquet_type(definition['types'][column],
+                                  definition['arguments'].get(column, ()))
+        fields.append(pyarrow.field(column, arrow_type))
+        arrays.append(pyarrow.array([to_parquet_value(value, arrow_type) for value in values],
+                                    type=arrow_type))
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(pyarrow.Table.from_arrays(arrays, schema=pyarrow.schema(fields)),
+                                buffer)
+    backend.write(path, buffer.getvalue())
+    return len(buffer.getvalue())
+
+
+def preprocess_files(task):
+    """
+    Streams a group of JSON files and writes them as chunks of at most
+    `rows_per_chunk` rows, so memory is bounded by one chunk.
+    Returns the manifest entries of the chunks.
+
+    INPUT:
+    * task dictionary with backend, paths, table, keys, output_prefix,
+      group, rows_per_chunk and file_format
+    """
+    backend, table, keys = task['backend'], task['table'], task['keys']
+    definition = staging_definition(table)
+    columns, types = definition['columns'], definition['types']
+    # Columns after the mapped ones (song_key) are not in the JSON: left empty.
+    keys = keys + columns[len(keys):]
+    timestamps = set(TIMESTAMP_COLUMNS.get(table, []))
+    integers = {key for key, column in zip(keys, columns) if types[column] in INTEGER_TYPES}
+    extension = 'parquet' if task['file_format'] == 'parquet' else 'csv.gz'
+    entries = []
+    rows = []
+
+    def flush():
+        path = '{}/{}/part-{:05d}-{:05d}.{}'.format(
+            task['output_prefix'].rstrip('/'), table, task['group'], len(entries), extension)
+        if task['file_format'] == 'parquet':
+            size = write_parquet_chunk(backend, path, rows, columns, timestamps, definition)
+        else:
+            size = write_csv_chunk(backend, path, rows)
+        entries.append({'url': path, 'mandatory': True, 'meta': {'content_length': size}})
+        del rows[:]
+
+    for path in task['paths']:
+        if isinstance(backend, LocalBackend):
+            records = iter_json_records(path)
+        else:
+            records = iter_json_lines(backend.iter_lines(path))
+        for record in records:
+            rows.append(to_row(record, keys, timestamps, integers))
+            if len(rows) >= task['rows_per_chunk']:
+                flush()
+    if rows:
+        flush()
+    return entries
+
+
+def preprocess_table(backend, paths, table, keys, output_prefix, workers,
+                     rows_per_chunk=500000, file_format='csv'):
+    """
+    Converts the JSON input of a staging table to gzip CSV (or Parquet)
+    chunks in parallel, one group of files per process, and writes the
+    manifest of the chunks. Returns the path of the manifest.
+
+    INPUTS:
+    * backend LocalBackend or S3Backend
+    * paths list of input JSON files
+    * table string - Staging table
+    * keys list of JSON keys, one per column of the table
+    * output_prefix string - Where the chunks and the manifest are written
+    * workers int - Number of processes
+    * rows_per_chunk int - Maximum rows per output file
+    * file_format string - 'csv' or 'parquet'
+    """
+    if file_format == 'parquet' and pyarrow is None:
+        raise ImportError("pyarrow is required to write Parquet chunks")
+    groups = [paths[index::workers] for index in range(workers) if paths[index::workers]]
+    tasks = [{'backend': backend, 'paths': group, 'table': table, 'keys': keys,
+              'output_prefix': output_prefix, 'group': index,
+              'rows_per_chunk': rows_per_chunk, 'file_format': file_format}
+             for index, group in enumerate(groups)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        entries = [entry for result in executor.map(preprocess_files, tasks) for entry in result]
+    path = '{}/{}.manifest'.format(output_prefix.rstrip('/'), table)
+    write_manifest(backend, entries, path)
+    print("- ", table, ": ", len(paths), " JSON files converted into ", len(entries),
+          " ", file_format, " chunks.", sep='')
+    return path
+
+
+def main():
+    """
+    Converts the staging JSON input into gzip CSV (or Parquet) chunks.
+    Usage: python3 preprocess.py [local]
+    With `local` the [LOCAL] files are converted into a local PREPROCESSED_PREFIX.
+    """
+    config = load_settings()
+
+    workers = config.getint('ETL', 'PREPROCESS_WORKERS', fallback=4)
+    # STAGING_FORMAT = json only means the ETL does not use the chunks yet.
+    file_format = 'parquet' if config.get('ETL', 'STAGING_FORMAT', fallback='csv') == 'parquet' \
+        else 'csv'
+    output_prefix = config['S3']['PREPROCESSED_PREFIX'].strip("'")
+    if len(sys.argv) > 1 and sys.argv[1] == 'local':
+        backend = LocalBackend()
+        sources = {'staging_events': config['LOCAL']['STAGING_EVENTS'],
+                   'staging_songs': config['LOCAL']['STAGING_SONGS']}
+        event_keys = staging_columns('staging_events')
+    else:
+        backend = S3Backend.from_config(config)
+        sources = {'staging_events': config['S3']['LOG_DATA'],
+                   'staging_songs': config['S3']['SONG_DATA']}
+        event_keys = load_jsonpaths(backend, config['S3']['LOG_JSONPATH'])
+
+    keys = {'staging_events': event_keys, 'staging_songs': staging_columns('staging_songs')}
+    for table, source in sources.items():
+        paths = [path for path, _ in backend.list(source.strip("'"))]
+        preprocess_table(backend, paths, table, keys[table], output_prefix, workers,
+                         file_format=file_format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import asyncio
+import json
+from botocore.exceptions import ClientError
+from lifecycle import restore_cluster, snapshot_mode
+from scheduler import critical_path, run_graph, write_trace
+from waiter import wait_for_cluster, wait_until
+
+
+S3_READ_ONLY_POLICY = "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess"
+
+# Steps of the provisioning, each one a function(clients, config, state), and
+# the steps each one waits for. The security group ingress only needs the
+# default VPC, so it runs while the cluster is being created.
+PROVISIONING_DEPENDENCIES = {
+    'role': set(),
+    'policy': {'role'},
+    'cluster': {'policy'},
+    'cluster_available': {'cluster'},
+    'ingress': set(),
+    'cluster_ingress': {'cluster_available', 'ingress'},
+    'save_config': {'policy', 'cluster_available'}
+}
+
+
+def ignore_client_error(error, codes):
+    """
+    Re-raises a ClientError unless its code contains one of `codes`
+    (an already existing resource is not an error when provisioning).
+
+    INPUTS:
+    * error ClientError
+    * codes list of error codes to ignore
+    """
+    code = error.response['Error']['Code']
+    if not any(ignored in code for ignored in codes):
+        raise error
+    print("- Skipped:", code)
+
+
+def role_exists(iam, role_name):
+    """
+    Returns True once the IAM role can be read back.
+
+    INPUTS:
+    * iam boto3 IAM client
+    * role_name string - Name of the role
+    """
+    try:
+        iam.get_role(RoleName=role_name)
+        return True
+    except ClientError as e:
+        if "NoSuchEntity" not in e.response['Error']['Code']:
+            raise
+        return False
+
+
+def create_role_step(clients, config, state):
+    """
+    Creates the IAM role Redshift assumes and waits until it is readable.
+    """
+    role_name = config['DWH']['DWH_IAM_ROLE_NAME']
+    print("- Creating IAM role:", role_name)
+    try:
+        clients['iam'].create_role(
+            Path='/',
+            RoleName=role_name,
+            Description="Allows Redshift clusters to call AWS services on your behalf.",
+            AssumeRolePolicyDocument=json.dumps(
+                {'Statement': [{'Action': 'sts:AssumeRole',
+                                'Effect': 'Allow',
+                                'Principal': {'Service': 'redshift.amazonaws.com'}}],
+                 'Version': '2012-10-17'}))
+    except ClientError as e:
+        ignore_client_error(e, ["EntityAlreadyExists"])
+    asyncio.run(wait_until(lambda: role_exists(clients['iam'], role_name), bool,
+                           deadline=60, initial=0.5, maximum=5))
+
+
+def attach_policy_step(clients, config, state):
+    """
+    Attaches the S3 read-only policy to the role and keeps its ARN.
+    """
+    role_name = config['DWH']['DWH_IAM_ROLE_NAME']
+    print("- Attaching policy to", role_name)
+    clients['iam'].attach_role_policy(RoleName=role_name, PolicyArn=S3_READ_ONLY_POLICY)
+    state['arn'] = clients['iam'].get_role(RoleName=role_name)['Role']['Arn']
+    print("- IAM role ARN:", state['arn'])
+
+
+def create_cluster_step(clients, config, state):
+    """
+    Requests the Redshift cluster with the role attached, or restores it from
+    its latest snapshot in snapshot lifecycle mode.
+    """
+    if snapshot_mode(config):
+        state['restored_from'] = restore_cluster(clients['redshift'], config, state['arn'])
+        if state['restored_from']:
+            return
+    print("- Creating Redshift cluster:", config['DWH']['DWH_CLUSTER_IDENTIFIER'])
+    try:
+        clients['redshift'].create_cluster(
+            ClusterType=config['DWH']['DWH_CLUSTER_TYPE'],
+            NodeType=config['DWH']['DWH_NODE_TYPE'],
+            NumberOfNodes=int(config['DWH']['DWH_NUM_NODES']),
+            DBName=config['DWH']['DWH_DB'],
+            ClusterIdentifier=config['DWH']['DWH_CLUSTER_IDENTIFIER'],
+            MasterUsername=config['DWH']['DWH_DB_USER'],
+            MasterUserPassword=config['DWH']['DWH_DB_PASSWORD'],
+            IamRoles=[state['arn']])
+    except ClientError as e:
+        ignore_client_error(e, ["ClusterAlreadyExists"])
+
+
+def wait_cluster_step(clients, config, state):
+    """
+    Waits until the cluster is available and keeps its properties.
+    """
+    operation = 'restore' if state.get('restored_from') else 'create'
+    state['cluster'] = wait_for_cluster(clients['redshift'], config, operation)
+
+
+def authorize_ingress(vpc, port):
+    """
+    Opens the DB port of the default security group of a VPC.
+
+    INPUTS:
+    * vpc boto3 EC2 Vpc resource
+    * port int - DB port
+    """
+    # GroupNames only resolves groups of the default VPC: filter on the name.
+    security_group = list(vpc.security_groups.filter(
+        Filters=[{'Name': 'group-name', 'Values': ['default']}]))[0]
+    print("- Security group ", security_group.id, " of ", vpc.id, ": opening port ",
+          port, sep='')
+    try:
+        security_group.authorize_ingress(
+            GroupId=security_group.id,
+            CidrIp='0.0.0.0/0',
+            IpProtocol='TCP',
+            FromPort=port,
+            ToPort=port)
+    except ClientError as e:
+        ignore_client_error(e, ["InvalidPermission.Duplicate"])
+
+
+def ingress_step(clients, config, state):
+    """
+    Opens the DB port in the default VPC, where the cluster is created.
+    """
+    vpcs = list(clients['ec2'].vpcs.filter(Filters=[{'Name': 'isDefault', 'Values': ['true']}]))
+    if not vpcs:
+        print("- No default VPC: the port is opened once the cluster is available")
+        return
+    authorize_ingress(vpcs[0], int(config['DWH']['DWH_PORT']))
+    state['ingress_vpc'] = vpcs[0].id
+
+
+def cluster_ingress_step(clients, config, state):
+    """
+    Opens the DB port in the VPC of the cluster if it is not the one
+    prepared by ingress_step().
+    """
+    vpc_id = state['cluster']['VpcId']
+    if state.get('ingress_vpc') != vpc_id:
+        authorize_ingress(clients['ec2'].Vpc(id=vpc_id), int(config['DWH']['DWH_PORT']))
+
+
+def save_config_step(clients, config, state):
+    """
+    Saves the role ARN and the cluster endpoint in the state file, once.
+    """
+    config.save_state({'IAM_ROLE': {'ARN': state['arn']},
+                       'DWH': {'DWH_ENDPOINT': state['cluster']['Endpoint']['Address']}})
+    print("- ARN and endpoint saved in", config.state_path)
+
+
+PROVISIONING_STEPS = {
+    'role': create_role_step,
+    'policy': attach_policy_step,
+    'cluster': create_cluster_step,
+    'cluster_available': wait_cluster_step,
+    'ingress': ingress_step,
+    'cluster_ingress': cluster_ingress_step,
+    'save_config': save_config_step
+}
+
+
+def provision(clients, config, trace_path=None):
+    """
+    Runs the provisioning steps concurrently, each one as soon as the steps
+    it depends on have succeeded. Returns the shared state (arn, cluster)
+    and the timing trace.
+
+    INPUTS:
+    * clients dictionary with the 'iam', 'ec2' (resource) and 'redshift' clients
+    * config Settings returned by settings.load_settings()
+    * trace_path string - JSON file for the timing trace (optional)
+    """
+    state = {}
+
+    def run_step(name, step):
+        step(clients, config, state)
+
+    trace = run_graph(PROVISIONING_STEPS, PROVISIONING_DEPENDENCIES, run_step,
+                      len(PROVISIONING_STEPS))
+    for node in trace:
+        print("- Step `", node['name'], "`: ", node['status'], sep='', end='')
+        if node['seconds'] is not None:
+            print(" from ", node['start'], "s to ", node['end'], "s", sep='', end='')
+        print(" " + node['error'] if node['error'] else "")
+    print("- Critical path:", " -> ".join(critical_path(trace)))
+    if trace_path:
+        write_trace(trace_path, 'provisioning', trace)
+        print("- Timing trace saved in", trace_path)
+    return state, trace
@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import json
+import re
+import threading
+import time
+
+
+TABLE_PATTERN = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+COLUMN_PATTERN = re.compile(r"^\s*(\w+)\s+(\w+)(?:\(([\d,\s]+)\))?(.*)$", re.IGNORECASE)
+REFERENCES_PATTERN = re.compile(r"REFERENCES\s+(\w+)", re.IGNORECASE)
+INSERT_PATTERN = re.compile(r"INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+
+
+def target_table(query):
+    """
+    Returns the table an INSERT (or an upsert script) writes into.
+
+    INPUT:
+    * query string - SQL statement(s) with one INSERT INTO
+    """
+    return INSERT_PATTERN.search(query).group(1).lower()
+
+
+def parse_table_definitions(create_queries):
+    """
+    Parses the CREATE TABLE statements.
+    Returns a dictionary {table: {'columns': [...], 'types': {column: type},
+    'arguments': {column: (precision, scale) or (length,)} of the columns
+    declared with them, 'primary_key': column, 'references': set of tables}}.
+
+    INPUT:
+    * create_queries list of CREATE TABLE statements
+    """
+    tables = {}
+    for query in create_queries:
+        table = TABLE_PATTERN.search(query).group(1).lower()
+        body = query[query.index('(') + 1:query.rindex(')')]
+        definition = {'columns': [], 'types': {}, 'arguments': {}, 'primary_key': None,
+                      'references': set()}
+        for line in body.splitlines():
+            match = COLUMN_PATTERN.match(line)
+            if not match:
+                continue
+            column, constraints = match.group(1).lower(), match.group(4)
+            definition['columns'].append(column)
+            definition['types'][column] = match.group(2).lower()
+            if match.group(3):
+                definition['arguments'][column] = tuple(
+                    int(argument) for argument in match.group(3).split(','))
+            if re.search(r"PRIMARY\s+KEY", constraints, re.IGNORECASE):
+                definition['primary_key'] = column
+            definition['references'].update(
+                reference.lower() for reference in REFERENCES_PATTERN.findall(constraints))
+        tables[table] = definition
+    return tables
+
+
+def build_table_dependencies(create_queries):
+    """
+    Returns the tables each table depends on: the ones named in its
+    REFERENCES clauses plus the ones whose primary key is one of its columns
+    (songplays.song_id -> songs.song_id).
+
+    INPUT:
+    * create_queries list of CREATE TABLE statements
+    """
+    tables = parse_table_definitions(create_queries)
+    dependencies = {}
+    for table, definition in tables.items():
+        needs = set(definition['references'])
+        for other, other_definition in tables.items():
+            key = other_definition['primary_key']
+            if other != table and key and key in definition['columns'] \
+                    and key != definition['primary_key']:
+                needs.add(other)
+        dependencies[table] = needs
+    return dependencies
+
+
+def build_insert_graph(insert_queries, create_queries):
+    """
+    Returns the nodes {table: query} and the dependencies {table: set of
+    tables} for a list of INSERT statements. Only the tables inserted by the
+    list are kept as dependencies.
+
+    INPUTS:
+    * insert_queries list of INSERT INTO statements or upsert scripts
+    * create_queries list of CREATE TABLE statements
+    """
+    nodes = {target_table(query): query for query in insert_queries}
+    table_dependencies = build_table_dependencies(create_queries)
+    dependencies = {
+        table: table_dependencies.get(table, set()) & set(nodes) - {table}
+        for table in nodes
+    }
+    return nodes, dependencies
+
+
+def critical_path(trace):
+    """
+    Returns the chain of nodes that finished last: the node with the latest
+    end and, going back, the dependency that released it.
+
+    INPUT:
+    * trace list of node timings returned by run_graph()
+    """
+    by_name = {node['name']: node for node in trace if node['end'] is not None}
+    if not by_name:
+        return []
+    path = [max(by_name.values(), key=lambda node: node['end'])]
+    while True:
+        parents = [by_name[name] for name in path[-1]['depends_on'] if name in by_name]
+        if not parents:
+            break
+        path.append(max(parents, key=lambda node: node['end']))
+    return [node['name'] for node in reversed(path)]
+
+
+def run_graph(nodes, dependencies, run_node, workers):
+    """
+    Runs every node as soon as all of its dependencies have succeeded,
+    with at most `workers` nodes at the same time. A node whose dependency
+    failed is skipped.
+    Returns the timing trace: one dictionary per node with its start and end
+    (seconds since the graph started), status, worker and dependencies.
+
+    INPUTS:
+    * nodes dictionary {name: payload}
+    * dependencies dictionary {name: set of names}
+    * run_node function(name, payload) executing one node
+    * workers int - Number of nodes running at the same time
+    """
+    origin = time.time()
+    trace = {
+        name: {'name': name, 'depends_on': sorted(dependencies.get(name, ())),
+               'start': None, 'end': None, 'seconds': None,
+               'status': 'pending', 'worker': None, 'error': None}
+        for name in nodes
+    }
+
+    def timed(name):
+        trace[name]['start'] = round(time.time() - origin, 3)
+        trace[name]['worker'] = threading.current_thread().name
+        try:
+            run_node(name, nodes[name])
+        finally:
+            trace[name]['end'] = round(time.time() - origin, 3)
+            trace[name]['seconds'] = round(trace[name]['end'] - trace[name]['start'], 3)
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            changed = True
+            while changed:
+                changed = False
+                for name, node in trace.items():
+                    if node['status'] != 'pending':
+                        continue
+                    statuses = [trace[parent]['status'] for parent in node['depends_on']]
+                    if any(status in ('failed', 'skipped') for status in statuses):
+                        node['status'] = 'skipped'
+                        changed = True
+                    elif all(status == 'succeeded' for status in statuses):
+                        node['status'] = 'running'
+                        running[executor.submit(timed, name)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                trace[name]['status'] = 'failed' if error else 'succeeded'
+                trace[name]['error'] = str(error) if error else None
+    return sorted(trace.values(), key=lambda node: (node['start'] is None, node['start'] or 0))
+
+
+def write_trace(path, phase, trace):
+    """
+    Writes a Gantt-style JSON trace with the timing of each node and the
+    critical path of the run.
+
+    INPUTS:
+    * path string - Output JSON file
+    * phase string - Name of the phase (e.g. 'insert_tables')
+    * trace list of node timings returned by run_graph()
+    """
+    ends = [node['end'] for node in trace if node['end'] is not None]
+    with open(path, 'w') as trace_file:
+        json.dump({
+            'phase': phase,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'wall_seconds': max(ends) if ends else 0,
+            'critical_path': critical_path(trace),
+            'nodes': trace
+        }, trace_file, indent=2)
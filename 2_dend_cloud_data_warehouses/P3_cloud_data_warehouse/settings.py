@@ -0,0 +1,215 @@
+import configparser
+import json
+import os
+import tempfile
+import threading
+
+
+CONFIG_PATH = 'dwh.cfg'
+
+# Sections every script needs.
+REQUIRED_SECTIONS = ['AWS', 'DWH', 'IAM_ROLE', 'S3']
+
+# Type of the options that are not plain strings: 'int', 'float', 'boolean'
+# or the tuple of accepted values.
+OPTION_TYPES = {
+    'DWH': {
+        'DWH_NUM_NODES': 'int',
+        'DWH_PORT': 'int',
+        'DWH_PROCESS_INCOMPLETE_DATA': 'boolean',
+        'DWH_POOL_MIN': 'int',
+        'DWH_POOL_MAX': 'int',
+        'DWH_POOL_TIMEOUT': 'float',
+        'DWH_POOL_HEALTH_CHECK_SECONDS': 'float',
+        'DWH_STATEMENT_TIMEOUT_MS': 'int',
+        'DWH_WAIT_INITIAL_SECONDS': 'float',
+        'DWH_WAIT_MAX_SECONDS': 'float',
+        'DWH_WAIT_DEADLINE_SECONDS': 'float',
+        'DWH_LIFECYCLE_MODE': ('delete', 'snapshot'),
+        'DWH_SNAPSHOT_RETENTION': 'int'
+    },
+    'ETL': {
+        'BATCH_SIZE': 'int',
+        'USE_SAVEPOINTS': 'boolean',
+        'LOAD_MODE': ('sequential', 'concurrent'),
+        'COPY_WORKERS': 'int',
+        'INSERT_MODE': ('sequential', 'parallel'),
+        'INSERT_WORKERS': 'int',
+        'DIMENSION_MODE': ('insert', 'upsert'),
+        'INCREMENTAL': 'boolean',
+        'USE_MANIFESTS': 'boolean',
+        'MANIFEST_CHUNK_MB': 'int',
+        'STAGING_FORMAT': ('json', 'csv', 'parquet'),
+        'PREPROCESS_WORKERS': 'int',
+        'ENCODING_SAMPLE_ROWS': 'int',
+        'DIST_ALL_MAX_ROWS': 'int',
+        'SONG_KEY_JOIN': 'boolean',
+        'TRANSFORM_MODE': ('staging', 'single_pass'),
+        'REPORT_SCANS': 'boolean',
+        'TIME_DIMENSION': ('extract', 'calendar')
+    },
+    'LOCAL': {
+        'ENABLED': 'boolean'
+    },
+    'GENERATOR': {
+        'USERS': 'int',
+        'SONGS': 'int',
+        'ARTISTS': 'int',
+        'ZIPF_SKEW': 'float',
+        'UNKNOWN_SONG_RATE': 'float',
+        'NEXT_SONG_RATE': 'float',
+        'FORMAT': ('json', 'parquet'),
+        'ROWS_PER_SHARD': 'int',
+        'WORKERS': 'int',
+        'SEED': 'int'
+    }
+}
+
+
+class SettingsError(ValueError):
+    """
+    Raised when dwh.cfg is missing a section or holds a value of the wrong
+    type.
+    """
+
+
+class Settings(configparser.ConfigParser):
+    """
+    dwh.cfg, with the runtime state written by the cluster scripts (role ARN,
+    endpoint) read from a separate JSON file on top of it. Option names keep
+    their case, as in every script.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        """
+        INPUT:
+        * path string - Config file
+        """
+        super().__init__()
+        self.optionxform = str
+        self.path = path
+        self.read(path)
+        self.state_path = self.get('DWH', 'DWH_STATE_PATH', fallback='dwh_state.json')
+        # Incremented by save_state(), so rendered queries can be refreshed.
+        self.version = 0
+        self._lock = threading.Lock()
+        for section, options in read_json(self.state_path).items():
+            if not self.has_section(section):
+                self.add_section(section)
+            for option, value in options.items():
+                self[section][option] = value
+
+    def typed(self, section, option, fallback=None):
+        """
+        Returns an option converted to its type in OPTION_TYPES.
+
+        INPUTS:
+        * section string - e.g. 'ETL'
+        * option string - e.g. 'BATCH_SIZE'
+        * fallback - Value returned when the option is missing
+        """
+        if not self.has_option(section, option):
+            return fallback
+        kind = OPTION_TYPES.get(section, {}).get(option)
+        if kind == 'int':
+            return self.getint(section, option)
+        if kind == 'float':
+            return self.getfloat(section, option)
+        if kind == 'boolean':
+            return self.getboolean(section, option)
+        return self.get(section, option)
+
+    def validate(self):
+        """
+        Checks the required sections and the type of every option in
+        OPTION_TYPES. Raises SettingsError listing all the problems.
+        """
+        problems = ["missing section [{}]".format(section)
+                    for section in REQUIRED_SECTIONS if not self.has_section(section)]
+        for section, options in OPTION_TYPES.items():
+            for option, kind in options.items():
+                if not self.has_option(section, option):
+                    continue
+                value = self.get(section, option)
+                if isinstance(kind, tuple):
+                    if value not in kind:
+                        problems.append("{} in [{}] must be one of {}, not '{}'".format(
+                            option, section, ', '.join(kind), value))
+                    continue
+                try:
+                    self.typed(section, option)
+                except ValueError:
+                    problems.append("{} in [{}] must be of type {}, not '{}'".format(
+                        option, section, kind, value))
+        if problems:
+            raise SettingsError("Invalid {}: {}".format(self.path, '; '.join(problems)))
+        return self
+
+    def save_state(self, updates):
+        """
+        Applies runtime values (e.g. the ARN and the endpoint) and writes them
+        to the state file, leaving the config file untouched.
+
+        INPUT:
+        * updates dictionary {section: {option: value}}
+        """
+        with self._lock:
+            state = read_json(self.state_path)
+            for section, options in updates.items():
+                state.setdefault(section, {}).update(options)
+                for option, value in options.items():
+                    self[section][option] = value
+            write_json_atomically(self.state_path, state)
+            self.version += 1
+
+
+def read_json(path):
+    """
+    Returns the content of a JSON file, or an empty dictionary if it does not
+    exist.
+
+    INPUT:
+    * path string - JSON file
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def write_json_atomically(path, data):
+    """
+    Writes a JSON file atomically: a temporary file in the same directory
+    replaces the previous one, so a crash or a concurrent reader never sees
+    a truncated file.
+
+    INPUTS:
+    * path string - JSON file
+    * data JSON-serializable object
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w') as json_file:
+        json.dump(data, json_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+_settings = {}
+_settings_lock = threading.Lock()
+
+
+def load_settings(path=CONFIG_PATH, reload=False):
+    """
+    Returns the validated settings of a config file, parsed once per
+    process and shared by every module.
+
+    INPUTS:
+    * path string - Config file (default: dwh.cfg)
+    * reload boolean - Parses the file again
+    """
+    key = os.path.abspath(path)
+    with _settings_lock:
+        if reload or key not in _settings:
+            _settings[key] = Settings(path).validate()
+        return _settings[key]
+
@@ -1,10 +1,7 @@
-import configparser
+import os
+from settings import load_settings
 
 
-# CONFIG
-config = configparser.ConfigParser()
-config.read('dwh.cfg')
-
 # DROP TABLES
 
 staging_events_table_drop = "DROP TABLE IF EXISTS staging_events"
@@ -36,7 +33,8 @@ CREATE TABLE IF NOT EXISTS staging_events (
     status          INTEGER,
     ts              TIMESTAMP,
     userAgent       VARCHAR,
-    userId          VARCHAR
+    userId          VARCHAR,
+    song_key        BIGINT      DISTKEY
 );
 """)
 
@@ -51,7 +49,8 @@ CREATE TABLE IF NOT EXISTS staging_songs (
     song_id             VARCHAR,
     title               VARCHAR,
     duration            DECIMAL,
-    year                INT    
+    year                INT,
+    song_key            BIGINT      DISTKEY
 );
 """)
 
@@ -65,7 +64,9 @@ CREATE TABLE IF NOT EXISTS songplays (
     artist_id       VARCHAR, 
     session_id      INT, 
     location        VARCHAR, 
-    user_agent      VARCHAR
+    user_agent      VARCHAR,
+    song_key_id     BIGINT,
+    artist_key_id   BIGINT
 );
 """)
 
@@ -85,7 +86,8 @@ CREATE TABLE IF NOT EXISTS songs (
     title           VARCHAR     SORTKEY,     
     artist_id       VARCHAR     NOT NULL    REFERENCES artists(artist_id), 
     year            INT,     
-    duration        DECIMAL
+    duration        DECIMAL,
+    key_id          BIGINT
     );
 """)
 
@@ -95,7 +97,8 @@ CREATE TABLE IF NOT EXISTS artists (
     name            VARCHAR     SORTKEY,     
     location        VARCHAR,     
     latitude        DECIMAL,     
-    longitude       DECIMAL
+    longitude       DECIMAL,
+    key_id          BIGINT
     );
 """)
 
@@ -111,11 +114,47 @@ CREATE TABLE IF NOT EXISTS time (
 );
 """)
 
+# One row per hour with its time parts, generated by time_dimension.py.
+# Not in drop_table_queries: it is generated once and extended when needed.
+calendar_table_create = ("""
+CREATE TABLE IF NOT EXISTS calendar (
+    hour_start      TIMESTAMP   NOT NULL    SORTKEY,
+    hour            INT         NOT NULL,
+    day             INT         NOT NULL,
+    week            INT         NOT NULL,
+    month           INT         NOT NULL,
+    year            INT         NOT NULL,
+    weekday         VARCHAR     NOT NULL
+) DISTSTYLE ALL;
+""")
+
+# Surrogate keys of the artists and songs known only from the logs, stored in
+# the key_id columns of artists and songs and in songplays.song_key_id and
+# artist_key_id. song is NULL for the artist keys.
+# Not in drop_table_queries: the keys stay stable across reloads.
+key_map_table_create = ("""
+CREATE TABLE IF NOT EXISTS key_map (
+    key_id          BIGINT      IDENTITY(1,1),
+    key_type        VARCHAR     NOT NULL,
+    artist          VARCHAR     NOT NULL    SORTKEY,
+    song            VARCHAR
+) DISTSTYLE ALL;
+""")
+
+
 # STAGING TABLES
 
-staging_events_copy = ("""
-    COPY staging_events
-    FROM {log_data_bucket}
+# The statements depending on dwh.cfg are rendered by render_queries().
+# `source` stays a placeholder after rendering, so the same COPY can load a
+# single file. The column list leaves out song_key, which is not in the JSON
+# (see LOG_JSONPATH).
+staging_events_copy_base = ("""
+    COPY staging_events (
+        artist, auth, firstName, gender, itemInSession, lastName, length, level,
+        location, method, page, registration, sessionId, song, status, ts,
+        userAgent, userId
+    )
+    FROM {source}
     CREDENTIALS 'aws_iam_role={arn}'
     EMPTYASNULL
     BLANKSASNULL
@@ -123,26 +162,74 @@ staging_events_copy = ("""
     REGION 'us-west-2'
     TIMEFORMAT AS 'epochmillisecs'
     JSON {log_data_path}
-""").format(
-        log_data_bucket=config['S3']['LOG_DATA'],
-        arn=config['IAM_ROLE']['ARN'],
-        log_data_path=config['S3']['LOG_JSONPATH']
-        )
-
-staging_songs_copy = ("""
-    COPY staging_songs
-    FROM 's3://udacity-dend/song_data/A/A/A'
-    CREDENTIALS 'aws_iam_role={}'
+""")
+
+staging_songs_copy_base = ("""
+    COPY {table}
+    FROM {source}
+    CREDENTIALS 'aws_iam_role={arn}'
     EMPTYASNULL
     BLANKSASNULL
     REGION 'us-west-2'
     FORMAT AS JSON 'auto'
     COMPUPDATE OFF
-""").format(config['IAM_ROLE']['ARN'])
+""")
+
+# Manifests written by manifest.py: gzip chunks sized for the cluster slices.
+manifest_options = """    MANIFEST
+    GZIP
+"""
+
+# Columnar input written by preprocess.py: gzip pipe-delimited CSV (or Parquet)
+# chunks in the column order of the staging tables, so COPY skips JSON parsing.
+preprocessed_copy_base = ("""
+    COPY {table}
+    FROM '{prefix}/{table}.manifest'
+    CREDENTIALS 'aws_iam_role={arn}'
+    MANIFEST
+    REGION 'us-west-2'
+""")
+
+csv_options = """    GZIP
+    CSV DELIMITER '|'
+    TIMEFORMAT 'auto'
+    EMPTYASNULL
+    BLANKSASNULL
+    COMPUPDATE OFF
+"""
+
+parquet_options = """    FORMAT AS PARQUET
+"""
+
+# SONG KEYS
+
+# Lowercased, trimmed and with every run of whitespace collapsed to one space.
+normalize_expression = "REGEXP_REPLACE(LOWER(TRIM({})), '[[:space:]]+', ' ')"
+
+# Normalized (artist, title) pair hashed into one BIGINT, computed once after
+# the load. The title hash is seeded with the artist hash instead of hashing a
+# concatenation, so no separator can make two pairs alike. Both staging tables
+# are distributed on it, so the songplays join is co-located.
+song_key_expression = "FNV_HASH({title}, FNV_HASH({artist}, 0))".format(
+    artist=normalize_expression.format('{artist}'), title=normalize_expression.format('{title}'))
+
+staging_events_key_update = ("""
+    UPDATE staging_events
+    SET song_key = {}
+    WHERE song_key IS NULL AND page = 'NextSong'
+""").format(song_key_expression.format(artist='artist', title='song'))
+
+staging_songs_key_update = ("""
+    UPDATE staging_songs
+    SET song_key = {}
+    WHERE song_key IS NULL
+""").format(song_key_expression.format(artist='artist_name', title='title'))
 
 # FINAL TABLES
+# The statements reading the events are templates on {events}: staging_events,
+# or staging_plays in the single-pass mode (see render_queries).
 
-songplay_table_insert = ("""
+songplay_table_insert_by_columns_template = ("""
     INSERT INTO songplays (
         start_time, 
         user_id, 
@@ -162,14 +249,52 @@ songplay_table_insert = ("""
         e.sessionId,
         e.location,
         e.userAgent
-    FROM staging_events AS e
+    FROM {events} AS e
     LEFT JOIN staging_songs AS s
         ON (e.artist = s.artist_name AND e.song = s.title)
     WHERE e.page = 'NextSong' AND s.title IS NOT NULL
 
 """)
+songplay_table_insert_by_columns = songplay_table_insert_by_columns_template.format(events='staging_events')
 
-user_table_insert = ("""
+songplay_table_insert_by_key_template = ("""
+    INSERT INTO songplays (
+        start_time, 
+        user_id, 
+        level, 
+        song_id, 
+        artist_id, 
+        session_id, 
+        location, 
+        user_agent
+    )
+    SELECT
+        e.ts,
+        e.userId,
+        e.level,
+        s.song_id,
+        s.artist_id,
+        e.sessionId,
+        e.location,
+        e.userAgent
+    FROM {events} AS e
+    JOIN staging_songs AS s
+        ON (e.song_key = s.song_key
+            AND {artist_events} = {artist_songs}
+            AND {title_events} = {title_songs})
+    WHERE e.page = 'NextSong'
+
+""").format(
+    events='{events}',
+    # The hash only places and filters the rows: the normalized values are
+    # compared too, so a 64-bit collision cannot produce a wrong songplay.
+    artist_events=normalize_expression.format('e.artist'),
+    artist_songs=normalize_expression.format('s.artist_name'),
+    title_events=normalize_expression.format('e.song'),
+    title_songs=normalize_expression.format('s.title'))
+songplay_table_insert_by_key = songplay_table_insert_by_key_template.format(events='staging_events')
+
+user_table_insert_template = ("""
     INSERT INTO users (user_id, first_name, last_name, gender, level)
     SELECT DISTINCT
         e.userId,
@@ -177,10 +302,11 @@ user_table_insert = ("""
         e.lastName,
         e.gender,
         e.level
-    FROM staging_events e
+    FROM {events} e
     WHERE e.userId IS NOT NULL
     AND e.userId NOT IN (SELECT DISTINCT user_id FROM users)
 """)
+user_table_insert = user_table_insert_template.format(events='staging_events')
 
 song_table_insert = ("""
     INSERT INTO songs (song_id, title, artist_id, year, duration)
@@ -206,7 +332,7 @@ artist_table_insert = ("""
     WHERE s.artist_id IS NOT NULL
 """)
 
-time_table_insert = ("""
+time_table_insert_by_extract_template = ("""
     INSERT INTO time (start_time, hour, day, week, month, year, weekday)
     SELECT DISTINCT
         e.ts,
@@ -225,12 +351,275 @@ time_table_insert = ("""
             WHEN EXTRACT(DOW FROM e.ts) = 6 THEN 'Saturday'
             ELSE 'Unknown'
         END
-    FROM staging_events AS e
+    FROM {events} AS e
     WHERE e.ts IS NOT NULL    
 """)
+time_table_insert_by_extract = time_table_insert_by_extract_template.format(events='staging_events')
+
+# UPSERT DIMENSION TABLES
+# The rows are staged, the matching rows are deleted from the target and the
+# staged rows are inserted, all in the caller's transaction. Re-runs replace
+# rows instead of adding duplicates and users keep their latest level.
+# The songs and artists are read from {songs}: staging_songs, or only the song
+# files of the run in an incremental load (staging_songs_delta).
+
+user_table_upsert_template = ("""
+    CREATE TEMP TABLE users_stage AS
+    SELECT user_id, first_name, last_name, gender, level
+    FROM (
+        SELECT
+            e.userId AS user_id,
+            e.firstName AS first_name,
+            e.lastName AS last_name,
+            e.gender,
+            e.level,
+            ROW_NUMBER() OVER (PARTITION BY e.userId ORDER BY e.ts DESC) AS position
+        FROM {events} AS e
+        WHERE e.userId IS NOT NULL
+    ) AS latest
+    WHERE position = 1;
+
+    DELETE FROM users USING users_stage WHERE users.user_id = users_stage.user_id;
+
+    INSERT INTO users (user_id, first_name, last_name, gender, level)
+    SELECT user_id, first_name, last_name, gender, level FROM users_stage;
+
+    DROP TABLE users_stage;
+""")
+user_table_upsert = user_table_upsert_template.format(events='staging_events')
+
+song_table_upsert_template = ("""
+    CREATE TEMP TABLE songs_stage AS
+    SELECT song_id, title, artist_id, year, duration
+    FROM (
+        SELECT
+            s.song_id,
+            s.title,
+            s.artist_id,
+            s.year,
+            s.duration,
+            ROW_NUMBER() OVER (PARTITION BY s.song_id ORDER BY s.year DESC) AS position
+        FROM {songs} AS s
+        WHERE s.song_id IS NOT NULL AND s.artist_id IS NOT NULL
+    ) AS latest
+    WHERE position = 1;
+
+    DELETE FROM songs USING songs_stage WHERE songs.song_id = songs_stage.song_id;
+
+    INSERT INTO songs (song_id, title, artist_id, year, duration)
+    SELECT song_id, title, artist_id, year, duration FROM songs_stage;
+
+    DROP TABLE songs_stage;
+""")
+
+artist_table_upsert_template = ("""
+    CREATE TEMP TABLE artists_stage AS
+    SELECT artist_id, name, location, latitude, longitude
+    FROM (
+        SELECT
+            s.artist_id,
+            s.artist_name AS name,
+            s.artist_location AS location,
+            s.artist_latitude AS latitude,
+            s.artist_longitude AS longitude,
+            ROW_NUMBER() OVER (PARTITION BY s.artist_id ORDER BY s.artist_name) AS position
+        FROM {songs} AS s
+        WHERE s.artist_id IS NOT NULL
+    ) AS latest
+    WHERE position = 1;
+
+    DELETE FROM artists USING artists_stage WHERE artists.artist_id = artists_stage.artist_id;
+
+    INSERT INTO artists (artist_id, name, location, latitude, longitude)
+    SELECT artist_id, name, location, latitude, longitude FROM artists_stage;
+
+    DROP TABLE artists_stage;
+""")
+
+song_table_upsert = song_table_upsert_template.format(songs='staging_songs')
+artist_table_upsert = artist_table_upsert_template.format(songs='staging_songs')
+
+# Time parts looked up in the calendar instead of computed for every event.
+# Only the start times not in the table yet are inserted.
+time_table_insert_from_calendar_template = ("""
+    INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+    SELECT DISTINCT
+        e.ts,
+        c.hour,
+        c.day,
+        c.week,
+        c.month,
+        c.year,
+        c.weekday
+    FROM {events} AS e
+    JOIN calendar AS c
+        ON (c.hour_start = DATE_TRUNC('hour', e.ts))
+    LEFT JOIN time AS t
+        ON (t.start_time = e.ts)
+    WHERE e.ts IS NOT NULL AND t.start_time IS NULL
+""")
+time_table_insert_from_calendar = time_table_insert_from_calendar_template.format(events='staging_events')
+
+calendar_bounds = "SELECT MIN(ts), MAX(ts) FROM staging_events"
+calendar_range = "SELECT MIN(hour_start), MAX(hour_start) FROM calendar"
+
+time_table_upsert_by_extract_template = ("""
+    CREATE TEMP TABLE time_stage AS
+    SELECT DISTINCT e.ts AS start_time
+    FROM {events} AS e
+    WHERE e.ts IS NOT NULL;
+
+    DELETE FROM time USING time_stage WHERE time.start_time = time_stage.start_time;
+
+    INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+    SELECT
+        t.start_time,
+        EXTRACT(HOUR FROM t.start_time),
+        EXTRACT(DAY FROM t.start_time),
+        EXTRACT(WEEK FROM t.start_time),
+        EXTRACT(MONTH FROM t.start_time),
+        EXTRACT(YEAR FROM t.start_time),
+        CASE 
+            WHEN EXTRACT(DOW FROM t.start_time) = 0 THEN 'Sunday'
+            WHEN EXTRACT(DOW FROM t.start_time) = 1 THEN 'Monday'
+            WHEN EXTRACT(DOW FROM t.start_time) = 2 THEN 'Tuesday'
+            WHEN EXTRACT(DOW FROM t.start_time) = 3 THEN 'Wednesday'
+            WHEN EXTRACT(DOW FROM t.start_time) = 4 THEN 'Thursday'
+            WHEN EXTRACT(DOW FROM t.start_time) = 5 THEN 'Friday'
+            WHEN EXTRACT(DOW FROM t.start_time) = 6 THEN 'Saturday'
+            ELSE 'Unknown'
+        END
+    FROM time_stage AS t;
+
+    DROP TABLE time_stage;
+""")
+time_table_upsert_by_extract = time_table_upsert_by_extract_template.format(events='staging_events')
+
+# INCREMENTAL LOADS
+# staging_events only holds the log files not loaded by a previous run.
+# staging_songs keeps every song file loaded so far, so the new events still
+# match the songs of the previous runs. The song files of the run are copied
+# into staging_songs_delta first: songs and artists are merged from it only,
+# instead of from every song loaded so far.
+staging_events_clear = "DELETE FROM staging_events"
+
+staging_songs_clear = "DELETE FROM staging_songs"
+
+staging_songs_delta_create = "CREATE TEMP TABLE staging_songs_delta (LIKE staging_songs)"
+
+staging_songs_delta_drop = "DROP TABLE staging_songs_delta"
+
+# Song files loaded again (the state file was not written after the previous
+# commit) replace their rows instead of adding identical ones, which would
+# each match the same event.
+staging_songs_merge = ("""
+    DELETE FROM staging_songs USING staging_songs_delta
+    WHERE staging_songs.song_id = staging_songs_delta.song_id;
+
+    INSERT INTO staging_songs SELECT DISTINCT * FROM staging_songs_delta;
+""")
+
+artist_table_upsert_delta = artist_table_upsert_template.format(songs='staging_songs_delta')
+song_table_upsert_delta = song_table_upsert_template.format(songs='staging_songs_delta')
+
+# Log files loaded again for the same reason: their events are already in
+# songplays, identified by user, session and start time.
+songplay_dedupe_filter = """    AND NOT EXISTS (
+        SELECT 1
+        FROM songplays AS p
+        WHERE p.user_id = e.userId AND p.session_id = e.sessionId AND p.start_time = e.ts
+    )
+"""
 
 # INSERT INCOMPLETE VALUES
-artist_table_insert_incomplete = ("""
+# Each distinct artist and (artist, song) pair gets its key once, on its first load.
+key_map_insert_template = ("""
+    INSERT INTO key_map (key_type, artist, song)
+    SELECT DISTINCT n.key_type, n.artist, n.song
+    FROM (
+        SELECT 'artist' AS key_type, e.artist, CAST(NULL AS VARCHAR) AS song
+        FROM {events} AS e
+        WHERE e.artist IS NOT NULL
+        UNION
+        SELECT 'song', e.artist, e.song
+        FROM {events} AS e
+        WHERE e.song IS NOT NULL AND e.artist IS NOT NULL
+    ) AS n
+    LEFT JOIN key_map AS k
+        ON (k.key_type = n.key_type
+            AND k.artist = n.artist
+            AND (k.song = n.song OR (k.song IS NULL AND n.song IS NULL)))
+    WHERE k.key_id IS NULL
+""")
+key_map_insert = key_map_insert_template.format(events='staging_events')
+
+# The artists and songs get their key in key_id, and its decimal string as
+# their VARCHAR id. The ones inserted by a previous run are skipped.
+artist_table_insert_incomplete_template = ("""
+    INSERT INTO artists (artist_id, name, key_id)
+    SELECT DISTINCT
+        CAST(a.key_id AS VARCHAR),
+        e.artist,
+        a.key_id
+    FROM {events} AS e
+    JOIN key_map AS a
+        ON (a.key_type = 'artist' AND a.artist = e.artist)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM artists AS t WHERE t.key_id = a.key_id
+    )
+""")
+artist_table_insert_incomplete = artist_table_insert_incomplete_template.format(events='staging_events')
+
+song_table_insert_incomplete_template = ("""
+    INSERT INTO songs (song_id, title, artist_id, key_id)
+    SELECT DISTINCT
+        CAST(s.key_id AS VARCHAR),
+        e.song,
+        CAST(a.key_id AS VARCHAR),
+        s.key_id
+    FROM {events} AS e
+    JOIN key_map AS s
+        ON (s.key_type = 'song' AND s.artist = e.artist AND s.song = e.song)
+    JOIN key_map AS a
+        ON (a.key_type = 'artist' AND a.artist = e.artist)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM songs AS t WHERE t.key_id = s.key_id
+    )
+""")
+song_table_insert_incomplete = song_table_insert_incomplete_template.format(events='staging_events')
+
+# The fact rows keep the BIGINT keys (joined to songs.key_id and artists.key_id).
+songplay_table_insert_incomplete_template = ("""
+    INSERT INTO songplays (
+        start_time, 
+        user_id, 
+        level, 
+        song_key_id, 
+        artist_key_id, 
+        session_id, 
+        location, 
+        user_agent
+    )
+    SELECT
+        e.ts,
+        e.userId,
+        e.level,
+        s.key_id,
+        a.key_id,
+        e.sessionId,
+        e.location,
+        e.userAgent
+    FROM {events} AS e
+    JOIN key_map AS s
+        ON (s.key_type = 'song' AND s.artist = e.artist AND s.song = e.song)
+    JOIN key_map AS a
+        ON (a.key_type = 'artist' AND a.artist = e.artist)
+    WHERE e.page = 'NextSong'
+""")
+songplay_table_insert_incomplete = songplay_table_insert_incomplete_template.format(events='staging_events')
+
+# Previous MD5 string keys, kept for `benchmark.py keymap`.
+artist_table_insert_incomplete_md5 = ("""
     INSERT INTO artists (artist_id, name)
     SELECT DISTINCT
         MD5(e.artist),
@@ -239,7 +628,7 @@ artist_table_insert_incomplete = ("""
     WHERE e.artist IS NOT NULL
 """)
 
-song_table_insert_incomplete = ("""
+song_table_insert_incomplete_md5 = ("""
     INSERT INTO songs (song_id, title, artist_id)
     SELECT DISTINCT
         MD5(CONCAT(e.song,e.artist)),
@@ -249,7 +638,7 @@ song_table_insert_incomplete = ("""
     WHERE e.song IS NOT NULL AND e.artist IS NOT NULL
 """)
 
-songplay_table_insert_incomplete = ("""
+songplay_table_insert_incomplete_md5 = ("""
     INSERT INTO songplays (
         start_time, 
         user_id, 
@@ -275,38 +664,217 @@ songplay_table_insert_incomplete = ("""
         AND e.artist IS NOT NULL
 """)
 
+# SINGLE PASS
+
+# staging_events is scanned once into staging_plays: NextSong events only and
+# only the columns the inserts read. A regular table, not a temporary one, so
+# the parallel inserts can read it from their own connections.
+staging_plays_drop = "DROP TABLE IF EXISTS staging_plays"
+
+staging_plays_create_template = ("""
+    CREATE TABLE staging_plays {distribution} SORTKEY (ts) AS
+    SELECT
+        artist, firstName, gender, lastName, level, location, page,
+        sessionId, song, ts, userAgent, userId, song_key
+    FROM staging_events
+    WHERE page = 'NextSong'
+""")
+
 # QUERY LISTS
-create_table_queries = [
+default_create_table_queries = [
     staging_events_table_create, 
     staging_songs_table_create, 
     time_table_create, 
     user_table_create, 
     artist_table_create, 
     songplay_table_create, 
-    song_table_create
+    song_table_create,
+    key_map_table_create,
+    calendar_table_create
 ]
 drop_table_queries = [
     staging_events_table_drop, 
     staging_songs_table_drop, 
+    staging_plays_drop,
     song_table_drop, 
     songplay_table_drop, 
     artist_table_drop, 
     user_table_drop, 
     time_table_drop
 ]
-copy_table_queries = [
-    staging_events_copy, 
-    staging_songs_copy
-]
-insert_table_queries = [
-    songplay_table_insert, 
-    user_table_insert, 
-    song_table_insert, 
-    artist_table_insert, 
-    time_table_insert
-]
-insert_incomplete_table_queries = [
-    artist_table_insert_incomplete,
-    song_table_insert_incomplete,
-    songplay_table_insert_incomplete
-]
+
+
+def render_events(templates, events):
+    """
+    Returns the statements of a list of templates reading `events`. The
+    templates without an {events} placeholder are returned as they are.
+
+    INPUTS:
+    * templates list of statements
+    * events string - 'staging_events' or 'staging_plays'
+    """
+    return [template.format(events=events) for template in templates]
+
+
+def render_queries(config):
+    """
+    Renders the statements and query lists that depend on dwh.cfg: the COPY
+    credentials and sources, and the variants selected in the [ETL] section.
+    Returns a dictionary {name: statement or list}.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    arn = config['IAM_ROLE']['ARN']
+    staging_events_copy_template = staging_events_copy_base.format(
+        source='{source}', arn=arn, log_data_path=config['S3']['LOG_JSONPATH'])
+    staging_songs_copy_template = staging_songs_copy_base.format(
+        table='staging_songs', source='{source}', arn=arn)
+    manifest_prefix = config.get('S3', 'MANIFEST_PREFIX', fallback='').strip("'")
+    preprocessed_copy_template = preprocessed_copy_base.format(
+        table='{table}', arn=arn,
+        prefix=config.get('S3', 'PREPROCESSED_PREFIX', fallback='').strip("'"))
+    queries = {
+        'staging_events_copy_template': staging_events_copy_template,
+        'staging_songs_copy_template': staging_songs_copy_template,
+        'staging_songs_delta_copy_template': staging_songs_copy_base.format(
+            table='staging_songs_delta', source='{source}', arn=arn),
+        'staging_events_copy': staging_events_copy_template.format(
+            source=config['S3']['LOG_DATA']),
+        'staging_songs_copy': staging_songs_copy_template.format(
+            source="'s3://udacity-dend/song_data/A/A/A'"),
+        # Manifests written by manifest.py: gzip chunks sized for the cluster slices.
+        'staging_events_copy_manifest': staging_events_copy_template.format(
+            source="'{}/staging_events.manifest'".format(manifest_prefix)) + manifest_options,
+        'staging_songs_copy_manifest': staging_songs_copy_template.format(
+            source="'{}/staging_songs.manifest'".format(manifest_prefix)) + manifest_options,
+        'staging_events_copy_csv':
+            preprocessed_copy_template.format(table='staging_events') + csv_options,
+        'staging_songs_copy_csv':
+            preprocessed_copy_template.format(table='staging_songs') + csv_options,
+        'staging_events_copy_parquet':
+            preprocessed_copy_template.format(table='staging_events') + parquet_options,
+        'staging_songs_copy_parquet':
+            preprocessed_copy_template.format(table='staging_songs') + parquet_options
+    }
+
+    staging_key_queries = []
+    songplay_table_insert_template = songplay_table_insert_by_columns_template
+    if config.getboolean('ETL', 'SONG_KEY_JOIN', fallback=False):
+        staging_key_queries = [
+            staging_events_key_update,
+            staging_songs_key_update
+        ]
+        songplay_table_insert_template = songplay_table_insert_by_key_template
+    time_table_insert_template = time_table_insert_by_extract_template
+    time_table_upsert_template = time_table_upsert_by_extract_template
+    if config.get('ETL', 'TIME_DIMENSION', fallback='extract') == 'calendar':
+        # Already merged on start_time, so it also replaces time_table_upsert.
+        time_table_insert_template = time_table_insert_from_calendar_template
+        time_table_upsert_template = time_table_insert_from_calendar_template
+    songplay_table_insert = songplay_table_insert_template.format(events='staging_events')
+    time_table_insert = time_table_insert_template.format(events='staging_events')
+    time_table_upsert = time_table_upsert_template.format(events='staging_events')
+    # CREATE TABLE statements with column encodings written by encoding_advisor.py
+    create_table_queries = default_create_table_queries
+    if os.path.isfile(config.get('ETL', 'ENCODED_DDL_PATH', fallback='')):
+        with open(config.get('ETL', 'ENCODED_DDL_PATH')) as ddl_file:
+            create_table_queries = [statement.strip() + ';'
+                                    for statement in ddl_file.read().split(';')
+                                    if statement.strip()]
+    copy_table_queries = [
+        queries['staging_events_copy'], 
+        queries['staging_songs_copy']
+    ]
+    if config.getboolean('ETL', 'USE_MANIFESTS', fallback=False):
+        copy_table_queries = [
+            queries['staging_events_copy_manifest'],
+            queries['staging_songs_copy_manifest']
+        ]
+    if config.get('ETL', 'STAGING_FORMAT', fallback='json') == 'csv':
+        copy_table_queries = [
+            queries['staging_events_copy_csv'],
+            queries['staging_songs_copy_csv']
+        ]
+    elif config.get('ETL', 'STAGING_FORMAT', fallback='json') == 'parquet':
+        copy_table_queries = [
+            queries['staging_events_copy_parquet'],
+            queries['staging_songs_copy_parquet']
+        ]
+    insert_table_templates = [
+        songplay_table_insert_template, 
+        user_table_insert_template, 
+        song_table_insert, 
+        artist_table_insert, 
+        time_table_insert_template
+    ]
+    upsert_table_templates = [
+        songplay_table_insert_template, 
+        user_table_upsert_template, 
+        song_table_upsert, 
+        artist_table_upsert, 
+        time_table_upsert_template
+    ]
+    insert_incomplete_table_templates = [
+        key_map_insert_template,
+        artist_table_insert_incomplete_template,
+        song_table_insert_incomplete_template,
+        songplay_table_insert_incomplete_template
+    ]
+    insert_table_queries = render_events(insert_table_templates, 'staging_events')
+    upsert_table_queries = render_events(upsert_table_templates, 'staging_events')
+    insert_incomplete_table_queries = render_events(
+        insert_incomplete_table_templates, 'staging_events')
+    incremental_insert_table_queries = [
+        artist_table_upsert_delta,
+        song_table_upsert_delta,
+        songplay_table_insert + songplay_dedupe_filter,
+        user_table_insert,
+        time_table_upsert
+    ]
+    queries.update({
+        'staging_key_queries': staging_key_queries,
+        'songplay_table_insert': songplay_table_insert,
+        'time_table_insert': time_table_insert,
+        'time_table_upsert': time_table_upsert,
+        'create_table_queries': create_table_queries,
+        'copy_table_queries': copy_table_queries,
+        'insert_table_queries': insert_table_queries,
+        'upsert_table_queries': upsert_table_queries,
+        'incremental_insert_table_queries': incremental_insert_table_queries,
+        'insert_incomplete_table_queries': insert_incomplete_table_queries,
+        # Co-located with staging_songs when the songplays join uses song_key.
+        'staging_plays_create': staging_plays_create_template.format(
+            distribution='DISTKEY (song_key)' if staging_key_queries else 'DISTSTYLE EVEN'),
+        'single_pass_insert_table_queries': render_events(
+            insert_table_templates, 'staging_plays'),
+        'single_pass_upsert_table_queries': render_events(
+            upsert_table_templates, 'staging_plays'),
+        'single_pass_insert_incomplete_table_queries': render_events(
+            insert_incomplete_table_templates, 'staging_plays')
+    })
+    return queries
+
+
+_rendered = {}
+
+
+def __getattr__(name):
+    """
+    Renders the queries of the shared settings on first access, so importing
+    this module does not read dwh.cfg. The scripts read them as
+    `sql_queries.copy_table_queries` when they run, never with
+    `from sql_queries import`, which would keep the queries rendered at
+    import. They are rendered again after the settings saved new runtime
+    state (ARN, endpoint).
+    """
+    if name.startswith('__'):
+        raise AttributeError(name)
+    settings = load_settings()
+    key = (id(settings), settings.version)
+    if key not in _rendered:
+        _rendered.clear()
+        _rendered[key] = render_queries(settings)
+    if name not in _rendered[key]:
+        raise AttributeError("module 'sql_queries' has no attribute '{}'".format(name))
+    return _rendered[key][name]
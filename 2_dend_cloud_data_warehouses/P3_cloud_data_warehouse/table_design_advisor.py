@@ -0,0 +1,346 @@
+from collections import Counter
+import re
+import sys
+import time
+import pandas as pd
+import sql_queries
+from connection import get_pool
+from local_stand_in import is_local_stand_in_enabled
+from scheduler import TABLE_PATTERN, parse_table_definitions
+from settings import load_settings
+
+
+TABLE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|RIGHT\b|INNER\b"
+    r"|FULL\b|CROSS\b|GROUP\b|ORDER\b|LIMIT\b|USING\b)(\w+))?", re.IGNORECASE)
+JOIN_PATTERN = re.compile(r"\b(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)")
+FILTER_PATTERN = re.compile(
+    r"\b(?:(\w+)\.)?(\w+)\s*(=|<>|!=|<=|>=|<|>|\bBETWEEN\b|\bIN\b|\bLIKE\b)\s*(?!\w+\.\w)",
+    re.IGNORECASE)
+RANGE_OPERATORS = ('<', '>', '<=', '>=', 'BETWEEN')
+IDENTITY_PATTERN = re.compile(r"^\s*(\w+)\s+\w+\s+IDENTITY\(", re.IGNORECASE | re.MULTILINE)
+DESIGN_PATTERN = re.compile(r"\s+\b(DISTKEY|SORTKEY)\b|\s*\bDISTSTYLE\s+\w+", re.IGNORECASE)
+
+
+def read_workload(path):
+    """
+    Returns the statements of a workload file (separated by `;`), without
+    their comments.
+
+    INPUT:
+    * path string - SQL file
+    """
+    with open(path) as workload_file:
+        text = re.sub(r"--[^\n]*", "", workload_file.read())
+    return [statement.strip() for statement in text.split(';') if statement.strip()]
+
+
+def analyze_workload(statements, tables):
+    """
+    Parses the joins and filters of every statement.
+    Returns a dictionary with the Counter of joins {((table, column),
+    (table, column)): count}, the Counter of filters {(table, column): count}
+    and the Counter of range filters (<, >, BETWEEN).
+
+    INPUTS:
+    * statements list of SQL queries
+    * tables dictionary returned by parse_table_definitions()
+    """
+    joins, filters, ranges = Counter(), Counter(), Counter()
+    for statement in statements:
+        aliases = {}
+        for table, alias in TABLE_REFERENCE_PATTERN.findall(statement):
+            if table.lower() in tables:
+                aliases[table.lower()] = table.lower()
+                if alias:
+                    aliases[alias.lower()] = table.lower()
+
+        def resolve(alias, column):
+            column = column.lower()
+            if alias:
+                table = aliases.get(alias.lower())
+                return (table, column) if table and column in tables[table]['columns'] else None
+            # Unqualified column: only when exactly one table of the query has it.
+            candidates = {table for table in aliases.values() if column in tables[table]['columns']}
+            return (candidates.pop(), column) if len(candidates) == 1 else None
+
+        for left_alias, left_column, right_alias, right_column in JOIN_PATTERN.findall(statement):
+            left, right = resolve(left_alias, left_column), resolve(right_alias, right_column)
+            if left and right and left[0] != right[0]:
+                joins[tuple(sorted((left, right)))] += 1
+
+        where = re.search(r"\bWHERE\b(.*?)(?:\bGROUP\b|\bORDER\b|\bLIMIT\b|$)",
+                          statement, re.IGNORECASE | re.DOTALL)
+        for alias, column, operator in FILTER_PATTERN.findall(where.group(1) if where else ''):
+            target = resolve(alias, column)
+            if target:
+                filters[target] += 1
+                if operator.upper() in RANGE_OPERATORS:
+                    ranges[target] += 1
+    return {'joins': joins, 'filters': filters, 'ranges': ranges}
+
+
+def propose_design(tables, workload, row_counts=None, all_max_rows=1000000):
+    """
+    Proposes a distribution style, distribution key and sort key per table:
+    - the fact table (the table joined the most) is distributed on the join
+      column of its most frequent join and sorted on its most filtered column
+      (range filters first);
+    - the dimension joined on that column gets the same DISTKEY and SORTKEY,
+      so the join is co-located and can be a merge join;
+    - the other dimensions are small enough to be copied to every node
+      (DISTSTYLE ALL) and are sorted on their join column;
+    - tables absent from the workload keep their current DDL (diststyle None).
+    Returns {table: {'diststyle', 'distkey', 'sortkey', 'reason'}}.
+
+    INPUTS:
+    * tables dictionary returned by parse_table_definitions()
+    * workload dictionary returned by analyze_workload()
+    * row_counts dictionary {table: rows} (optional)
+    * all_max_rows int - Largest dimension copied with DISTSTYLE ALL
+    """
+    row_counts = row_counts or {}
+    joined = Counter()
+    for (left, right), count in workload['joins'].items():
+        joined[left[0]] += count
+        joined[right[0]] += count
+    design = {table: {'diststyle': None, 'distkey': None, 'sortkey': None,
+                      'reason': 'not in the workload'} for table in tables}
+    if not joined:
+        return design
+
+    fact = joined.most_common(1)[0][0]
+    fact_joins = Counter()
+    for (left, right), count in workload['joins'].items():
+        if fact in (left[0], right[0]):
+            own, other = (left, right) if left[0] == fact else (right, left)
+            # Co-locating the biggest dimension saves the most redistribution.
+            fact_joins[(own, other)] += count * max(row_counts.get(other[0], 1), 1)
+    (fact_column, dimension), _ = fact_joins.most_common(1)[0]
+    sort_candidates = Counter({column: count * 2 + workload['ranges'][column]
+                               for column, count in workload['filters'].items()
+                               if column[0] == fact})
+    fact_sortkey = sort_candidates.most_common(1)[0][0][1] if sort_candidates else fact_column[1]
+    design[fact] = {'diststyle': 'KEY', 'distkey': fact_column[1], 'sortkey': fact_sortkey,
+                    'reason': 'fact table, co-located with {}'.format(dimension[0])}
+    design[dimension[0]] = {'diststyle': 'KEY', 'distkey': dimension[1], 'sortkey': dimension[1],
+                            'reason': 'joined to {} on its distribution key'.format(fact)}
+
+    for (own, other), _ in fact_joins.most_common():
+        table = other[0]
+        if table == dimension[0] or design[table]['diststyle']:
+            continue
+        if row_counts.get(table, 0) > all_max_rows:
+            design[table] = {'diststyle': 'EVEN', 'distkey': None, 'sortkey': other[1],
+                             'reason': 'too big for DISTSTYLE ALL'}
+        else:
+            design[table] = {'diststyle': 'ALL', 'distkey': None, 'sortkey': other[1],
+                             'reason': 'small dimension joined to {}'.format(fact)}
+    return design
+
+
+def rewrite_design(create_query, design):
+    """
+    Returns the CREATE TABLE statement with the table design as table
+    attributes, replacing the DISTKEY and SORTKEY column attributes.
+    Without a design the statement gets DISTSTYLE EVEN and no keys (`nodist`);
+    a design without diststyle returns the statement unchanged.
+
+    INPUTS:
+    * create_query string - CREATE TABLE statement
+    * design dictionary with diststyle, distkey and sortkey (or None)
+    """
+    if design and not design['diststyle']:
+        return create_query
+    start, end = create_query.index('(') + 1, create_query.rindex(')')
+    body = '\n'.join(DESIGN_PATTERN.sub('', line) for line in create_query[start:end].split('\n'))
+    attributes = ' DISTSTYLE EVEN'
+    if design:
+        attributes = ' DISTSTYLE {}'.format(design['diststyle'])
+        if design['distkey']:
+            attributes += ' DISTKEY ({})'.format(design['distkey'])
+        if design['sortkey']:
+            attributes += ' SORTKEY ({})'.format(design['sortkey'])
+    # Table attributes after the closing parenthesis are replaced too.
+    tail = re.sub(r"\)[^)]*;\s*$", ')' + attributes + ';', create_query[end:].rstrip())
+    return create_query[:start] + body + tail + '\n'
+
+
+def design_queries(design=None):
+    """
+    Returns the CREATE TABLE statements of create_table_queries with a design
+    ({table: design}) or, without one, with no distribution or sort keys.
+
+    INPUT:
+    * design dictionary returned by propose_design()
+    """
+    queries = []
+    for query in sql_queries.create_table_queries:
+        table = TABLE_PATTERN.search(query).group(1).lower()
+        queries.append(rewrite_design(query, design[table] if design else None))
+    return queries
+
+
+def count_table_rows(cur, tables):
+    """
+    Returns the rows of every table, used to weight the joins.
+
+    INPUTS:
+    * cur the cursor variable
+    * tables list of table names
+    """
+    counts = {}
+    for table in tables:
+        cur.execute("SELECT COUNT(*) FROM {}".format(table))
+        counts[table] = cur.fetchone()[0]
+    return counts
+
+
+def create_schema(cur, conn, schema, queries):
+    """
+    (Re)creates a schema with the given tables and copies into it the rows of
+    the tables loaded by etl.py.
+
+    INPUTS:
+    * cur the cursor variable
+    * conn the connection to the DB
+    * schema string - Name of the schema (e.g. 'dist')
+    * queries list of CREATE TABLE statements
+    """
+    cur.execute("DROP SCHEMA IF EXISTS {} CASCADE".format(schema))
+    cur.execute("CREATE SCHEMA {}".format(schema))
+    cur.execute("SET search_path TO {}".format(schema))
+    for query in queries:
+        cur.execute(query)
+        table = TABLE_PATTERN.search(query).group(1).lower()
+        # IDENTITY columns cannot be inserted explicitly on Redshift.
+        identities = {column.lower() for column in IDENTITY_PATTERN.findall(query)}
+        columns = ', '.join(column for column in parse_table_definitions([query])[table]['columns']
+                            if column not in identities)
+        cur.execute("INSERT INTO {0}.{1} ({2}) SELECT {2} FROM public.{1}".format(
+            schema, table, columns))
+        cur.execute("ANALYZE {}.{}".format(schema, table))
+    conn.commit()
+    print("- Schema `", schema, "` created and loaded.", sep='')
+
+
+def run_workload(config, cur, conn, schema, statements, runs):
+    """
+    Replays the workload in a schema. Returns one row per statement and run
+    with the wall time.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * cur the cursor variable
+    * conn the connection to the DB
+    * schema string - Name of the schema
+    * statements list of SQL queries
+    * runs int - Runs of each statement
+    """
+    if not is_local_stand_in_enabled(config):
+        # Every run must be executed, not read from the result cache.
+        cur.execute("SET enable_result_cache_for_session TO off")
+    cur.execute("SET search_path TO {}".format(schema))
+    results = []
+    for run in range(1, runs + 1):
+        for index, statement in enumerate(statements):
+            start = time.time()
+            cur.execute(statement)
+            cur.fetchall()
+            results.append({'schema': schema, 'query': index + 1, 'run': run,
+                            'seconds': round(time.time() - start, 3)})
+    conn.commit()
+    return results
+
+
+def benchmark_designs(config, statements, design, runs=3):
+    """
+    A/B benchmark of the workload: the tables are copied into a `nodist`
+    schema (no distribution or sort keys) and a `dist` schema (the proposed
+    design) and every statement is replayed in both.
+    Returns a DataFrame with the median time per query and schema.
+
+    INPUTS:
+    * config ConfigParser() object with parameters
+    * statements list of SQL queries
+    * design dictionary returned by propose_design()
+    * runs int - Runs of each statement per schema
+    """
+    results = []
+    with get_pool(config).connection() as conn:
+        cur = conn.cursor()
+        for schema, queries in (('nodist', design_queries()), ('dist', design_queries(design))):
+            create_schema(cur, conn, schema, queries)
+            results.extend(run_workload(config, cur, conn, schema, statements, runs))
+        cur.execute("SET search_path TO public")
+        conn.commit()
+    stats = pd.DataFrame(results).groupby(['query', 'schema'])['seconds'].median().unstack()
+    stats['speedup'] = (stats['nodist'] / stats['dist']).round(2)
+    return stats
+
+
+def print_design(workload, design):
+    """
+    Prints the joins and filters found in the workload and the proposed design.
+
+    INPUTS:
+    * workload dictionary returned by analyze_workload()
+    * design dictionary returned by propose_design()
+    """
+    print("- Joins:")
+    for ((left_table, left_column), (right_table, right_column)), count in \
+            workload['joins'].most_common():
+        print("    ", left_table, ".", left_column, " = ", right_table, ".", right_column,
+              ": ", count, sep='')
+    print("- Filters:")
+    for (table, column), count in workload['filters'].most_common():
+        print("    ", table, ".", column, ": ", count, " (", workload['ranges'][(table, column)],
+              " range)", sep='')
+    print("- Design:")
+    for table, choice in design.items():
+        if not choice['diststyle']:
+            print("    ", table, ": current DDL kept - ", choice['reason'], sep='')
+            continue
+        print("    ", table, ": DISTSTYLE ", choice['diststyle'],
+              " DISTKEY ({})".format(choice['distkey']) if choice['distkey'] else '',
+              " SORTKEY ({})".format(choice['sortkey']) if choice['sortkey'] else '',
+              " - ", choice['reason'], sep='')
+
+
+def main():
+    """
+    Proposes the table design for a workload and writes the DDL to
+    TABLE_DESIGN_DDL_PATH. With `benchmark` it also replays the workload
+    against the `nodist` and `dist` schemas. Run it after etl.py.
+    Usage: python3 table_design_advisor.py <workload.sql> [benchmark [runs]]
+    """
+    if len(sys.argv) < 2:
+        print("- Usage: python3 table_design_advisor.py <workload.sql> [benchmark [runs]]")
+        return
+    config = load_settings()
+
+    tables = parse_table_definitions(sql_queries.create_table_queries)
+    statements = read_workload(sys.argv[1])
+    with get_pool(config).connection() as conn:
+        row_counts = count_table_rows(conn.cursor(), list(tables))
+        conn.commit()
+
+    print("1. Analyzing", len(statements), "queries:")
+    workload = analyze_workload(statements, tables)
+    design = propose_design(tables, workload, row_counts,
+                            config.getint('ETL', 'DIST_ALL_MAX_ROWS', fallback=1000000))
+    print_design(workload, design)
+
+    path = config.get('ETL', 'TABLE_DESIGN_DDL_PATH', fallback='') or 'table_design.sql'
+    with open(path, 'w') as ddl_file:
+        ddl_file.write('\n'.join(query.strip() for query in design_queries(design)) + '\n')
+    print("2. Table design DDL written:", path)
+
+    if len(sys.argv) > 2 and sys.argv[2] == 'benchmark':
+        runs = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+        print("3. Replaying the workload against `nodist` and `dist`:")
+        print(benchmark_designs(config, statements, design, runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,10 @@ import boto3
 import json
 import time
 
-import configparser
 from botocore.exceptions import ClientError
+from waiter import wait_for_cluster
+from lifecycle import delete_cluster_with_snapshot, prune_snapshots, snapshot_mode
+from settings import load_settings
 
 PATH = './dwh.cfg'
 
@@ -104,10 +106,8 @@ def detachPolicyToRole(iam, config):
         iam.detach_role_policy(RoleName=config['DWH']['DWH_IAM_ROLE_NAME'], 
                             PolicyArn="arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess")
 
-        print("Deleting ARN from '", PATH[2:], "' file", sep='')
-        config['IAM_ROLE']['ARN'] = ''
-        with open(PATH, 'w') as conf:
-            config.write(conf)
+        print("Deleting ARN from '", config.state_path, "' file", sep='')
+        config.save_state({'IAM_ROLE': {'ARN': ''}})
     except ClientError as e:
         if "NoSuchEntity" in e.response['Error']['Code']:
             print("- Role is already deleted")
@@ -119,30 +119,30 @@ def detachPolicyToRole(iam, config):
 def deleteRedshiftCluster(redshift, config):
     try:
         print('-------------------------------------')
-        print('Deleting Redshift cluster')
-        redshift.delete_cluster( ClusterIdentifier=config['DWH']['DWH_CLUSTER_IDENTIFIER'],  SkipFinalClusterSnapshot=True)
-        config['DWH']['DWH_ENDPOINT'] = ""
-        print('Deleting endpoint from', PATH[2:], 'file')
-        with open(PATH, 'w') as conf:
-            config.write(conf)
+        if snapshot_mode(config):
+            delete_cluster_with_snapshot(redshift, config)
+        else:
+            print('Deleting Redshift cluster')
+            redshift.delete_cluster( ClusterIdentifier=config['DWH']['DWH_CLUSTER_IDENTIFIER'],  SkipFinalClusterSnapshot=True)
+        print('Deleting endpoint from', config.state_path, 'file')
+        config.save_state({'DWH': {'DWH_ENDPOINT': ""}})
     except ClientError as e:
         if "ClusterNotFound" in e.response['Error']['Code']:
             print("- Redshift cluster is already deleted")
         else:
             print(e)        
-        print('Deleting endpoint from', PATH[2:], 'file')
-        config['DWH']['DWH_ENDPOINT'] = ""
-        with open(PATH, 'w') as conf:
-            config.write(conf)
+        print('Deleting endpoint from', config.state_path, 'file')
+        config.save_state({'DWH': {'DWH_ENDPOINT': ""}})
     except Exception as e:
         print(e)
 
-def describeRedshiftCluster(redshift, config):
+def describeRedshiftCluster(redshift, config, myClusterProps=None):
     try:
         pd.set_option('display.max_colwidth', None)
         keysToShow = ["ClusterIdentifier", "NodeType", "ClusterStatus", "MasterUsername", 
                 "DBName", "Endpoint", "NumberOfNodes", 'VpcId']
-        myClusterProps = redshift.describe_clusters(ClusterIdentifier=config['DWH']['DWH_CLUSTER_IDENTIFIER'])['Clusters'][0]
+        if myClusterProps is None:
+            myClusterProps = getRedshiftClusterProperties(redshift, config)
         x = [(k, v) for k,v in myClusterProps.items() if k in keysToShow]
         print(pd.DataFrame(data=x, columns=["Key", "Value"]))
         print('-------------------------------------')
@@ -160,36 +160,18 @@ def isRedshiftClusterAvailable(redshift, config):
 
 def isRedshiftClusterDeleted(redshift, config):
     try:
-        time_passed = 1
-        while getStatusOfRedshiftCluster(redshift, config) != 'available':
-            print("Redshift Cluster Status:", getStatusOfRedshiftCluster(redshift, config), "-", time_passed, "s")
-            time.sleep(10)
-            time_passed += 10
-    except ClientError as e:
-        if "ClusterNotFound" in e.response['Error']['Code']:
-            print("- Redshift cluster is now deleted")
-        else:
-            print("Here", e)
+        wait_for_cluster(redshift, config, 'delete')
+        print("- Redshift cluster is now deleted")
     except Exception as e:
         print(e)
     
 def waitUntilRedshiftClusterIsAvailable(redshift,config):
-    time_passed = 0
     print("5. Creating cluster:")
-    while not(isRedshiftClusterAvailable(redshift,config)):
-        time.sleep(2)
-        time_passed += 2
-        if time_passed % 30 == 0:
-            print("* ClusterStatus at ", time_passed, "s: ", 
-                getStatusOfRedshiftCluster(redshift,config), sep="")
-    print("- ClusterStatus at ", time_passed, "s: ", 
-                getStatusOfRedshiftCluster(redshift,config), sep="")
+    myClusterProps = wait_for_cluster(redshift, config, 'create')
     print('-------------------------------------')
-    describeRedshiftCluster(redshift,config)
-    print("6. Saving hostname in", PATH[2:], "file")
-    config['DWH']['DWH_ENDPOINT'] = redshift.describe_clusters(ClusterIdentifier=config['DWH']['DWH_CLUSTER_IDENTIFIER'])['Clusters'][0]['Endpoint']['Address']
-    with open(PATH, 'w') as conf:
-        config.write(conf)
+    describeRedshiftCluster(redshift,config,myClusterProps)
+    print("6. Saving hostname in", config.state_path, "file")
+    config.save_state({'DWH': {'DWH_ENDPOINT': myClusterProps['Endpoint']['Address']}})
     print('-------------------------------------')
 
 def openIncomingTCPPort(ec2,redshift,config):
@@ -222,9 +204,7 @@ def main():
     Fouth, we create the cluster in Redshift and wait until it is available.
     Then, we open the incoming TCP port.
     """
-    config = configparser.ConfigParser()
-    config.optionxform=str
-    config.read(PATH)
+    config = load_settings(PATH)
     empty_sections = getEmptySections(config)
     getPrettyParameters(config)
 
@@ -241,6 +221,8 @@ def main():
     detachPolicyToRole(iam, config)
     deleteRole(iam, config['DWH']['DWH_IAM_ROLE_NAME'])
     isRedshiftClusterDeleted(redshift,config)
+    if snapshot_mode(config):
+        prune_snapshots(redshift, config)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+import contextlib
+import io
+import unittest
+
+from execution import ExecutionPlan, PhaseError
+
+
+class FakeCursor:
+    """
+    Cursor recording the statements, failing on 'bad'.
+    """
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, query):
+        if query == 'bad':
+            raise RuntimeError('bad statement')
+        self.executed.append(query)
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class ExecutionPlanTest(unittest.TestCase):
+
+    def make_plan(self, queries, **options):
+        cur, conn = FakeCursor(), FakeConnection()
+        plan = ExecutionPlan('phase', queries, lambda query: query, **options)
+        return plan, cur, conn
+
+    def test_successful_phase_returns_its_statistics(self):
+        plan, cur, conn = self.make_plan(['a', 'b', 'c'], batch_size=2)
+        stats = plan.run(cur, conn)
+        self.assertEqual((stats['statements'], stats['failed'], stats['commits']), (3, 0, 2))
+
+    def test_failed_batch_is_rolled_back_and_raises(self):
+        plan, cur, conn = self.make_plan(['a', 'b', 'c', 'bad', 'd'], batch_size=2)
+        with self.assertRaises(PhaseError) as raised:
+            plan.run(cur, conn)
+        self.assertEqual(raised.exception.phase, 'phase')
+        self.assertEqual(conn.rollbacks, 1)
+        # The batch after the failed one never runs.
+        self.assertNotIn('d', cur.executed)
+
+    def test_rolled_back_statements_are_not_counted(self):
+        plan, cur, conn = self.make_plan(['a', 'b', 'c', 'bad'], batch_size=2)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(PhaseError):
+            plan.run(cur, conn)
+        # 'c' ran but its batch was rolled back: only the first batch counts.
+        self.assertIn("2 statements, 1 failed, 1 commits", output.getvalue())
+
+    def test_savepoints_finish_the_phase_then_raise(self):
+        plan, cur, conn = self.make_plan(['a', 'bad', 'b'], savepoints=True)
+        with self.assertRaises(PhaseError):
+            plan.run(cur, conn)
+        self.assertIn('b', cur.executed)
+        self.assertEqual(conn.commits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
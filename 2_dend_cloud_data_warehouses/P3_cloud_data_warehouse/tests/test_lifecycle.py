@@ -0,0 +1,150 @@
+import configparser
+from datetime import datetime, timedelta
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.stub import ANY, Stubber
+
+import lifecycle
+
+
+CLUSTER = 'sparkifyCluster'
+
+
+def make_config(history_path=''):
+    """
+    Returns the [DWH] settings the lifecycle functions read.
+
+    INPUT:
+    * history_path string - DWH_WAIT_HISTORY_PATH (empty: nothing recorded)
+    """
+    config = configparser.ConfigParser()
+    config.read_dict({'DWH': {
+        'DWH_CLUSTER_IDENTIFIER': CLUSTER,
+        'DWH_NODE_TYPE': 'dc2.large',
+        'DWH_NUM_NODES': '4',
+        'DWH_SNAPSHOT_RETENTION': '2',
+        'DWH_WAIT_HISTORY_PATH': history_path
+    }})
+    return config
+
+
+def make_snapshot(identifier, age_days, status='available'):
+    """
+    Returns a snapshot as described by describe_cluster_snapshots.
+
+    INPUTS:
+    * identifier string - Snapshot identifier
+    * age_days int - Days since the snapshot was created
+    * status string - Snapshot status
+    """
+    return {'SnapshotIdentifier': identifier, 'ClusterIdentifier': CLUSTER,
+            'Status': status, 'SnapshotType': 'manual',
+            'SnapshotCreateTime': datetime(2018, 11, 30) - timedelta(days=age_days)}
+
+
+class LifecycleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.redshift = boto3.client('redshift', region_name='us-west-2',
+                                     aws_access_key_id='key', aws_secret_access_key='secret')
+        self.stubber = Stubber(self.redshift)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+
+    def stub_snapshots(self, snapshots):
+        self.stubber.add_response(
+            'describe_cluster_snapshots', {'Snapshots': snapshots},
+            {'ClusterIdentifier': CLUSTER, 'SnapshotType': 'manual'})
+
+    def test_list_snapshots_returns_available_ones_newest_first(self):
+        self.stub_snapshots([make_snapshot('old', 3), make_snapshot('new', 1),
+                             make_snapshot('creating', 0, status='creating')])
+        snapshots = lifecycle.list_snapshots(self.redshift, CLUSTER)
+        self.assertEqual([snapshot['SnapshotIdentifier'] for snapshot in snapshots],
+                         ['new', 'old'])
+        self.stubber.assert_no_pending_responses()
+
+    def test_list_snapshots_of_a_missing_cluster_is_empty(self):
+        self.stubber.add_client_error('describe_cluster_snapshots', 'ClusterNotFound')
+        self.assertEqual(lifecycle.list_snapshots(self.redshift, CLUSTER), [])
+
+    def test_list_snapshots_raises_other_errors(self):
+        self.stubber.add_client_error('describe_cluster_snapshots', 'AccessDenied')
+        with self.assertRaises(lifecycle.ClientError):
+            lifecycle.list_snapshots(self.redshift, CLUSTER)
+
+    def test_restore_cluster_uses_the_latest_snapshot(self):
+        self.stub_snapshots([make_snapshot('old', 3), make_snapshot('new', 1)])
+        self.stubber.add_response(
+            'restore_from_cluster_snapshot', {'Cluster': {}},
+            {'ClusterIdentifier': CLUSTER, 'SnapshotIdentifier': 'new',
+             'NodeType': 'dc2.large', 'NumberOfNodes': 4, 'IamRoles': ['arn:role']})
+        self.assertEqual(lifecycle.restore_cluster(self.redshift, make_config(), 'arn:role'), 'new')
+        self.stubber.assert_no_pending_responses()
+
+    def test_restore_cluster_without_snapshot_returns_none(self):
+        self.stub_snapshots([])
+        self.assertIsNone(lifecycle.restore_cluster(self.redshift, make_config(), 'arn:role'))
+        self.stubber.assert_no_pending_responses()
+
+    def test_delete_cluster_with_snapshot_takes_a_final_snapshot(self):
+        self.stubber.add_response(
+            'delete_cluster', {'Cluster': {}},
+            {'ClusterIdentifier': CLUSTER, 'SkipFinalClusterSnapshot': False,
+             'FinalClusterSnapshotIdentifier': ANY})
+        snapshot = lifecycle.delete_cluster_with_snapshot(self.redshift, make_config())
+        self.assertRegex(snapshot, r'^sparkifycluster-\d{8}-\d{6}$')
+        self.stubber.assert_no_pending_responses()
+
+    def test_prune_snapshots_keeps_the_newest_ones(self):
+        self.stub_snapshots([make_snapshot('day-{}'.format(age), age) for age in range(4)])
+        for identifier in ('day-2', 'day-3'):
+            self.stubber.add_response('delete_cluster_snapshot', {'Snapshot': {}},
+                                      {'SnapshotIdentifier': identifier})
+        self.assertEqual(lifecycle.prune_snapshots(self.redshift, make_config()),
+                         ['day-2', 'day-3'])
+        self.stubber.assert_no_pending_responses()
+
+
+class PrepareWarehouseTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.history_path = os.path.join(directory.name, 'waits.json')
+        self.config = make_config(self.history_path)
+
+    def recorded(self):
+        with open(self.history_path) as history_file:
+            return json.load(history_file)
+
+    @mock.patch('lifecycle.full_reload')
+    @mock.patch('lifecycle.is_warehouse_loaded', return_value=True)
+    def test_restored_and_loaded_warehouse_is_not_reloaded(self, is_loaded, full_reload):
+        self.assertEqual(lifecycle.prepare_warehouse(self.config, 'snap', 0.0), 'restore')
+        full_reload.assert_not_called()
+        self.assertIn('first_query_restore', self.recorded())
+
+    @mock.patch('lifecycle.full_reload')
+    @mock.patch('lifecycle.is_warehouse_loaded', return_value=False)
+    def test_restored_but_empty_warehouse_falls_back_to_reload(self, is_loaded, full_reload):
+        self.assertEqual(lifecycle.prepare_warehouse(self.config, 'snap', 0.0), 'reload')
+        full_reload.assert_called_once_with()
+        self.assertIn('first_query_reload', self.recorded())
+
+    @mock.patch('lifecycle.full_reload')
+    @mock.patch('lifecycle.is_warehouse_loaded')
+    def test_new_cluster_is_reloaded_without_checking(self, is_loaded, full_reload):
+        self.assertEqual(lifecycle.prepare_warehouse(self.config, None, 0.0), 'reload')
+        full_reload.assert_called_once_with()
+        # Only the check after the reload, none before it.
+        is_loaded.assert_called_once_with(self.config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+import json
+import os
+import tempfile
+import unittest
+
+from botocore.exceptions import ClientError
+
+import provisioning
+from settings import Settings
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'operation')
+
+
+class FakeIAM:
+    """
+    IAM client whose role becomes readable once it has been created.
+    """
+
+    def __init__(self):
+        self.roles = {}
+        self.policies = []
+
+    def create_role(self, RoleName, **kwargs):
+        self.roles[RoleName] = {'RoleName': RoleName,
+                                'Arn': 'arn:aws:iam::123456789012:role/' + RoleName}
+
+    def get_role(self, RoleName):
+        if RoleName not in self.roles:
+            raise client_error('NoSuchEntity')
+        return {'Role': self.roles[RoleName]}
+
+    def attach_role_policy(self, RoleName, PolicyArn):
+        self.policies.append((RoleName, PolicyArn))
+
+
+class FakeSecurityGroup:
+
+    def __init__(self, group_id):
+        self.id = group_id
+        self.group_name = 'default'
+        self.ingress = []
+
+    def authorize_ingress(self, **kwargs):
+        self.ingress.append(kwargs)
+
+
+class FakeSecurityGroups:
+
+    def __init__(self, group):
+        self.group = group
+
+    def filter(self, Filters):
+        assert Filters == [{'Name': 'group-name', 'Values': ['default']}], Filters
+        return [self.group]
+
+
+class FakeVpc:
+
+    def __init__(self, vpc_id, is_default):
+        self.id = vpc_id
+        self.is_default = is_default
+        self.security_groups = FakeSecurityGroups(FakeSecurityGroup('sg-' + vpc_id))
+
+
+class FakeEC2:
+    """
+    EC2 resource with the VPCs given, each one with its default security group.
+    """
+
+    def __init__(self, vpcs):
+        self.vpcs_by_id = {vpc.id: vpc for vpc in vpcs}
+        self.vpcs = self
+
+    def filter(self, Filters):
+        assert Filters == [{'Name': 'isDefault', 'Values': ['true']}], Filters
+        return [vpc for vpc in self.vpcs_by_id.values() if vpc.is_default]
+
+    def Vpc(self, id):
+        return self.vpcs_by_id[id]
+
+
+class FakeRedshift:
+    """
+    Redshift client whose cluster is available on the second status call.
+    """
+
+    def __init__(self, vpc_id):
+        self.vpc_id = vpc_id
+        self.created = None
+        self.status_calls = 0
+
+    def create_cluster(self, **kwargs):
+        self.created = kwargs
+
+    def describe_clusters(self, ClusterIdentifier):
+        if self.created is None:
+            raise client_error('ClusterNotFound')
+        self.status_calls += 1
+        status = 'available' if self.status_calls > 1 else 'creating'
+        return {'Clusters': [{'ClusterIdentifier': ClusterIdentifier, 'ClusterStatus': status,
+                              'VpcId': self.vpc_id,
+                              'Endpoint': {'Address': 'sparkify.example.com', 'Port': 5439}}]}
+
+
+class ProvisionTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.config_path = os.path.join(directory.name, 'dwh.cfg')
+        self.state_path = os.path.join(directory.name, 'dwh_state.json')
+        with open(self.config_path, 'w') as config_file:
+            config_file.write('\n'.join([
+                '[DWH]',
+                'DWH_CLUSTER_TYPE = multi-node',
+                'DWH_NUM_NODES = 4',
+                'DWH_NODE_TYPE = dc2.large',
+                'DWH_IAM_ROLE_NAME = dwhRole',
+                'DWH_CLUSTER_IDENTIFIER = sparkifyCluster',
+                'DWH_DB = sparkify',
+                'DWH_DB_USER = user',
+                'DWH_DB_PASSWORD = password',
+                'DWH_PORT = 5439',
+                'DWH_STATE_PATH = ' + self.state_path,
+                'DWH_WAIT_INITIAL_SECONDS = 0.01',
+                'DWH_WAIT_MAX_SECONDS = 0.01',
+                'DWH_WAIT_DEADLINE_SECONDS = 5',
+                '[IAM_ROLE]',
+                'ARN = '
+            ]) + '\n')
+        with open(self.config_path) as config_file:
+            self.config_text = config_file.read()
+        self.config = Settings(self.config_path)
+        self.iam = FakeIAM()
+
+    def provision(self, ec2, redshift):
+        state, trace = provisioning.provision(
+            {'iam': self.iam, 'ec2': ec2, 'redshift': redshift}, self.config)
+        self.assertEqual({node['name']: node['status'] for node in trace},
+                         {name: 'succeeded' for name in provisioning.PROVISIONING_STEPS})
+        return state
+
+    def test_provision_creates_the_cluster_and_saves_the_state(self):
+        vpc = FakeVpc('vpc-1', is_default=True)
+        redshift = FakeRedshift('vpc-1')
+        state = self.provision(FakeEC2([vpc]), redshift)
+
+        arn = 'arn:aws:iam::123456789012:role/dwhRole'
+        self.assertEqual(self.iam.policies, [('dwhRole', provisioning.S3_READ_ONLY_POLICY)])
+        self.assertEqual(redshift.created['IamRoles'], [arn])
+        self.assertEqual(state['ingress_vpc'], 'vpc-1')
+        self.assertEqual(vpc.security_groups.group.ingress, [
+            {'GroupId': 'sg-vpc-1', 'CidrIp': '0.0.0.0/0', 'IpProtocol': 'TCP',
+             'FromPort': 5439, 'ToPort': 5439}])
+        # The ARN and the endpoint go to the state file, dwh.cfg is untouched.
+        with open(self.state_path) as state_file:
+            self.assertEqual(json.load(state_file), {
+                'IAM_ROLE': {'ARN': arn}, 'DWH': {'DWH_ENDPOINT': 'sparkify.example.com'}})
+        with open(self.config_path) as config_file:
+            self.assertEqual(config_file.read(), self.config_text)
+        self.assertEqual(self.config['IAM_ROLE']['ARN'], arn)
+
+    def test_cluster_outside_the_default_vpc_opens_its_own_group(self):
+        default_vpc = FakeVpc('vpc-1', is_default=True)
+        cluster_vpc = FakeVpc('vpc-2', is_default=False)
+        self.provision(FakeEC2([default_vpc, cluster_vpc]), FakeRedshift('vpc-2'))
+
+        self.assertEqual(len(default_vpc.security_groups.group.ingress), 1)
+        cluster_ingress = cluster_vpc.security_groups.group.ingress
+        self.assertEqual([ingress['GroupId'] for ingress in cluster_ingress], ['sg-vpc-2'])
+
+    def test_without_default_vpc_the_port_is_opened_in_the_cluster_vpc(self):
+        cluster_vpc = FakeVpc('vpc-2', is_default=False)
+        state = self.provision(FakeEC2([cluster_vpc]), FakeRedshift('vpc-2'))
+
+        self.assertNotIn('ingress_vpc', state)
+        self.assertEqual(len(cluster_vpc.security_groups.group.ingress), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from scheduler import parse_table_definitions
+from table_design_advisor import analyze_workload, propose_design, rewrite_design
+
+
+SONGPLAYS = """
+CREATE TABLE IF NOT EXISTS songplays (
+    songplay_id     INT         IDENTITY(0,1),
+    start_time      TIMESTAMP   NOT NULL,
+    user_id         INT         NOT NULL,
+    song_id         VARCHAR
+);
+"""
+USERS = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id         INT         NOT NULL    SORTKEY,
+    level           VARCHAR
+);
+"""
+TIME = """
+CREATE TABLE IF NOT EXISTS time (
+    start_time      TIMESTAMP   NOT NULL    SORTKEY,
+    hour            INT
+);
+"""
+CALENDAR = """
+CREATE TABLE IF NOT EXISTS calendar (
+    hour_start      TIMESTAMP   NOT NULL    SORTKEY,
+    hour            INT         NOT NULL
+) DISTSTYLE ALL;
+"""
+KEY_MAP = """
+CREATE TABLE IF NOT EXISTS key_map (
+    kind            VARCHAR     NOT NULL,
+    song_key        BIGINT      NOT NULL    DISTKEY
+);
+"""
+WORKLOAD = [
+    "SELECT u.level, COUNT(*) FROM songplays sp JOIN users u ON sp.user_id = u.user_id "
+    "WHERE sp.start_time > '2018-11-01' GROUP BY u.level",
+    "SELECT t.hour, COUNT(*) FROM songplays sp JOIN time t ON sp.start_time = t.start_time "
+    "GROUP BY t.hour"
+]
+
+
+class TableDesignTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = {'songplays': SONGPLAYS, 'users': USERS, 'time': TIME,
+                        'calendar': CALENDAR, 'key_map': KEY_MAP}
+        tables = parse_table_definitions(list(self.queries.values()))
+        self.design = propose_design(tables, analyze_workload(WORKLOAD, tables),
+                                     {'songplays': 1000, 'users': 100, 'time': 1000})
+
+    def test_tables_in_the_workload_are_redesigned(self):
+        self.assertEqual(self.design['songplays']['diststyle'], 'KEY')
+        self.assertEqual(self.design['songplays']['sortkey'], 'start_time')
+        self.assertEqual(self.design['time']['distkey'], 'start_time')
+        self.assertEqual(self.design['users']['diststyle'], 'ALL')
+        self.assertIn('DISTSTYLE ALL SORTKEY (user_id);',
+                      rewrite_design(USERS, self.design['users']))
+
+    def test_tables_without_workload_evidence_round_trip_unchanged(self):
+        for table in ('calendar', 'key_map'):
+            self.assertIsNone(self.design[table]['diststyle'])
+            self.assertEqual(rewrite_design(self.queries[table], self.design[table]),
+                             self.queries[table])
+
+    def test_nodist_removes_every_key(self):
+        rewritten = rewrite_design(KEY_MAP, None)
+        self.assertNotIn('DISTKEY', rewritten)
+        self.assertIn(') DISTSTYLE EVEN;', rewritten)
+
+
+if __name__ == '__main__':
+    unittest.main()
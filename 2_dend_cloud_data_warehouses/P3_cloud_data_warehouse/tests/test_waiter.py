@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from botocore.exceptions import ClientError
+
+import waiter
+
+
+class StubRedshift:
+    """
+    Redshift client returning the given cluster statuses, one per
+    describe_clusters call (None: the cluster does not exist).
+    """
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def describe_clusters(self, ClusterIdentifier):
+        status = self.statuses[min(self.calls, len(self.statuses) - 1)]
+        self.calls += 1
+        if status is None:
+            raise ClientError({'Error': {'Code': 'ClusterNotFound', 'Message': ''}},
+                              'DescribeClusters')
+        return {'Clusters': [{'ClusterIdentifier': ClusterIdentifier, 'ClusterStatus': status}]}
+
+
+class FakeClock:
+    """
+    Clock only moved by the sleeps of the waiter.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+OPTIONS = {'initial': 1.0, 'maximum': 4.0, 'deadline': 20.0}
+
+
+class WaitForClusterTest(unittest.TestCase):
+
+    def wait(self, statuses, operation='create'):
+        self.redshift, self.clock = StubRedshift(statuses), FakeClock()
+        return asyncio.run(waiter.wait_for_cluster_async(
+            self.redshift, 'sparkifyCluster', operation, OPTIONS,
+            sleep=self.clock.sleep, clock=self.clock))
+
+    def test_ready_after_several_polls(self):
+        props, elapsed, ticks = self.wait(['creating', 'creating', 'available'])
+        self.assertEqual(props['ClusterStatus'], 'available')
+        self.assertEqual((ticks, self.redshift.calls, len(self.clock.sleeps)), (3, 3, 2))
+        self.assertEqual(elapsed, sum(self.clock.sleeps))
+
+    def test_deleted_cluster_is_ready_for_delete(self):
+        props, _, ticks = self.wait(['deleting', None], operation='delete')
+        self.assertIsNone(props)
+        self.assertEqual(ticks, 2)
+
+    def test_timeout_after_the_deadline(self):
+        with self.assertRaises(waiter.WaitTimeout):
+            self.wait(['creating'])
+        # The last sleep is cut to the deadline, and one poll follows it.
+        self.assertEqual(self.clock.now, OPTIONS['deadline'])
+        self.assertEqual(self.redshift.calls, len(self.clock.sleeps) + 1)
+
+    def test_terminal_failure_stops_the_wait(self):
+        with self.assertRaises(waiter.WaitFailed):
+            self.wait(['creating', 'incompatible-network', 'available'])
+        self.assertEqual(self.redshift.calls, 2)
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_delays_grow_up_to_the_maximum_with_bounded_jitter(self):
+        delays = waiter.backoff_delays(1.0, 8.0, multiplier=2.0, jitter=0.2,
+                                       rng=random.Random(7))
+        for base in [1, 2, 4, 8, 8, 8, 8]:
+            delay = next(delays)
+            self.assertGreaterEqual(delay, base * 0.8)
+            self.assertLessEqual(delay, base)
+
+    def test_no_jitter_gives_the_exact_delays(self):
+        delays = waiter.backoff_delays(1.0, 5.0, jitter=0.0)
+        self.assertEqual([next(delays) for _ in range(5)], [1.0, 2.0, 4.0, 5.0, 5.0])
+
+
+class RecordWaitTest(unittest.TestCase):
+
+    def test_durations_are_appended_atomically(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'waits.json')
+            waiter.record_wait(path, 'create', 120.04)
+            self.assertEqual(waiter.record_wait(path, 'create', 90.0), [120.0, 90.0])
+            waiter.record_wait(path, 'delete', 30.0)
+            with open(path) as history_file:
+                self.assertEqual(json.load(history_file),
+                                 {'create': [120.0, 90.0], 'delete': [30.0]})
+            # Only the history itself: no temporary file left behind.
+            self.assertEqual(os.listdir(directory), ['waits.json'])
+
+    def test_without_path_nothing_is_written(self):
+        self.assertEqual(waiter.record_wait('', 'create', 12.34), [12.3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import sys
+import pandas as pd
+import sql_queries
+from connection import get_pool
+from settings import load_settings
+
+
+CALENDAR_COLUMNS = ['hour_start', 'hour', 'day', 'week', 'month', 'year', 'weekday']
+
+
+def build_calendar(start, end):
+    """
+    Returns a DataFrame with one row per hour between start and end (both
+    included) and its time parts, computed with vectorized pandas operations.
+    The parts match EXTRACT on Redshift: the week is the ISO week.
+
+    INPUTS:
+    * start datetime-like - First hour
+    * end datetime-like - Last hour
+    """
+    hours = pd.date_range(pd.Timestamp(start).floor('H'), pd.Timestamp(end).floor('H'), freq='H')
+    return pd.DataFrame({
+        'hour_start': hours,
+        'hour': hours.hour,
+        'day': hours.day,
+        'week': hours.isocalendar().week.astype(int).values,
+        'month': hours.month,
+        'year': hours.year,
+        'weekday': hours.day_name()
+    }, columns=CALENDAR_COLUMNS)
+
+
+def missing_hours(cur, start, end):
+    """
+    Returns the (start, end) ranges of hours not in the calendar yet. The
+    calendar is always one contiguous range, extended before or after.
+
+    INPUTS:
+    * cur the cursor variable
+    * start datetime-like - First hour needed
+    * end datetime-like - Last hour needed
+    """
+    start, end = pd.Timestamp(start).floor('H'), pd.Timestamp(end).floor('H')
+    cur.execute(sql_queries.calendar_range)
+    first, last = cur.fetchone()
+    if first is None:
+        return [(start, end)]
+    first, last = pd.Timestamp(first), pd.Timestamp(last)
+    ranges = []
+    if start < first:
+        ranges.append((start, first - pd.Timedelta(hours=1)))
+    if end > last:
+        ranges.append((last + pd.Timedelta(hours=1), end))
+    return ranges
+
+
+def insert_calendar(cur, calendar, batch_size=1000):
+    """
+    Bulk inserts the calendar rows with multi-row INSERT statements.
+
+    INPUTS:
+    * cur the cursor variable
+    * calendar DataFrame returned by build_calendar()
+    * batch_size int - Rows per INSERT
+    """
+    rows = ["('{}', {}, {}, {}, {}, {}, '{}')".format(
+        hour_start.strftime('%Y-%m-%d %H:%M:%S'), hour, day, week, month, year, weekday)
+        for hour_start, hour, day, week, month, year, weekday
+        in calendar[CALENDAR_COLUMNS].itertuples(index=False)]
+    for start in range(0, len(rows), batch_size):
+        cur.execute("INSERT INTO calendar ({}) VALUES {}".format(
+            ', '.join(CALENDAR_COLUMNS), ', '.join(rows[start:start + batch_size])))
+
+
+def ensure_calendar(cur, start=None, end=None):
+    """
+    Extends the calendar so it covers start..end (default: the timestamps in
+    staging_events). Returns the number of hours added. The caller commits.
+
+    INPUTS:
+    * cur the cursor variable
+    * start datetime-like - First hour needed (optional)
+    * end datetime-like - Last hour needed (optional)
+    """
+    if start is None or end is None:
+        cur.execute(sql_queries.calendar_bounds)
+        start, end = cur.fetchone()
+        if start is None:
+            return 0
+    added = 0
+    for first, last in missing_hours(cur, start, end):
+        calendar = build_calendar(first, last)
+        insert_calendar(cur, calendar)
+        added += len(calendar)
+    print("- Calendar: ", added, " hours added.", sep='')
+    return added
+
+
+def main():
+    """
+    Generates the calendar for a range of dates, or for the timestamps in
+    staging_events when no range is given.
+    Usage: python3 time_dimension.py [start end]
+    """
+    config = load_settings()
+
+    start, end = (sys.argv[1], sys.argv[2]) if len(sys.argv) > 2 else (None, None)
+    pool = get_pool(config)
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        ensure_calendar(cur, start, end)
+        conn.commit()
+    pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
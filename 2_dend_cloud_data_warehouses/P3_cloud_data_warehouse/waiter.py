@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from botocore.exceptions import ClientError
+from settings import write_json_atomically
+
+
+class WaitTimeout(Exception):
+    """
+    Raised when the resource does not reach the expected state before the
+    deadline.
+    """
+
+
+class WaitFailed(Exception):
+    """
+    Raised when the resource reaches a state it does not leave on its own.
+    """
+
+
+# State each cluster operation waits for. None: the cluster no longer exists.
+CLUSTER_TARGETS = {
+    'create': 'available',
+    'resume': 'available',
+    'restore': 'available',
+    'pause': 'paused',
+    'delete': None
+}
+
+# Cluster states that never reach the target without an intervention.
+CLUSTER_FAILURES = {'hardware-failure', 'incompatible-hsm', 'incompatible-network',
+                    'incompatible-parameters', 'incompatible-restore', 'storage-full'}
+
+
+def backoff_delays(initial, maximum, multiplier=2.0, jitter=0.2, rng=random):
+    """
+    Yields the delays between two polls: exponential from `initial` up to
+    `maximum`, each one shortened by a random fraction of at most `jitter`
+    so that concurrent waiters do not poll in lockstep.
+
+    INPUTS:
+    * initial float - First delay in seconds
+    * maximum float - Largest delay in seconds
+    * multiplier float - Growth factor of the delay
+    * jitter float - Largest random reduction (0.2 = up to 20% shorter)
+    * rng random.Random-like object
+    """
+    delay = initial
+    while True:
+        yield delay * (1 - jitter * rng.random())
+        delay = min(delay * multiplier, maximum)
+
+
+async def wait_until(describe, is_ready, deadline, initial=5.0, maximum=60.0, multiplier=2.0,
+                     jitter=0.2, on_tick=None, sleep=asyncio.sleep, clock=time.monotonic,
+                     rng=random, has_failed=None):
+    """
+    Polls `describe` until `is_ready` accepts its result, sleeping with
+    jittered exponential backoff between polls. `describe` is called exactly
+    once per tick, in a thread so that other waiters keep running.
+    Returns (result, elapsed seconds, ticks). Raises WaitTimeout after
+    `deadline` seconds, and WaitFailed as soon as `has_failed` accepts the
+    result.
+
+    INPUTS:
+    * describe function() returning the current state of the resource
+    * is_ready function(state) -> bool
+    * deadline float - Total seconds to wait
+    * initial, maximum, multiplier, jitter - see backoff_delays()
+    * on_tick function(state, elapsed, tick) called after every poll
+    * sleep coroutine function(seconds) (replaceable in tests)
+    * clock function() returning seconds (replaceable in tests)
+    * rng random.Random-like object
+    * has_failed function(state) -> bool (optional)
+    """
+    loop = asyncio.get_running_loop()
+    origin = clock()
+    delays = backoff_delays(initial, maximum, multiplier, jitter, rng)
+    tick = 0
+    while True:
+        state = await loop.run_in_executor(None, describe)
+        tick += 1
+        elapsed = clock() - origin
+        if on_tick:
+            on_tick(state, elapsed, tick)
+        if is_ready(state):
+            return state, elapsed, tick
+        if has_failed and has_failed(state):
+            raise WaitFailed("Failed after {:.0f}s and {} polls".format(elapsed, tick))
+        if elapsed >= deadline:
+            raise WaitTimeout("Not ready after {:.0f}s and {} polls".format(elapsed, tick))
+        await sleep(min(next(delays), max(deadline - elapsed, 0)))
+
+
+def describe_cluster(redshift, identifier):
+    """
+    Returns the properties of a Redshift cluster, or None when it does not
+    exist.
+
+    INPUTS:
+    * redshift boto3 Redshift client
+    * identifier string - Cluster identifier
+    """
+    try:
+        return redshift.describe_clusters(ClusterIdentifier=identifier)['Clusters'][0]
+    except ClientError as e:
+        if "ClusterNotFound" in e.response['Error']['Code']:
+            return None
+        raise
+
+
+def cluster_is_ready(operation):
+    """
+    Returns the readiness predicate of a cluster operation.
+
+    INPUT:
+    * operation string - Key of CLUSTER_TARGETS
+    """
+    target = CLUSTER_TARGETS[operation]
+    if target is None:
+        return lambda props: props is None
+    return lambda props: props is not None and props['ClusterStatus'] == target
+
+
+def cluster_has_failed(props):
+    """
+    Returns True when the cluster is in one of the CLUSTER_FAILURES states.
+
+    INPUT:
+    * props dictionary returned by describe_cluster() (None: deleted)
+    """
+    return props is not None and props['ClusterStatus'] in CLUSTER_FAILURES
+
+
+async def wait_for_cluster_async(redshift, identifier, operation, options, sleep=asyncio.sleep,
+                                 clock=time.monotonic):
+    """
+    Waits until a cluster operation has finished. Prints the status at
+    every poll. Returns (cluster properties or None, elapsed seconds, ticks).
+    Raises WaitFailed when the cluster reaches one of the CLUSTER_FAILURES.
+
+    INPUTS:
+    * redshift boto3 Redshift client
+    * identifier string - Cluster identifier
+    * operation string - 'create', 'resume', 'restore', 'pause' or 'delete'
+    * options dictionary returned by waiter_options()
+    * sleep, clock - see wait_until()
+    """
+    def on_tick(props, elapsed, tick):
+        print("* ClusterStatus at ", round(elapsed), "s: ",
+              props['ClusterStatus'] if props else 'deleted', sep="")
+
+    return await wait_until(
+        lambda: describe_cluster(redshift, identifier), cluster_is_ready(operation),
+        options['deadline'], options['initial'], options['maximum'],
+        on_tick=on_tick, sleep=sleep, clock=clock, has_failed=cluster_has_failed)
+
+
+def waiter_options(config):
+    """
+    Returns the backoff settings of the [DWH] section.
+
+    INPUT:
+    * config ConfigParser() object with parameters
+    """
+    return {
+        'initial': config.getfloat('DWH', 'DWH_WAIT_INITIAL_SECONDS', fallback=5),
+        'maximum': config.getfloat('DWH', 'DWH_WAIT_MAX_SECONDS', fallback=60),
+        'deadline': config.getfloat('DWH', 'DWH_WAIT_DEADLINE_SECONDS', fallback=1800),
+        'history_path': config.get('DWH', 'DWH_WAIT_HISTORY_PATH', fallback='')
+    }
+
+
+def record_wait(path, operation, seconds):
+    """
+    Appends the duration of a wait to the JSON history file and returns the
+    durations recorded for that operation. The file is replaced atomically
+    (see write_json_atomically), so an interrupted run keeps the history.
+
+    INPUTS:
+    * path string - History file (nothing is recorded when empty)
+    * operation string - e.g. 'create'
+    * seconds float - Duration of the wait
+    """
+    if not path:
+        return [round(seconds, 1)]
+    history = {}
+    if os.path.exists(path):
+        with open(path) as history_file:
+            history = json.load(history_file)
+    history.setdefault(operation, []).append(round(seconds, 1))
+    write_json_atomically(path, history)
+    return history[operation]
+
+
+def print_wait_distribution(operation, durations):
+    """
+    Prints the distribution of the recorded durations of an operation.
+
+    INPUTS:
+    * operation string - e.g. 'create'
+    * durations list of seconds
+    """
+    ordered = sorted(durations)
+    p90 = ordered[min(len(ordered) - 1, int(round(0.9 * (len(ordered) - 1))))]
+    print("- Time to ", CLUSTER_TARGETS[operation] or 'deleted', " over ", len(ordered),
+          " runs: min ", ordered[0], "s, median ", round(statistics.median(ordered), 1),
+          "s, p90 ", p90, "s, max ", ordered[-1], "s", sep='')
+
+
+def wait_for_cluster(redshift, config, operation):
+    """
+    Waits until a cluster operation has finished, records its duration and
+    prints the distribution of the previous ones. Returns the cluster
+    properties (None once deleted).
+
+    INPUTS:
+    * redshift boto3 Redshift client
+    * config ConfigParser() object with parameters
+    * operation string - 'create', 'resume', 'restore', 'pause' or 'delete'
+    """
+    options = waiter_options(config)
+    props, elapsed, ticks = asyncio.run(wait_for_cluster_async(
+        redshift, config['DWH']['DWH_CLUSTER_IDENTIFIER'], operation, options))
+    print("- Cluster ", CLUSTER_TARGETS[operation] or 'deleted', " after ", round(elapsed),
+          "s and ", ticks, " status calls", sep='')
+    print_wait_distribution(operation, record_wait(options['history_path'], operation, elapsed))
+    return props
@@ -0,0 +1,52 @@
+-- Sample analytical workload of the Sparkify analysts, used by
+-- table_design_advisor.py. One statement per query, separated by `;`.
+
+-- Most played songs in a month
+SELECT s.title, a.name, COUNT(*) AS plays
+FROM songplays sp
+JOIN songs s ON sp.song_id = s.song_id
+JOIN artists a ON sp.artist_id = a.artist_id
+JOIN time t ON sp.start_time = t.start_time
+WHERE t.year = 2018 AND t.month = 11
+GROUP BY s.title, a.name
+ORDER BY plays DESC
+LIMIT 10;
+
+-- Plays per hour of the day for paid users
+SELECT t.hour, COUNT(*) AS plays
+FROM songplays sp
+JOIN time t ON sp.start_time = t.start_time
+JOIN users u ON sp.user_id = u.user_id
+WHERE u.level = 'paid'
+GROUP BY t.hour
+ORDER BY t.hour;
+
+-- Top artists by listeners
+SELECT a.name, COUNT(DISTINCT sp.user_id) AS listeners
+FROM songplays sp
+JOIN artists a ON sp.artist_id = a.artist_id
+GROUP BY a.name
+ORDER BY listeners DESC
+LIMIT 20;
+
+-- Plays per weekday and gender in the last week of the logs
+SELECT t.weekday, u.gender, COUNT(*) AS plays
+FROM songplays sp
+JOIN time t ON sp.start_time = t.start_time
+JOIN users u ON sp.user_id = u.user_id
+WHERE sp.start_time BETWEEN '2018-11-24' AND '2018-11-30'
+GROUP BY t.weekday, u.gender;
+
+-- Songs of the most played year
+SELECT s.year, COUNT(*) AS plays
+FROM songplays sp
+JOIN songs s ON sp.song_id = s.song_id
+WHERE s.year > 0
+GROUP BY s.year
+ORDER BY plays DESC;
+
+-- Listening sessions of a user
+SELECT sp.session_id, MIN(sp.start_time), MAX(sp.start_time), COUNT(*)
+FROM songplays sp
+WHERE sp.user_id = '15' AND sp.start_time >= '2018-11-01'
+GROUP BY sp.session_id;
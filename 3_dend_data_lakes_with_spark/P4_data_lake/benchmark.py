@@ -0,0 +1,414 @@
+import configparser
+import gzip
+import os
+import re
+import sys
+import tempfile
+from pyspark.sql import SparkSession
+from pyspark import StorageLevel
+from etl import (
+    BROADCAST_THRESHOLD_MB, DIMENSION_STORAGE_LEVEL, months_between, process_song_data,
+    process_log_data)
+
+# The data generator and the result helpers are shared with the data warehouse
+# project (P3).
+P3_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                       '2_dend_cloud_data_warehouses', 'P3_cloud_data_warehouse')
+sys.path.append(P3_PATH)
+from benchmark_results import compare_results, directory_size, measure, write_results
+from generate_data import generate, generator_options
+
+# Files written by generate_data.py, relative to its output directory.
+GENERATED_SONG_DATA = 'song_data/*.json.gz'
+GENERATED_LOG_DATA = 'log_data/*/*/*.json.gz'
+GENERATED_LOG_MONTH_DATA = 'log_data/{year:04d}/{month:02d}/*.json.gz'
+
+SONG_TABLES = ['songs', 'artists']
+LOG_TABLES = ['users', 'time', 'songplays']
+
+# Filter of a typical query of each partitioned table, on its partition
+# columns. The pruning benchmark generates a year of events, so the month
+# filters keep 1/12 of time and songplays.
+PRUNING_FILTERS = {
+    'songs': "year = 2000",
+    'time': "year = 2018 AND month = 11",
+    'songplays': "year = 2018 AND month = 11"
+}
+PRUNING_DATES = ('2018-01-01', '2018-12-31')
+
+# Date ranges of the incremental runs of the incremental benchmark, on a year
+# of events.
+INCREMENTAL_RANGES = [('2018-11-01', '2018-11-30'), ('2018-10-01', '2018-12-31')]
+
+# Broadcast thresholds of the join benchmark, in MB: the configured one, and
+# ones forcing each strategy.
+JOIN_THRESHOLDS = {
+    'auto': None,
+    'broadcast': 1024 * 1024,
+    'bucketed_sort_merge': 0
+}
+
+
+class JvmPeakMemory:
+    """
+    Peak heap used by the Spark JVM while a `with` block runs. In local mode
+    the driver and the executors share this JVM.
+    """
+
+    def __init__(self, spark):
+        """
+        INPUT:
+        - spark: a Spark session
+        """
+        management = spark.sparkContext._jvm.java.lang.management.ManagementFactory
+        self.pools = [pool for pool in management.getMemoryPoolMXBeans()
+                      if pool.getType().toString() == 'Heap memory']
+        self.bytes = 0
+
+    def __enter__(self):
+        for pool in self.pools:
+            pool.resetPeakUsage()
+        return self
+
+    def __exit__(self, *args):
+        self.bytes = sum(pool.getPeakUsage().getUsed() for pool in self.pools)
+
+
+def create_local_spark_session(config):
+    """
+    Creates a local-mode Spark session for the benchmarks.
+
+    INPUT:
+    - config: ConfigParser with an optional [BENCHMARK] section.
+    """
+    spark = SparkSession \
+        .builder \
+        .master(config.get('BENCHMARK', 'SPARK_MASTER', fallback='local[*]')) \
+        .appName('sparkify-benchmark') \
+        .config("spark.sql.shuffle.partitions",
+                config.get('BENCHMARK', 'SHUFFLE_PARTITIONS', fallback='8')) \
+        .config("spark.sql.legacy.timeParserPolicy", "LEGACY") \
+        .config("spark.sql.session.timeZone", "UTC") \
+        .config("spark.ui.showConsoleProgress", "false") \
+        .getOrCreate()
+    spark.sparkContext.setLogLevel('WARN')
+    print("- Local Spark session created.")
+    return spark
+
+
+def output_size(output_data, tables):
+    """
+    Returns the bytes of the parquet files of tables.
+
+    INPUT:
+    - output_data: output directory of the ETL
+    - tables: list of table names
+    """
+    return sum(directory_size(os.path.join(output_data, table + '.parquet')) for table in tables)
+
+
+def partition_filters(table_df):
+    """
+    Returns the partition filters of the parquet scans in the physical plan
+    of a DataFrame (empty when no partition is pruned).
+
+    INPUT:
+    - table_df: DataFrame reading parquet files
+    """
+    plan = table_df._jdf.queryExecution().executedPlan().toString()
+    return [filters for filters in re.findall(r"PartitionFilters: \[([^\]]*)\]", plan) if filters]
+
+
+def benchmark_pruning(spark, config, sizes):
+    """
+    Generates a year of events at each scale, runs the ETL and copies every
+    partitioned table without partitions. Then times the same filtered
+    query (PRUNING_FILTERS) on both layouts. The plan of the partitioned
+    layout must prune partitions, otherwise an AssertionError is raised.
+    Returns the results of every stage (see measure()), with the partition
+    filters of each scan.
+
+    INPUT:
+    - spark: a local Spark session
+    - config: ConfigParser with the optional [GENERATOR] section
+    - sizes: list of numbers of events
+    """
+    results = []
+    for events in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            input_data = os.path.join(directory, 'input') + '/'
+            output_data = os.path.join(directory, 'output') + '/'
+            options = generator_options(config, events)
+            options['file_format'] = 'json'
+            options['start_date'], options['end_date'] = PRUNING_DATES
+            generate(options, input_data)
+            process_song_data(spark, input_data, output_data, GENERATED_SONG_DATA)
+            process_log_data(spark, input_data, output_data, GENERATED_LOG_DATA)
+
+            for table, condition in PRUNING_FILTERS.items():
+                partitioned = output_data + table + '.parquet'
+                flat = output_data + table + '_flat.parquet'
+                spark.read.parquet(partitioned).write.parquet(flat)
+                for layout, path in (('flat', flat), ('partitioned', partitioned)):
+                    table_df = spark.read.parquet(path).filter(condition)
+                    filters = partition_filters(table_df)
+                    if layout == 'partitioned':
+                        assert filters, "No partition pruning in the plan of " + table
+                    result = measure(
+                        events, '{} {} scan'.format(table, layout),
+                        lambda: table_df.write.format('noop').mode('overwrite').save(),
+                        rows=table_df.count, memory=lambda: JvmPeakMemory(spark))
+                    result['partition_filters'] = filters
+                    print("  PartitionFilters:", filters or 'none')
+                    results.append(result)
+    return results
+
+
+def table_counts(spark, output_data):
+    """
+    Returns the rows of every log table, and of each month of songplays.
+
+    INPUT:
+    - spark: a Spark session
+    - output_data: output directory of the ETL
+    """
+    counts = {table: spark.read.parquet(output_data + table + '.parquet').count()
+              for table in LOG_TABLES}
+    for row in spark.read.parquet(output_data + 'songplays.parquet') \
+            .groupBy('year', 'month').count().collect():
+        counts['songplays {}-{:02d}'.format(row['year'], row['month'])] = row['count']
+    return counts
+
+
+def benchmark_incremental(spark, config, sizes):
+    """
+    Generates a year of events at each scale and processes it fully, then
+    runs the incremental mode on the date ranges of INCREMENTAL_RANGES.
+    Re-processing months that are already stored must not change any table,
+    otherwise an AssertionError is raised.
+    Returns the results of every stage (see measure()).
+
+    INPUT:
+    - spark: a local Spark session
+    - config: ConfigParser with the optional [GENERATOR] section
+    - sizes: list of numbers of events
+    """
+    results = []
+    for events in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            input_data = os.path.join(directory, 'input') + '/'
+            output_data = os.path.join(directory, 'output') + '/'
+            options = generator_options(config, events)
+            options['file_format'] = 'json'
+            options['start_date'], options['end_date'] = PRUNING_DATES
+            generate(options, input_data)
+            process_song_data(spark, input_data, output_data, GENERATED_SONG_DATA)
+            results.append(measure(
+                events, 'full log_data',
+                lambda: process_log_data(spark, input_data, output_data, GENERATED_LOG_DATA),
+                rows=lambda: events, bytes_written=lambda: output_size(output_data, LOG_TABLES),
+                memory=lambda: JvmPeakMemory(spark)))
+            expected = table_counts(spark, output_data)
+
+            for start_date, end_date in INCREMENTAL_RANGES:
+                months = months_between(start_date, end_date)
+                month_dirs = [os.path.join(input_data, 'log_data', '{:04d}'.format(year),
+                                           '{:02d}'.format(month)) for year, month in months]
+                results.append(measure(
+                    events, 'incremental {} month(s)'.format(len(months)),
+                    lambda: process_log_data(spark, input_data, output_data, months=months,
+                                             month_files=GENERATED_LOG_MONTH_DATA),
+                    rows=lambda: sum(rows for rows, _ in map(count_generated, month_dirs)),
+                    bytes_written=lambda: sum(
+                        directory_size(os.path.join(output_data, table + '.parquet',
+                                                    'year={}'.format(year), 'month={}'.format(month)))
+                        for table in ('time', 'songplays') for year, month in months),
+                    memory=lambda: JvmPeakMemory(spark)))
+                assert table_counts(spark, output_data) == expected, \
+                    "The incremental run changed the stored tables"
+    return results
+
+
+def count_generated(directory):
+    """
+    Returns the events and bytes of the generated log files of a directory.
+
+    INPUT:
+    - directory: directory of gzip JSON lines files
+    """
+    rows = 0
+    for name in os.listdir(directory):
+        with gzip.open(os.path.join(directory, name), 'rt') as log_file:
+            rows += sum(1 for _ in log_file)
+    return rows, directory_size(directory)
+
+
+def benchmark_dimensions(spark, config, sizes):
+    """
+    Compares the log stage reading songs and artists back from parquet with
+    the log stage using the DataFrames persisted by the song stage
+    (DIMENSION_STORAGE_LEVEL of the [ETL] section). The parquet bytes of
+    the two tables are the bytes the cache saves reading from S3.
+    Returns the results of every stage (see measure()), with the dimension
+    bytes read back.
+
+    INPUT:
+    - spark: a local Spark session
+    - config: ConfigParser with the optional [GENERATOR] and [ETL] sections
+    - sizes: list of numbers of events
+    """
+    storage_level = getattr(StorageLevel, config.get(
+        'ETL', 'DIMENSION_STORAGE_LEVEL', fallback=DIMENSION_STORAGE_LEVEL))
+    results = []
+    for events in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            input_data = os.path.join(directory, 'input') + '/'
+            output_data = os.path.join(directory, 'output') + '/'
+            options = generator_options(config, events)
+            options['file_format'] = 'json'
+            generate(options, input_data)
+            seconds = {}
+            for mode in ('reread', 'cache'):
+                dimensions = process_song_data(
+                    spark, input_data, output_data, GENERATED_SONG_DATA,
+                    storage_level=storage_level if mode == 'cache' else None)
+                result = measure(
+                    events, 'process_log_data ' + mode,
+                    lambda: process_log_data(
+                        spark, input_data, output_data, GENERATED_LOG_DATA,
+                        dimensions=dimensions if mode == 'cache' else None),
+                    rows=lambda: events, bytes_written=lambda: output_size(output_data, LOG_TABLES),
+                    memory=lambda: JvmPeakMemory(spark))
+                result['dimension_bytes_read'] = \
+                    output_size(output_data, SONG_TABLES) if mode == 'reread' else 0
+                seconds[mode] = result['seconds']
+                results.append(result)
+                for dimension in dimensions:
+                    dimension.unpersist()
+            print("- ", events, ": the cache saves ", results[-2]['dimension_bytes_read'],
+                  " bytes read and ", round(seconds['reread'] - seconds['cache'], 3), "s", sep='')
+    return results
+
+
+def benchmark_join(spark, config, sizes):
+    """
+    Compares the strategies of the songplays join on events with skewed
+    artists (JOIN_ZIPF_SKEW of the [BENCHMARK] section): the one chosen with
+    BROADCAST_THRESHOLD_MB of the [ETL] section, then broadcast and bucketed
+    sort-merge forced.
+    Returns the results of every stage (see measure()), with the metrics of
+    the join.
+
+    INPUT:
+    - spark: a local Spark session
+    - config: ConfigParser with the optional [GENERATOR], [ETL] and [BENCHMARK] sections
+    - sizes: list of numbers of events
+    """
+    results = []
+    for events in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            input_data = os.path.join(directory, 'input') + '/'
+            output_data = os.path.join(directory, 'output') + '/'
+            options = generator_options(config, events)
+            options['file_format'] = 'json'
+            options['skew'] = config.getfloat('BENCHMARK', 'JOIN_ZIPF_SKEW', fallback=1.5)
+            generate(options, input_data)
+            dimensions = process_song_data(spark, input_data, output_data, GENERATED_SONG_DATA,
+                                           storage_level=StorageLevel.MEMORY_AND_DISK)
+            for name, threshold_mb in JOIN_THRESHOLDS.items():
+                if threshold_mb is None:
+                    threshold_mb = config.getint('ETL', 'BROADCAST_THRESHOLD_MB',
+                                                 fallback=BROADCAST_THRESHOLD_MB)
+                metrics = {}
+                result = measure(
+                    events, 'songplays join ' + name,
+                    lambda: metrics.update(process_log_data(
+                        spark, input_data, output_data, GENERATED_LOG_DATA,
+                        dimensions=dimensions, broadcast_threshold_mb=threshold_mb,
+                        lookup_path=os.path.join(directory, 'scratch', 'song_lookup.parquet'))),
+                    rows=lambda: events, bytes_written=lambda: output_size(output_data, LOG_TABLES),
+                    memory=lambda: JvmPeakMemory(spark))
+                result['join'] = metrics['songplays_join']
+                result['source_scans'] = metrics['source_scans']
+                print("  Join:", result['join'])
+                results.append(result)
+            for dimension in dimensions:
+                dimension.unpersist()
+    return results
+
+
+def benchmark_etl(spark, config, sizes):
+    """
+    Runs process_song_data and process_log_data on generated data at each
+    scale and returns the results of every stage (see measure()).
+
+    INPUT:
+    - spark: a local Spark session
+    - config: ConfigParser with the optional [GENERATOR] section
+    - sizes: list of numbers of events
+    """
+    results = []
+    for events in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            input_data = os.path.join(directory, 'input') + '/'
+            output_data = os.path.join(directory, 'output') + '/'
+            options = generator_options(config, events)
+            options['file_format'] = 'json'
+            totals = {}
+            results.append(measure(
+                events, 'generate', lambda: totals.update(generate(options, input_data)),
+                rows=lambda: sum(rows for rows, _ in totals.values()),
+                bytes_written=lambda: sum(size for _, size in totals.values())))
+            results.append(measure(
+                events, 'process_song_data',
+                lambda: process_song_data(spark, input_data, output_data, GENERATED_SONG_DATA),
+                rows=lambda: totals['songs'][0],
+                bytes_written=lambda: output_size(output_data, SONG_TABLES),
+                memory=lambda: JvmPeakMemory(spark)))
+            metrics = {}
+            results.append(measure(
+                events, 'process_log_data',
+                lambda: metrics.update(process_log_data(
+                    spark, input_data, output_data, GENERATED_LOG_DATA)),
+                rows=lambda: totals['events'][0],
+                bytes_written=lambda: output_size(output_data, LOG_TABLES),
+                memory=lambda: JvmPeakMemory(spark)))
+            results[-1]['source_scans'] = metrics['source_scans']
+    return results
+
+
+BENCHMARKS = {
+    'etl': benchmark_etl,
+    'pruning': benchmark_pruning,
+    'incremental': benchmark_incremental,
+    'dimensions': benchmark_dimensions,
+    'join': benchmark_join
+}
+
+
+def main():
+    """
+    Benchmarks the ETL in local-mode Spark on generated data.
+    Usage: python3 benchmark.py <benchmark> [events ...]
+    or: python3 benchmark.py compare <old results> <new results>
+    """
+    if len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        compare_results(sys.argv[2], sys.argv[3])
+        return
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("- Choose a benchmark:", ", ".join(BENCHMARKS))
+        return
+    # dl.cfg is optional here: the benchmark reads and writes local files only.
+    config = configparser.ConfigParser()
+    config.read('dl.cfg')
+    sizes = [int(size) for size in sys.argv[2:]] or [10000, 100000, 1000000]
+
+    spark = create_local_spark_session(config)
+    results = BENCHMARKS[sys.argv[1]](spark, config, sizes)
+    write_results(config.get('BENCHMARK', 'RESULTS_DIR', fallback='benchmark_results'),
+                  sys.argv[1], results)
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
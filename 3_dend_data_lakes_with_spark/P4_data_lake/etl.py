@@ -1,45 +1,302 @@
 from pyspark.sql import SparkSession
+from datetime import datetime
 import os
+import sys
 import configparser
-from botocore.exceptions import ClientError
+from pyspark import StorageLevel
+from pyspark.sql.functions import col
+from pyspark.sql.utils import AnalysisException
 from pyspark.sql.types import (
     StructType, StructField, StringType, DoubleType, IntegerType, TimestampType)
-import boto3
 
 
-config = configparser.ConfigParser()
-config.read_file(open('dl.cfg'))
+# Files read by default, relative to input_data.
+SONG_DATA = 'song_data/A/A/A/*.json'
+LOG_DATA = 'log_data/2018/11/2018-11-01-events.json'
+# Log files of one month, read by incremental runs.
+LOG_MONTH_DATA = 'log_data/{year:04d}/{month:02d}/*.json'
 
-os.environ["AWS_ACCESS_KEY_ID"]= config['AWS']['AWS_ACCESS_KEY_ID']
-os.environ["AWS_SECRET_ACCESS_KEY"]= config['AWS']['AWS_SECRET_ACCESS_KEY']
-os.environ["AWS_REGION"]= config['AWS']['AWS_REGION']
+# Partition columns of the tables written partitioned.
+PARTITION_COLUMNS = {
+    'songs': ['year', 'artist_id'],
+    'time': ['year', 'month'],
+    'songplays': ['year', 'month']
+}
+
+# Approximate size of a row once written to parquet, in bytes, used to cap
+# the rows per file (measured with benchmark.py on generated data).
+ROW_BYTES = {
+    'songs': 40,
+    'artists': 20,
+    'users': 12,
+    'time': 15,
+    'songplays': 12
+}
+
+# Default target size of the output files.
+TARGET_FILE_MB = 128
+
+# Default storage level of the songs and artists kept for the log stage.
+DIMENSION_STORAGE_LEVEL = 'MEMORY_AND_DISK'
+
+# Default storage level of the parsed NextSong events, and the event columns
+# the log tables read.
+EVENTS_STORAGE_LEVEL = 'MEMORY_AND_DISK'
+EVENT_COLUMNS = ['artist', 'firstName', 'gender', 'lastName', 'level', 'location', 'sessionId',
+                 'song', 'ts', 'userAgent', 'userId']
+
+# The song lookup of songplays is broadcast below this estimated size, and
+# bucketed by (artist_name, title) for a sort-merge join above it.
+BROADCAST_THRESHOLD_MB = 64
+LOOKUP_BUCKETS = 16
+LOOKUP_TABLE = 'song_lookup'
+# Temp view of the lookup, apart from the 'song_data' view of the song files.
+LOOKUP_VIEW = 'song_lookup_data'
+# Scratch location of the bucketed lookup, outside the output bucket (relative
+# paths are resolved against the default file system of the cluster).
+LOOKUP_PATH = 'scratch/song_lookup.parquet'
+
+# Physical joins looked for in the plan of songplays.
+JOIN_OPERATORS = ['BroadcastHashJoin', 'SortMergeJoin', 'ShuffledHashJoin',
+                  'BroadcastNestedLoopJoin', 'CartesianProduct']
+
+
+def load_config(path='dl.cfg'):
+    """
+    Reads the config file and exports the AWS credentials for hadoop-aws.
+    
+    INPUT:
+    - path: config file. Default 'dl.cfg'.
+    """
+    config = configparser.ConfigParser()
+    config.read_file(open(path))
+
+    os.environ["AWS_ACCESS_KEY_ID"]= config['AWS']['AWS_ACCESS_KEY_ID']
+    os.environ["AWS_SECRET_ACCESS_KEY"]= config['AWS']['AWS_SECRET_ACCESS_KEY']
+    os.environ["AWS_REGION"]= config['AWS']['AWS_REGION']
+    return config
 
 
 def create_spark_session():
     """
     Creates Spark session.
+    The week-based date patterns of the time table ('w', 'Y') need the
+    legacy time parser on Spark 3. Times are in UTC, as the days of the log
+    files, so the month of an event is the month of its file.
     """
     
     spark = SparkSession \
         .builder \
         .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
+        .config("spark.sql.legacy.timeParserPolicy", "LEGACY") \
+        .config("spark.sql.session.timeZone", "UTC") \
         .getOrCreate()
     print("- Spark session created.")
     return spark
 
 
-def process_song_data(spark, input_data, output_data):
+def write_table(table_df, output_data, table, target_file_mb=TARGET_FILE_MB, dynamic=False):
+    """
+    Writes a table to parquet, partitioned by its PARTITION_COLUMNS.
+    The rows of each partition are gathered in one task, so it is written as
+    one file, split in files of about target_file_mb.
+    
+    INPUT:
+    - table_df: DataFrame of the table
+    - output_data: path to store the output data
+    - table: name of the table. Ex: 'songs'
+    - target_file_mb: target size of the files in MB. Default TARGET_FILE_MB.
+    - dynamic: only replaces the partitions present in table_df. Default False.
+    """
+    columns = PARTITION_COLUMNS.get(table, [])
+    if columns:
+        table_df = table_df.repartition(*columns)
+    writer = table_df.write.option(
+        "maxRecordsPerFile", max(int(target_file_mb * 1024 * 1024 / ROW_BYTES[table]), 1))
+    if dynamic:
+        writer = writer.option("partitionOverwriteMode", "dynamic")
+    if columns:
+        writer = writer.partitionBy(*columns)
+    writer.parquet(output_data + table + ".parquet", mode="overwrite")
+
+
+def months_between(start_date, end_date):
+    """
+    Returns the (year, month) of every month from start_date to end_date.
+    
+    INPUT:
+    - start_date: first day. Ex: '2018-11-01'
+    - end_date: last day. Ex: '2018-11-30'
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def in_months(table_df, months):
+    """
+    Keeps the rows of a table partitioned by year and month that belong to
+    one of the months, so a dynamic overwrite never replaces other months.
+    
+    INPUT:
+    - table_df: DataFrame with year and month columns
+    - months: list of (year, month)
+    """
+    condition = None
+    for year, month in months:
+        in_month = (col("year") == year) & (col("month") == month)
+        condition = in_month if condition is None else condition | in_month
+    return table_df.filter(condition)
+
+
+def merge_users(spark, users_table, output_data, target_file_mb=TARGET_FILE_MB):
+    """
+    Merges users by userId into the users parquet files: the users of
+    users_table replace the stored ones, the other stored users are kept.
+    
+    INPUT:
+    - spark: a Spark session
+    - users_table: DataFrame with one row per new or updated user
+    - output_data: path of the output data
+    - target_file_mb: target size of the output files in MB.
+    """
+    try:
+        stored = spark.read.parquet(output_data + "users.parquet")
+    except AnalysisException:
+        print("- No users stored yet.")
+        write_table(users_table, output_data, "users", target_file_mb)
+        return
+    merged = users_table.unionByName(stored.join(users_table, on="userId", how="left_anti"))
+    # The merge reads the files it replaces: materialize it first.
+    write_table(merged.localCheckpoint(), output_data, "users", target_file_mb)
+
+
+def estimate_size(table_df):
+    """
+    Returns the size in bytes Spark estimates for a DataFrame, from the
+    statistics of its optimized plan (file sizes scaled to the columns read,
+    or the in-memory size of cached data).
+    
+    INPUT:
+    - table_df: DataFrame
+    """
+    return int(str(table_df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes()))
+
+
+def plan_join(table_df):
+    """
+    Returns the first physical join of the plan of a DataFrame (None if
+    there is none).
+    
+    INPUT:
+    - table_df: DataFrame
+    """
+    plan = table_df._jdf.queryExecution().executedPlan().toString()
+    found = [(plan.find(join), join) for join in JOIN_OPERATORS if join in plan]
+    return min(found)[1] if found else None
+
+
+def source_scans(table_df):
+    """
+    Returns the number of scans of JSON files in the physical plan of a
+    DataFrame. Cached data is read through an in-memory scan, not counted.
+    
+    INPUT:
+    - table_df: DataFrame
+    """
+    nodes = [table_df._jdf.queryExecution().executedPlan()]
+    scans = 0
+    while nodes:
+        node = nodes.pop()
+        if node.nodeName() == 'AdaptiveSparkPlan':
+            nodes.append(node.executedPlan())
+            continue
+        if node.nodeName().startswith('Scan json'):
+            scans += 1
+        children = node.children()
+        nodes.extend(children.apply(index) for index in range(children.size()))
+    return scans
+
+
+def prepare_song_lookup(spark, songs_table, artists_table, lookup_path,
+                        threshold_mb=BROADCAST_THRESHOLD_MB, buckets=LOOKUP_BUCKETS):
+    """
+    Creates the temp view LOOKUP_VIEW joined to the events by songplays and
+    returns the join hint to use with it and the strategy metrics.
+    The size of the lookup is estimated from its songs and artists columns
+    (the estimate of the join itself is a product of the two sides). Under
+    threshold_mb it is broadcast. Above it, it is saved as a table bucketed
+    and sorted by (artist_name, title) at lookup_path, so only the events
+    are shuffled by the sort-merge join.
+    
+    INPUT:
+    - spark: a Spark session
+    - songs_table: DataFrame of the songs table
+    - artists_table: DataFrame of the artists table
+    - lookup_path: scratch location of the bucketed lookup table
+    - threshold_mb: largest estimated size broadcast, in MB. Default BROADCAST_THRESHOLD_MB.
+    - buckets: buckets of the lookup table above the threshold. Default LOOKUP_BUCKETS.
+    """
+    songs_table.createOrReplaceTempView("songs_data")
+    artists_table.createOrReplaceTempView("artists_data")
+    
+    song_df = spark.sql("""
+        SELECT s.song_id, s.title, a.artist_id, a.artist_name
+        FROM songs_data AS s
+        JOIN artists_data AS a
+            ON s.artist_id = a.artist_id
+        """)
+    print("- Created songs_table (extended with artist columns).")
+
+    estimated_bytes = estimate_size(songs_table.select("song_id", "title", "artist_id")) + \
+        estimate_size(artists_table.select("artist_id", "artist_name"))
+    metrics = {
+        'estimated_bytes': estimated_bytes,
+        'threshold_bytes': threshold_mb * 1024 * 1024
+    }
+    if estimated_bytes <= metrics['threshold_bytes']:
+        metrics['strategy'] = 'broadcast'
+        song_df.createOrReplaceTempView(LOOKUP_VIEW)
+        hint = "BROADCAST(s)"
+    else:
+        metrics['strategy'] = 'bucketed_sort_merge'
+        metrics['buckets'] = buckets
+        song_df.write \
+            .bucketBy(buckets, "artist_name", "title") \
+            .sortBy("artist_name", "title") \
+            .option("path", lookup_path) \
+            .saveAsTable(LOOKUP_TABLE, format="parquet", mode="overwrite")
+        spark.table(LOOKUP_TABLE).createOrReplaceTempView(LOOKUP_VIEW)
+        hint = "MERGE(s)"
+    print("- Song lookup: ", metrics['strategy'], " (estimated ", estimated_bytes,
+          " bytes, threshold ", metrics['threshold_bytes'], " bytes).", sep='')
+    return hint, metrics
+
+
+def process_song_data(spark, input_data, output_data, song_files=SONG_DATA,
+                      target_file_mb=TARGET_FILE_MB, storage_level=None):
     """
     Process song data file and saves it into a songs and artists parquet files.
+    Returns the songs and artists DataFrames, persisted when storage_level is
+    set so that process_log_data can use them without reading the parquet
+    files back.
     
     INPUT:
     - spark: a Spark session
     - input_data: S3 bucket name to read data from. Ex: 's3a://udacity-dend/'
     - output_data: S3 bucket name to store the output data. Ex: 's3a://sparkify-analytics-with-spark/'
+    - song_files: song files to read, relative to input_data. Default SONG_DATA.
+    - target_file_mb: target size of the output files in MB.
+    - storage_level: StorageLevel of the returned DataFrames. Default None (not persisted).
     """
     
     # get filepath to song data file
-    song_data = input_data +  'song_data/A/A/A/*.json'
+    song_data = input_data + song_files
     
     # read song data file
     song_data_schema = StructType([
@@ -53,7 +310,7 @@ def process_song_data(spark, input_data, output_data):
         StructField("duration", DoubleType(), False),
         StructField("year", IntegerType(), False)
     ])
-    df = spark.read.json(input_data, schema=song_data_schema)
+    df = spark.read.json(song_data, schema=song_data_schema)
     df.createOrReplaceTempView("song_data")
     print("- Imported song_data and saved as a temp view: 'song_data'.")
 
@@ -68,13 +325,12 @@ def process_song_data(spark, input_data, output_data):
         FROM song_data AS s
         WHERE s.song_id IS NOT NULL AND s.artist_id IS NOT NULL
     ''')
+    if storage_level:
+        songs_table = songs_table.persist(storage_level)
     print("- Created songs_table.")
     
     # write songs table to parquet files partitioned by year and artist
-    songs_table.write.parquet(
-        output_data + "songs.parquet",
-        mode="overwrite"
-    )
+    write_table(songs_table, output_data, "songs", target_file_mb)
     print("- Saved parquet file for songs.")
 
     # extract columns to create artists table
@@ -88,28 +344,51 @@ def process_song_data(spark, input_data, output_data):
         FROM song_data AS s
         WHERE s.artist_id IS NOT NULL
     ''')
+    if storage_level:
+        artists_table = artists_table.persist(storage_level)
     print("- Created artists_table.")
     
     # write artists table to parquet files
-    artists_table.write.parquet(
-        output_data + "artists.parquet",
-        mode="overwrite"
-    )
+    write_table(artists_table, output_data, "artists", target_file_mb)
     print("- Saved parquet file for artists.")
+    return songs_table, artists_table
 
 
-def process_log_data(spark, input_data, output_data):
+def process_log_data(spark, input_data, output_data, log_files=LOG_DATA,
+                     target_file_mb=TARGET_FILE_MB, months=None, month_files=LOG_MONTH_DATA,
+                     dimensions=None, broadcast_threshold_mb=BROADCAST_THRESHOLD_MB,
+                     lookup_buckets=LOOKUP_BUCKETS, lookup_path=LOOKUP_PATH,
+                     events_storage_level=getattr(StorageLevel, EVENTS_STORAGE_LEVEL)):
     """
     Process log data file and saves it into a users, time and songplays parquet files.
+    The JSON files are parsed once: the NextSong events, with the columns of
+    the three tables, are persisted and every table is derived from them.
+    Returns the metrics of the run: the songplays join (see
+    prepare_song_lookup) and the number of scans of the JSON files.
+    With months, only the log files of these months are read, only their
+    time and songplays partitions are replaced and users are merged by key.
     
     INPUT:
     - spark: a Spark session
     - input_data: S3 bucket name to read data from. Ex: 's3a://udacity-dend/'
     - output_data: S3 bucket name to store the output data. Ex: 's3a://sparkify-analytics-with-spark/'
+    - log_files: log files to read, relative to input_data. Default LOG_DATA.
+    - target_file_mb: target size of the output files in MB.
+    - months: list of (year, month) to process incrementally. Default None (full run).
+    - month_files: log files of a month, relative to input_data. Default LOG_MONTH_DATA.
+    - dimensions: (songs, artists) DataFrames returned by process_song_data. Default None (read from output_data).
+    - broadcast_threshold_mb: largest song lookup broadcast, in MB. Default BROADCAST_THRESHOLD_MB.
+    - lookup_buckets: buckets of the song lookup when it is not broadcast. Default LOOKUP_BUCKETS.
+    - lookup_path: scratch location of the song lookup when it is not broadcast. Default LOOKUP_PATH.
+    - events_storage_level: StorageLevel of the parsed events. Default EVENTS_STORAGE_LEVEL.
     """
     
     # get filepath to log data file
-    log_data = input_data + 'log_data/2018/11/2018-11-01-events.json'
+    if months:
+        log_data = [input_data + month_files.format(year=year, month=month)
+                    for year, month in months]
+    else:
+        log_data = input_data + log_files
 
     # read log data file
     log_data_schema = StructType([
@@ -130,30 +409,35 @@ def process_log_data(spark, input_data, output_data):
         StructField("userId", StringType(), True)
     ])
     df = spark.read.json(log_data, schema=log_data_schema)
-    df.createOrReplaceTempView("event_data")
-    print("- Imported log_data and saved as a temp view: 'event_data'.")
     
-    # filter by actions for song plays
-    df = df.filter(col("page") == "NextSong")
+    # filter by actions for song plays and keep the parsed events for the three tables
+    df = df.filter(col("page") == "NextSong").select(*EVENT_COLUMNS)
+    scans = source_scans(df)
+    df = df.persist(events_storage_level)
+    df.createOrReplaceTempView("event_data")
+    print("- Imported log_data (NextSong events) and saved as a temp view: 'event_data'.")
 
-    # extract columns for users table    
+    # extract columns for users table: one row per user, from their latest
+    # event, so a user whose level changed is not stored twice
     users_table = spark.sql('''
-        SELECT DISTINCT
-            e.userId,
-            e.firstName,
-            e.lastName,
-            e.gender,
-            e.level
-        FROM event_data AS e
-        WHERE e.userId IS NOT NULL
+        SELECT userId, firstName, lastName, gender, level
+        FROM (
+            SELECT
+                e.*,
+                ROW_NUMBER() OVER (PARTITION BY e.userId ORDER BY e.ts DESC) AS position
+            FROM event_data AS e
+            WHERE e.userId IS NOT NULL
+        ) AS latest
+        WHERE position = 1
     ''')
+    scans += source_scans(users_table)
     print("- Created users_table.")
     
-    # write users table to parquet files
-    users_table.write.parquet(
-        output_data + "users.parquet",
-        mode="overwrite"
-    )
+    # write users table to parquet files, merged with the stored users in incremental runs
+    if months:
+        merge_users(spark, users_table, output_data, target_file_mb)
+    else:
+        write_table(users_table, output_data, "users", target_file_mb)
     print("- Saved parquet file for users.")
 
     # extract columns to create time table
@@ -164,41 +448,34 @@ def process_log_data(spark, input_data, output_data):
             CAST(DATE_FORMAT(FROM_UNIXTIME(e.ts/1000), 'd') as int) AS day,
             CAST(DATE_FORMAT(FROM_UNIXTIME(e.ts/1000), 'w') as int) AS week,
             CAST(DATE_FORMAT(FROM_UNIXTIME(e.ts/1000), 'M') as int) AS month,
-            CAST(DATE_FORMAT(FROM_UNIXTIME(e.ts/1000), 'Y') as int) AS year,
+            CAST(DATE_FORMAT(FROM_UNIXTIME(e.ts/1000), 'y') as int) AS year,
             CAST(DATE_FORMAT(FROM_UNIXTIME(e.ts/1000), 'EEEE') as string) AS weekday,
             FROM_UNIXTIME(e.ts/1000) AS full_time
         FROM event_data AS e
         WHERE e.ts IS NOT NULL   
     ''')
+    scans += source_scans(time_table)
     print("- Created time_table.")
     
     # write time table to parquet files partitioned by year and month
-    time_table.write.parquet(
-        output_data + "time.parquet",
-        mode="overwrite"
-    )
+    if months:
+        time_table = in_months(time_table, months)
+    write_table(time_table, output_data, "time", target_file_mb, dynamic=bool(months))
     print("- Saved parquet file for time.")
 
-    # read in song data to use for songplays table
-    songs_table = spark.read.parquet(output_data + "songs.parquet")
-    artists_table = spark.read.parquet(output_data + "artists.parquet")
-    
-    songs_table.createOrReplaceTempView("songs_data")
-    artists_table.createOrReplaceTempView("artists_data")
-    
-    song_df = spark.sql("""
-        SELECT s.song_id, s.title, a.artist_id, a.artist_name
-        FROM songs_data AS s
-        JOIN artists_data AS a
-            ON s.artist_id = a.artist_id
-        """)
-    print("- Created songs_table (extended with artist columns).")
-    
-    song_df.createOrReplaceTempView("song_data") 
+    # read in song data to use for songplays table, unless process_song_data just computed it
+    if dimensions:
+        songs_table, artists_table = dimensions
+        print("- Using songs and artists from process_song_data.")
+    else:
+        songs_table = spark.read.parquet(output_data + "songs.parquet")
+        artists_table = spark.read.parquet(output_data + "artists.parquet")
+    hint, metrics = prepare_song_lookup(spark, songs_table, artists_table, lookup_path,
+                                        broadcast_threshold_mb, lookup_buckets)
 
     # extract columns from joined song and log datasets to create songplays table 
     songplays_table = spark.sql('''
-        SELECT
+        SELECT /*+ {} */
             e.ts,
             e.userId,
             e.level,
@@ -206,35 +483,70 @@ def process_log_data(spark, input_data, output_data):
             s.artist_id,
             e.sessionId,
             e.location,
-            e.userAgent
+            e.userAgent,
+            YEAR(FROM_UNIXTIME(e.ts/1000)) AS year,
+            MONTH(FROM_UNIXTIME(e.ts/1000)) AS month
         FROM event_data AS e
-        LEFT JOIN song_data AS s
+        LEFT JOIN {} AS s
             ON (e.artist = s.artist_name AND e.song = s.title)
-        WHERE e.page = 'NextSong' AND s.title IS NOT NULL
-    ''')
-    print("- Created songplays_table.")
+        WHERE s.title IS NOT NULL
+    '''.format(hint, LOOKUP_VIEW))
+    scans += source_scans(songplays_table)
+    metrics['plan_join'] = plan_join(songplays_table)
+    print("- Created songplays_table (", metrics['plan_join'], ").", sep='')
 
     # write songplays table to parquet files partitioned by year and month
-    songplays_table.write.parquet(
-        output_data + "songplays.parquet",
-        mode="overwrite"
-    )
+    if months:
+        songplays_table = in_months(songplays_table, months)
+    write_table(songplays_table, output_data, "songplays", target_file_mb, dynamic=bool(months))
     print("- Saved parquet file for songplays.")
+    df.unpersist()
+    print("- Scans of log_data:", scans)
+    return {'songplays_join': metrics, 'source_scans': scans}
 
 
 def main():
     """
     Main function to run the ETL.
+    Usage: python3 etl.py [<start_date> <end_date>]
+    With a date range, only the log_data of its months is processed
+    (song_data is not processed again).
     """
     
+    config = load_config()
     spark = create_spark_session()
     input_data = "s3a://udacity-dend/"
     output_data = "s3a://sparkify-analytics-with-spark/"
+    target_file_mb = config.getint('ETL', 'TARGET_FILE_MB', fallback=TARGET_FILE_MB)
+    log_options = {
+        'broadcast_threshold_mb': config.getint(
+            'ETL', 'BROADCAST_THRESHOLD_MB', fallback=BROADCAST_THRESHOLD_MB),
+        'lookup_buckets': config.getint('ETL', 'LOOKUP_BUCKETS', fallback=LOOKUP_BUCKETS),
+        'lookup_path': config.get('ETL', 'LOOKUP_PATH', fallback=LOOKUP_PATH),
+        'events_storage_level': getattr(StorageLevel, config.get(
+            'ETL', 'EVENTS_STORAGE_LEVEL', fallback=EVENTS_STORAGE_LEVEL))
+    }
     
-    process_song_data(spark, input_data, output_data)
+    if len(sys.argv) == 3:
+        months = months_between(sys.argv[1], sys.argv[2])
+        print("- Incremental run of", len(months), "month(s):",
+              ", ".join("{}-{:02d}".format(year, month) for year, month in months))
+        process_log_data(spark, input_data, output_data, target_file_mb=target_file_mb,
+                         months=months, **log_options)
+        print("- Finished processing log_data.")
+        print("- SUCCESSFULLY finished ETL.")
+        return
+
+    storage_level = getattr(StorageLevel, config.get(
+        'ETL', 'DIMENSION_STORAGE_LEVEL', fallback=DIMENSION_STORAGE_LEVEL))
+    dimensions = process_song_data(spark, input_data, output_data, target_file_mb=target_file_mb,
+                                   storage_level=storage_level)
     print("- Finished processing song_data.")
-    process_log_data(spark, input_data, output_data)
+    process_log_data(spark, input_data, output_data, target_file_mb=target_file_mb,
+                     dimensions=dimensions, **log_options)
     print("- Finished processing log_data.")
+    for dimension in dimensions:
+        dimension.unpersist()
     print("- SUCCESSFULLY finished ETL.")
 
 